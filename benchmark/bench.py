@@ -0,0 +1,272 @@
+#!/usr/bin/python
+""" Per-stage benchmark of etoro_edavki on synthetic (or given) statements.
+
+    python benchmark/bench.py -n 100000                  # generate a statement and time every stage
+    python benchmark/bench.py -n 100000 --json base.json # store the results ...
+    python benchmark/bench.py -n 100000 --compare base.json  # ... and compare a later run against them
+"""
+
+import argparse
+import datetime
+import gc
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from collections import namedtuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import etoro_edavki as ee
+import generate_statement
+
+TAXPAYER = {"taxNumber": "12345678", "taxpayerType": "FO"}
+
+Stage = namedtuple("Stage", ["name", "run"])  # run(context) -> number of processed rows
+
+def read_sheets(context, sheet, cache=None):
+    rows = []
+    for filename in context["statements"]:
+        rows.append(list(getattr(ee.EToroStatement(filename, cache), sheet)()))
+    context[sheet + "_rows"] = rows
+    return sum(len(sheetRows) for sheetRows in rows)
+
+def read_cached(context):
+    cache = ee.StatementCache(os.path.join(context["workdir"], "cache"), max_size=1024 * 1024)
+    return sum(read_sheets(dict(context), sheet, cache) for sheet in ("closed_positions", "transactions", "dividends"))
+
+def merge_overlapping(context):
+    """ Merges the statements with a copy of themselves, i.e. fully overlapping exports """
+    statements = ee.Statements(context["closed_positions_rows"] * 2, context["transactions_rows"] * 2, context["dividends_rows"] * 2)
+    merged = ee.merge_statements(statements)
+    for sheets in merged:
+        for sheet in sheets:
+            for row in sheet:
+                pass
+    return sum(len(sheet) for sheets in statements for sheet in sheets)
+
+def load_rates_xml(context):
+    context["rates"] = ee.load_exchange_rates(context["rates_source"], store=None)
+    context["rates"].save(os.path.join(context["workdir"], "bsrate.bin"))
+    return sum(len(context["rates"].calendar(currency)[1]) for currency in context["rates"].currencies())
+
+def load_rates_store(context):
+    rates = ee.ExchangeRateTable.load(os.path.join(context["workdir"], "bsrate.bin"))
+    return sum(len(rates.calendar(currency)[1]) for currency in rates.currencies())
+
+def load_company_index(context):
+    context["companies"] = ee.CompanyIndex.read(context["company_info"])
+    return len(context["companies"].bySymbol)
+
+def map_symbols(context):
+    context["symbols"] = ee.get_position_symbols(context["transactions_rows"])
+    return sum(len(sheetRows) for sheetRows in context["transactions_rows"])
+
+def normalize_positions(context):
+    context["positions"] = ee.normalize_positions(context["closed_positions_rows"], context["symbols"], context["years"], context["rates"])
+    return sum(len(sheetRows) for sheetRows in context["closed_positions_rows"])
+
+def normalize_dividends(context):
+    context["dividends"], missing_info = ee.normalize_dividends(context["dividends_rows"], context["symbols"], context["years"],
+                                                                context["rates"], context["companies"])
+    return sum(len(sheetRows) for sheetRows in context["dividends_rows"])
+
+def write_normalized(context):
+    normalized = ee.NormalizedStatements(context["positions"], context["dividends"], [])
+    ee.write_normalized_file(os.path.join(context["workdir"], "normalized.bin"), normalized, context["years"])
+    return len(context["positions"]) + len(context["dividends"])
+
+def read_normalized(context):
+    normalized, years = ee.read_normalized_file(os.path.join(context["workdir"], "normalized.bin"))
+    return len(normalized.positions) + len(normalized.dividends)
+
+def classify(context):
+    normalized = ee.NormalizedStatements(context["positions"], context["dividends"], [])
+    context["reports"] = ee.classify_reports(normalized, context["years"], outputDirectory=os.path.join(context["workdir"], "output"))
+    for report in context["reports"].values():
+        os.makedirs(report.directory, exist_ok=True)
+        report.fragmentCache = ee.StatementCache(os.path.join(context["workdir"], "fragments"), max_size=1024 * 1024)
+    return len(context["positions"]) + len(context["dividends"])
+
+def trade_count(*tradeGroups):
+    return sum(len(trades) for groups in tradeGroups for trades in groups.values())
+
+def render(writer, filename, arguments, count):
+    """ Stage running one output writer for every report year """
+    def run(context):
+        rows = 0
+        for report in context["reports"].values():
+            writer(os.path.join(report.directory, filename.format(report.year)), *arguments(report))
+            rows += count(report)
+        return rows
+    return run
+
+STAGES = [
+    Stage("read closed positions", lambda context: read_sheets(context, "closed_positions")),
+    Stage("read account activity", lambda context: read_sheets(context, "transactions")),
+    Stage("read dividends", lambda context: read_sheets(context, "dividends")),
+    Stage("read (cache miss)", read_cached),
+    Stage("read (cache hit)", read_cached),
+    Stage("merge overlapping (2x)", merge_overlapping),
+    Stage("rates (BSI XML)", load_rates_xml),
+    Stage("rates (binary store)", load_rates_store),
+    Stage("company index", load_company_index),
+    Stage("symbol mapping", map_symbols),
+    Stage("normalize positions", normalize_positions),
+    Stage("normalize dividends", normalize_dividends),
+    Stage("normalized file (write)", write_normalized),
+    Stage("normalized file (read)", read_normalized),
+    Stage("group and sort", classify),
+    Stage("write Doh-KDVP", render(ee.write_doh_kdvp, "Doh-KDVP.xml",
+                                   lambda r: (TAXPAYER, r.year, False, r.longNormalTrades, r.shortNormalTrades),
+                                   lambda r: trade_count(r.longNormalTrades, r.shortNormalTrades))),
+    Stage("write Doh-KDVP (fragment miss)", render(ee.write_doh_kdvp, "Doh-KDVP-fragments.xml",
+                                                   lambda r: (TAXPAYER, r.year, False, r.longNormalTrades, r.shortNormalTrades, r.fragmentCache),
+                                                   lambda r: trade_count(r.longNormalTrades, r.shortNormalTrades))),
+    Stage("write Doh-KDVP (fragment hit)", render(ee.write_doh_kdvp, "Doh-KDVP-fragments.xml",
+                                                  lambda r: (TAXPAYER, r.year, False, r.longNormalTrades, r.shortNormalTrades, r.fragmentCache),
+                                                  lambda r: trade_count(r.longNormalTrades, r.shortNormalTrades))),
+    Stage("write D-IFI", render(ee.write_d_ifi, "D-IFI.xml",
+                                lambda r: (TAXPAYER, r.year, False, r.longDerivateTrades, r.shortDerivateTrades),
+                                lambda r: trade_count(r.longDerivateTrades, r.shortDerivateTrades))),
+    Stage("write Doh-Div", render(ee.write_doh_div, "Doh-Div.xml",
+                                  lambda r: (TAXPAYER, r.year, False, r.dividends),
+                                  lambda r: len(r.dividends))),
+    Stage("write Debug xlsx", render(ee.write_debug_workbook, "Debug-{0}.xlsx",
+                                     lambda r: (r.longNormalTrades, r.longDerivateTrades, r.shortDerivateTrades, r.skippedCryptoTrades),
+                                     lambda r: trade_count(r.longNormalTrades, r.longDerivateTrades, r.shortDerivateTrades, r.skippedCryptoTrades))),
+    Stage("write Dividende-info xlsx", render(ee.write_dividends_info, "Dividende-info-{0}.xlsx",
+                                              lambda r: (r.dividends,),
+                                              lambda r: len(r.dividends))),
+    Stage("write Debug csv", render(ee.write_debug_csv, "Debug-{0}.csv",
+                                    lambda r: (r.longNormalTrades, r.longDerivateTrades, r.shortDerivateTrades, r.skippedCryptoTrades),
+                                    lambda r: trade_count(r.longNormalTrades, r.longDerivateTrades, r.shortDerivateTrades, r.skippedCryptoTrades))),
+    Stage("write Dividende-info csv", render(ee.write_dividends_info_csv, "Dividende-info-{0}.csv",
+                                             lambda r: (r.dividends,),
+                                             lambda r: len(r.dividends))),
+]
+
+def run_stages(context, memory=False):
+    """ Runs all stages in order; returns {stage: (wall s, cpu s, rows, peak MB or None)} """
+    results = {}
+    for stage in STAGES:
+        gc.collect()
+        if memory:
+            tracemalloc.start()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        rows = stage.run(context)
+        cpu = time.process_time() - cpu
+        wall = time.perf_counter() - wall
+        peak = None
+        if memory:
+            peak = tracemalloc.get_traced_memory()[1] / (1024 * 1024)  # allocated by this stage only
+            tracemalloc.stop()
+        results[stage.name] = (wall, cpu, rows, peak)
+    return results
+
+def benchmark(statements, ratesSource, companyInfo, years, repeat=1, memory=True):
+    results = {}
+    for i in range(repeat):
+        with tempfile.TemporaryDirectory(prefix="etoro-edavki-bench-") as workdir:
+            context = {"statements": statements, "rates_source": ratesSource, "company_info": companyInfo,
+                       "years": set(years), "workdir": workdir}
+            for name, (wall, cpu, rows, peak) in run_stages(context).items():
+                if name not in results or wall < results[name]["wall"]:
+                    results[name] = {"wall": wall, "cpu": cpu, "rows": rows, "rows_per_s": rows / wall if wall > 0 else None, "peak_mb": None}
+
+    if memory:
+        """ Separate pass, tracing allocations slows the stages down too much to time them at the same time """
+        with tempfile.TemporaryDirectory(prefix="etoro-edavki-bench-") as workdir:
+            context = {"statements": statements, "rates_source": ratesSource, "company_info": companyInfo,
+                       "years": set(years), "workdir": workdir}
+            for name, (wall, cpu, rows, peak) in run_stages(context, memory=True).items():
+                results[name]["peak_mb"] = peak
+    return results
+
+def print_results(results, baseline=None, threshold=0.2, noise=0.05):
+    """ Prints the results table; returns names of stages slower than baseline by more than threshold
+        (and by more than noise seconds, timings of very short stages vary too much to compare them) """
+    regressions = []
+    header = "{0:<32} {1:>9} {2:>9} {3:>10} {4:>12} {5:>9}".format("stage", "wall [s]", "cpu [s]", "rows", "rows/s", "peak [MB]")
+    if baseline is not None:
+        header += " {0:>10}".format("vs. base")
+    print(header)
+    print("-" * len(header))
+    for name, result in results.items():
+        line = "{0:<32} {1:>9.3f} {2:>9.3f} {3:>10} {4:>12} {5:>9}".format(
+            name, result["wall"], result["cpu"], result["rows"],
+            "{0:.0f}".format(result["rows_per_s"]) if result["rows_per_s"] else "-",
+            "{0:.1f}".format(result["peak_mb"]) if result["peak_mb"] is not None else "-")
+        if baseline is not None and name in baseline and baseline[name]["wall"] > 0:
+            ratio = result["wall"] / baseline[name]["wall"]
+            line += " {0:>9.2f}x".format(ratio)
+            if ratio > 1 + threshold and result["wall"] - baseline[name]["wall"] > noise:
+                line += " !"
+                regressions.append(name)
+        print(line)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-stage benchmark of etoro_edavki")
+    parser.add_argument("statements", metavar="statement.xlsx", nargs="*", help="statements to use instead of a generated one")
+    parser.add_argument("-n", "--positions", type=int, default=10000, help="positions of the generated statement (default 10000)")
+    parser.add_argument("-l", "--locale", choices=sorted(generate_statement.DATETIME_FORMATS), default="en")
+    parser.add_argument("--start-year", type=int, default=datetime.date.today().year - 4)
+    parser.add_argument("--years", type=int, default=4, help="years covered by the generated statement (default 4)")
+    parser.add_argument("-y", "--report-years", type=ee.parse_report_years, help="report years (default all generated years)")
+    parser.add_argument("--rates-source", help="BSI rate file (generated by default)")
+    parser.add_argument("--company-info", default="Company_info.xlsx")
+    parser.add_argument("--repeat", type=int, default=1, help="run the timing pass N times and keep the fastest run of each stage")
+    parser.add_argument("--no-memory", action="store_true", help="skip the (slow) peak memory pass")
+    parser.add_argument("--json", metavar="FILE", help="write the results as JSON")
+    parser.add_argument("--compare", metavar="FILE", help="compare with results written by --json; exits with 1 on regressions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="relative slowdown reported as a regression (default 0.2)")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="etoro-edavki-data-") as datadir:
+        statements = args.statements
+        ratesSource = args.rates_source
+        years = args.report_years or list(range(args.start_year, args.start_year + args.years))
+        if not statements:
+            statements = [os.path.join(datadir, "statement.xlsx")]
+            instruments = generate_statement.load_instruments(args.company_info)
+            started = time.perf_counter()
+            counts = generate_statement.generate_statement(statements[0], args.positions, args.locale,
+                                                           startYear=args.start_year, years=args.years, instruments=instruments)
+            print("Generated {0} closed positions, {1} account activity rows, {2} dividends in {3:.1f} s\n".format(
+                *counts, time.perf_counter() - started))
+        if ratesSource is None:
+            ratesSource = os.path.join(datadir, "rates.xml")
+            generate_statement.generate_rates(ratesSource, datetime.date(min(args.start_year, min(years)) - 1, 12, 1),
+                                              datetime.date(max(args.start_year + args.years - 1, max(years)) + 1, 1, 31))
+
+        results = benchmark(statements, ratesSource, args.company_info, years, args.repeat, not args.no_memory)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)["stages"]
+    regressions = print_results(results, baseline, args.threshold)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({
+                "created": datetime.datetime.now().isoformat(timespec="seconds"),
+                "python": platform.python_version(),
+                "statements": [os.path.basename(statement) for statement in args.statements] or None,
+                "positions": None if args.statements else args.positions,
+                "locale": None if args.statements else args.locale,
+                "years": sorted(years),
+                "stages": results,
+            }, f, indent=2)
+
+    if regressions:
+        print("\nSlower than baseline: " + ", ".join(regressions))
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+#!/usr/bin/python
+""" Synthetic eToro account statements and a matching BSI exchange rate file for benchmarking etoro_edavki.
+
+    python benchmark/generate_statement.py -n 100000 -l sl -o statement.xlsx --rates rates.xml
+"""
+
+import argparse
+import datetime
+import heapq
+import itertools
+import os
+import random
+import tempfile
+import zipfile
+from xml.sax.saxutils import escape
+
+from openpyxl import load_workbook
+
+# current (2025.11) sheet layouts
+CLOSED_POSITIONS_HEADERS = [
+    "Position ID", "Action", "Long / Short", "Amount", "Units / Contracts", "Open Date", "Close Date", "Leverage",
+    "Spread Fees (USD)", "Market Spread (USD)", "Profit(USD)", "Profit(EUR)", "FX rate at open (USD)",
+    "FX rate at close (USD)", "Open Rate", "Close Rate", "Take profit rate", "Stop loss rate",
+    "Overnight Fees and Dividends", "Copied From", "Type", "ISIN", "Notes"
+]
+ACCOUNT_ACTIVITY_HEADERS = [
+    "Date", "Type", "Details", "Amount", "Units / Contracts", "Realized Equity Change", "Realized Equity", "Balance",
+    "Position ID", "Asset type", "NWA"
+]
+DIVIDENDS_HEADERS = [
+    "Date of Payment", "Instrument Name", "Net Dividend Received (USD)", "Net dividends", "Currency",
+    "Franked/Unfranked", "Franking Credits (AUD)", "Net Dividend Received (EUR)", "Withholding Tax Rate (%)",
+    "Withholding Tax Amount (USD)", "Withholding Tax Amount (EUR)", "Position ID", "Type", "ISIN"
+]
+
+# instruments that are not in Company_info.xlsx: (symbol, name, type, ISIN)
+OTHER_INSTRUMENTS = [
+    ("SPY", "SPDR S&P 500 ETF Trust", "ETF", "US78462F1030"),
+    ("QQQ", "Invesco QQQ Trust", "ETF", "US46090E1038"),
+    ("VOO", "Vanguard S&P 500 ETF", "ETF", "US9229083632"),
+    ("BTC", "Bitcoin", "Crypto", ""),
+    ("ETH", "Ethereum", "Crypto", ""),
+    ("ADA", "Cardano", "Crypto", ""),
+    ("XRP", "Ripple", "Crypto", ""),
+    ("EURUSD", "EUR/USD", "CFD", ""),
+    ("GBPUSD", "GBP/USD", "CFD", ""),
+    ("GOLD", "Gold", "CFD", ""),
+    ("OIL", "Oil", "CFD", ""),
+    ("SPX500", "SPX500", "CFD", ""),
+]
+
+DATETIME_FORMATS = {"en": "%d/%m/%Y %H:%M:%S", "sl": "%d.%m.%Y %H:%M:%S"}
+
+def load_instruments(companyInfoFilename=None, stocks=200, seed=0):
+    """ Stocks from Company_info.xlsx (or invented ones when it is not available) plus ETFs, crypto and CFDs """
+    instruments = []
+    if companyInfoFilename and os.path.isfile(companyInfoFilename):
+        wb = load_workbook(companyInfoFilename, read_only=True)
+        rows = wb["Info"].iter_rows(min_row=2, values_only=True)
+        for symbol, isin, name, address, country in rows:
+            if symbol and name and "." not in symbol:
+                instruments.append((symbol, name, "Stocks", isin or ""))
+        wb.close()
+    rnd = random.Random(seed)
+    rnd.shuffle(instruments)
+    instruments = instruments[:stocks]
+    for i in range(len(instruments), stocks):
+        instruments.append(("SYN{0}".format(i), "Synthetic Company {0} Inc".format(i), "Stocks", "US{0:010d}".format(i)))
+    return instruments + OTHER_INSTRUMENTS
+
+class XlsxWriter:
+    """ Minimal streaming XLSX writer (inline strings, numeric cells); much faster than openpyxl for millions of rows.
+        Every sheet is buffered in its own temporary file, so rows can be appended to the sheets in any order. """
+    CONTENT_TYPES = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '{0}</Types>'
+    )
+    SHEET_CONTENT_TYPE = '<Override PartName="/xl/worksheets/sheet{0}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+    ROOT_RELS = (
+        '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+        '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+        '<Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    )
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.sheets = []  # [title, temporary file, next row number]
+        self.columns = [self._column(i) for i in range(64)]
+
+    @staticmethod
+    def _column(index):
+        name = ""
+        index += 1
+        while index:
+            index, remainder = divmod(index - 1, 26)
+            name = chr(65 + remainder) + name
+        return name
+
+    def create_sheet(self, title):
+        sheet = [title, tempfile.TemporaryFile("w+", encoding="utf-8"), 1]
+        self.sheets.append(sheet)
+        return sheet
+
+    def append(self, sheet, values):
+        row = sheet[2]
+        sheet[2] = row + 1
+        cells = []
+        for column, value in zip(self.columns, values):
+            if value is None or value == "":
+                continue
+            if isinstance(value, str):
+                cells.append('<c r="{0}{1}" t="inlineStr"><is><t>{2}</t></is></c>'.format(column, row, escape(value)))
+            else:
+                cells.append('<c r="{0}{1}"><v>{2}</v></c>'.format(column, row, value))
+        sheet[1].write('<row r="{0}">{1}</row>'.format(row, "".join(cells)))
+
+    def save(self):
+        with zipfile.ZipFile(self.filename, "w", zipfile.ZIP_DEFLATED) as archive:
+            archive.writestr("[Content_Types].xml", self.CONTENT_TYPES.format(
+                "".join(self.SHEET_CONTENT_TYPE.format(i + 1) for i in range(len(self.sheets)))))
+            archive.writestr("_rels/.rels", self.ROOT_RELS)
+            archive.writestr("xl/workbook.xml",
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<workbook xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main" '
+                'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships"><sheets>' +
+                "".join('<sheet name="{0}" sheetId="{1}" r:id="rId{1}"/>'.format(escape(sheet[0]), i + 1) for i, sheet in enumerate(self.sheets)) +
+                '</sheets></workbook>')
+            archive.writestr("xl/_rels/workbook.xml.rels",
+                '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">' +
+                "".join('<Relationship Id="rId{0}" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" '
+                        'Target="worksheets/sheet{0}.xml"/>'.format(i + 1) for i in range(len(self.sheets))) +
+                '</Relationships>')
+            for i, (title, buffer, rows) in enumerate(self.sheets):
+                buffer.seek(0)
+                with archive.open("xl/worksheets/sheet{0}.xml".format(i + 1), "w") as part:
+                    part.write(b'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+                               b'<worksheet xmlns="http://schemas.openxmlformats.org/spreadsheetml/2006/main"><sheetData>')
+                    for block in iter(lambda: buffer.read(1024 * 1024), ""):
+                        part.write(block.encode("utf-8"))
+                    part.write(b'</sheetData></worksheet>')
+                buffer.close()
+
+def generate_statement(filename, positions, locale="en", seed=1, startYear=2021, years=4, instruments=None,
+                       dividendRatio=0.3, firstPositionId=1000000000):
+    """ Writes a statement with the given number of positions; returns (closed positions, activity rows, dividends).
+        Positions are opened in date order and pending closes and dividends wait in heaps, so all three sheets are
+        streamed in date order without holding the statement in memory. """
+    rnd = random.Random(seed)
+    dateFormat = DATETIME_FORMATS[locale]
+    if locale == "sl":
+        number = lambda value: "{0:.2f}".format(value).replace(".", ",")
+    else:
+        number = lambda value: round(value, 2)
+    if instruments is None:
+        instruments = load_instruments()
+
+    start = datetime.datetime(startYear, 1, 1, 8, 0, 0)
+    end = datetime.datetime(startYear + years, 1, 1)
+    step = (end - start).total_seconds() * 0.9 / max(1, positions)  # average gap between two opened positions
+    weights = [10 if instrument[2] == "Stocks" else 3 for instrument in instruments]
+    cumulativeWeights = list(itertools.accumulate(weights))
+
+    wb = XlsxWriter(filename)
+    closedSheet = wb.create_sheet("Closed Positions")
+    wb.append(closedSheet, CLOSED_POSITIONS_HEADERS)
+    activitySheet = wb.create_sheet("Account Activity")
+    wb.append(activitySheet, ACCOUNT_ACTIVITY_HEADERS)
+    dividendsSheet = wb.create_sheet("Dividends")
+    wb.append(dividendsSheet, DIVIDENDS_HEADERS)
+    counts = [0, 0, 0]
+
+    pendingCloses = []  # (close date, position ID, row values)
+    pendingDividends = []  # (payment date, position ID, row values)
+
+    def flush(until):
+        while pendingCloses and pendingCloses[0][0] <= until:
+            closeDate, positionId, (action, longShort, amount, units, openDate, leverage, profit, details, ifiType, isin) = heapq.heappop(pendingCloses)
+            wb.append(closedSheet, [
+                str(positionId), action, longShort, number(amount), number(units), openDate.strftime(dateFormat),
+                closeDate.strftime(dateFormat), str(leverage), number(0), number(amount * 0.001), number(profit),
+                number(profit * 0.92), number(1.08), number(1.09), number(amount / units), number((amount + profit) / units),
+                number(0), number(0), number(-amount * 0.0005), "", ifiType, isin, ""
+            ])
+            wb.append(activitySheet, [
+                closeDate.strftime(dateFormat), "Position closed", details, number(amount + profit), number(units),
+                number(profit), number(0), number(0), str(positionId), ifiType, number(0)
+            ])
+            counts[0] += 1
+            counts[1] += 1
+        while pendingDividends and pendingDividends[0][0] <= until:
+            paymentDate, positionId, (name, net, taxRate, ifiType, isin) = heapq.heappop(pendingDividends)
+            tax = net * taxRate / (100 - taxRate)
+            wb.append(dividendsSheet, [
+                paymentDate.strftime(dateFormat), name, number(net), number(net), "USD", "", "", number(net * 0.92),
+                "{0} %".format(taxRate), number(tax), number(tax * 0.92), str(positionId), ifiType, isin
+            ])
+            counts[2] += 1
+
+    openDate = start
+    for i in range(positions):
+        positionId = firstPositionId + i
+        openDate += datetime.timedelta(seconds=rnd.expovariate(1.0 / step))
+        flush(openDate)
+
+        symbol, name, ifiType, isin = rnd.choices(instruments, cum_weights=cumulativeWeights)[0]
+        if ifiType == "CFD":
+            leverage = rnd.choice([1, 2, 5, 10, 20])
+            longShort = rnd.choice(["Long", "Short"])
+        else:
+            leverage = 1
+            longShort = "Long"
+        amount = rnd.uniform(10, 5000)
+        units = amount * leverage / rnd.uniform(1, 500)
+        profit = amount * rnd.uniform(-0.5, 0.8)
+        details = name if ifiType == "CFD" and "/" in name else "{0}/USD".format(symbol)
+        action = "{0} {1}".format("Buy" if longShort == "Long" else "Sell", name)
+        closeDate = openDate + datetime.timedelta(days=rnd.randrange(0, 400), seconds=rnd.randrange(60, 3600))
+
+        wb.append(activitySheet, [
+            openDate.strftime(dateFormat), "Open Position", details, number(amount), number(units), number(0), number(0),
+            number(0), str(positionId), ifiType, number(0)
+        ])
+        counts[1] += 1
+        if closeDate < end:
+            heapq.heappush(pendingCloses, (closeDate, positionId, (action, longShort, amount, units, openDate, leverage, profit, details, ifiType, isin)))
+
+        if ifiType in ("Stocks", "ETF") and rnd.random() < dividendRatio:
+            paymentDate = openDate.replace(hour=0, minute=0, second=0)
+            for k in range(rnd.randint(1, 4)):
+                paymentDate += datetime.timedelta(days=rnd.randrange(1, 120))
+                if paymentDate >= min(closeDate, end):
+                    break
+                net = rnd.uniform(-0.2, 3) if rnd.random() < 0.05 else rnd.uniform(0.01, 25)
+                taxRate = rnd.choice([0, 15, 15, 15, 30])
+                heapq.heappush(pendingDividends, (paymentDate, positionId, (name, net, taxRate, ifiType, isin)))
+
+    flush(end)
+    wb.save()
+    return tuple(counts)
+
+def generate_rates(filename, since, until, seed=1):
+    """ Writes a BSI daily rate list (dtecbs-l.xml layout) with random-walk rates for working days """
+    rnd = random.Random(seed)
+    rates = {"USD": 1.10, "GBP": 0.86, "CHF": 1.05, "JPY": 130.0}
+    day = since
+    with open(filename, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<DtecBS xmlns="http://www.bsi.si" xmlns:xsi="http://www.w3.org/2001/XMLSchema-instance" '
+                'xsi:schemaLocation="http://www.bsi.si http://www.bsi.si/_data/tecajnice/DtecBS-l.xsd">\n')
+        while day <= until:
+            if day.weekday() < 5:
+                f.write('<tecajnica datum="{0}">'.format(day.isoformat()))
+                for currency in rates:
+                    rates[currency] *= 1 + rnd.uniform(-0.004, 0.004)
+                    f.write('<tecaj oznaka="{0}" sifra="000">{1:.4f}</tecaj>'.format(currency, rates[currency]))
+                f.write('</tecajnica>\n')
+            day += datetime.timedelta(days=1)
+        f.write('</DtecBS>\n')
+
+def main():
+    parser = argparse.ArgumentParser(description="Synthetic eToro statement (and BSI rate file) generator")
+    parser.add_argument("-n", "--positions", type=int, default=10000, help="number of positions (default 10000)")
+    parser.add_argument("-l", "--locale", choices=sorted(DATETIME_FORMATS), default="en", help="date/number format of the statement")
+    parser.add_argument("-o", "--output", default="eToroAccountStatement-synthetic.xlsx", help="statement filename")
+    parser.add_argument("--rates", metavar="FILE", help="also write a matching BSI rate file")
+    parser.add_argument("--start-year", type=int, default=datetime.date.today().year - 4)
+    parser.add_argument("--years", type=int, default=4, help="number of years covered (default 4)")
+    parser.add_argument("--stocks", type=int, default=200, help="number of distinct stocks (default 200)")
+    parser.add_argument("--dividends", type=float, default=0.3, help="share of stock positions receiving dividends")
+    parser.add_argument("--company-info", default="Company_info.xlsx", help="source of stock symbols, names and ISINs")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    instruments = load_instruments(args.company_info, args.stocks, args.seed)
+    counts = generate_statement(args.output, args.positions, args.locale, args.seed, args.start_year, args.years,
+                                instruments, args.dividends)
+    print("{0}: {1} closed positions, {2} account activity rows, {3} dividends".format(args.output, *counts))
+    if args.rates:
+        generate_rates(args.rates, datetime.date(args.start_year - 1, 12, 1), datetime.date(args.start_year + args.years, 1, 31), args.seed)
+        print("{0}: rates {1}-{2}".format(args.rates, args.start_year - 1, args.start_year + args.years))
+
+if __name__ == "__main__":
+    main()
@@ -6,6 +6,7 @@ if sys.version_info.major == 3 and sys.version_info.minor >= 10:
     import collections.abc
     collections.Iterable = collections.abc.Iterable
 
+import urllib.parse
 import urllib.request
 import sys
 import xml.etree.ElementTree
@@ -13,17 +14,50 @@ import datetime
 import os
 import glob
 import argparse
+import contextlib
+import csv
+import cProfile
+import functools
+import hashlib
+import heapq
+import http.server
+import io
+import itertools
+import json
+import mmap
+import pickle
+import signal
+import struct
+import tempfile
+import threading
+import time
+import traceback
+import tracemalloc
+import warnings
+import zipfile
+from array import array
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
 #import locale
 #import prettytable
-from xml.dom import minidom
 
-from openpyxl import Workbook
-from openpyxl.styles import NamedStyle
+from openpyxl import Workbook, load_workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Alignment, Font, NamedStyle, PatternFill
+from openpyxl.utils import get_column_letter
+from openpyxl.worksheet.filters import AutoFilter
+from openpyxl.worksheet.table import Table, TableColumn
 from openpyxl_templates import TemplatedWorkbook
-from openpyxl_templates.styles import DefaultStyleSet
+from openpyxl_templates.styles import DEFAULT_ACCENT_COLOR
 from openpyxl_templates.table_sheet import TableSheet
 from openpyxl_templates.table_sheet.columns import CharColumn
-from operator import itemgetter
+from openpyxl_templates.table_sheet.table_sheet import HeadersNotFound
+from operator import attrgetter
+
+try:
+    import numpy
+except ImportError:  # optional; pure Python fallback is used for trade normalization
+    numpy = None
 
 APP_VER = "1.8.3 (20.11.2025)"
 
@@ -33,15 +67,32 @@ ETORO_DATETIME_FORMAT_EN2 = "%d/%m/%Y"
 ETORO_DATETIME_FORMAT_SL1 = "%d.%m.%Y %H:%M:%S"
 ETORO_DATETIME_FORMAT_SL2 = "%d.%m.%Y"
 ETORO_CURRENCY = "USD"
+EXCHANGE_RATE_MAX_GAP = 6  # days
+EXCHANGE_RATE_HISTORY_YEARS = 5  # years loaded before the first report year (positions are mostly opened within them)
 
 bsRateXmlUrl = "https://www.bsi.si/_data/tecajnice/dtecbs-l.xml"
+bsRateStoreFilename = "bsrate.bin"
 ignoreAssets = []
 derivateAssets = ["CFD", "OPT", "FUT", "FOP", "Crypto Margin"]
 normalAssets = ["Stocks", "Crypto", "ETF"]
 
 dividendMarker = "Payment caused by dividend"
 
-float_with_comma = False
+STATEMENT_CACHE_DIR = ".etoro-edavki-cache"
+STATEMENT_CACHE_SCHEMA = 5  # bump whenever the cached row layout (or row selection) changes
+STATEMENT_CACHE_MAX_SIZE = 256  # MB
+STATEMENT_CACHE_CHUNK = 1000
+COMPANY_INDEX_FILENAME = "company-info.pickle"  # stored in STATEMENT_CACHE_DIR
+FRAGMENT_CACHE_SCHEMA = 1  # bump whenever the rendering of KDVPItem or TItem changes
+
+SERVER_DEFAULT_HOST = "127.0.0.1"
+SERVER_MAX_UPLOAD = 64  # MB
+SERVER_MAX_PENDING = 16  # conversions waiting for a free worker
+
+CONTROL_FILE_FORMATS = ("xlsx", "csv", "none")  # Debug-<year> and Dividende-info-<year> control files
+
+DATE_MEMO_SIZE = 4096  # distinct days remembered by CellDecoder
+PERIOD_STOP_ROWS = 1000  # dated rows after the report period read before a chronological sheet stops
 
 class ClosedPositionsSheet(TableSheet):
     # 2024: Position ID	Action	Amount	Units	Open Date	Close Date	Leverage	Spread Fees (USD)	Profit(USD)	Profit(EUR)	Open Rate
@@ -129,6 +180,291 @@ class EToroWorkbook(TemplatedWorkbook):
     transactions = AccountActivityReportSheet(sheetname='Account Activity')
     dividends = DividendsSheet(sheetname='Dividends')
 
+""" Lightweight rows holding only the statement columns used by the converter """
+ClosedPositionRow = namedtuple("ClosedPositionRow", [
+    "position_id", "action", "long_short", "amount", "units", "open_date", "close_date", "leverage", "profit", "type"
+])
+AccountActivityRow = namedtuple("AccountActivityRow", ["details", "position_id"])
+DividendRow = namedtuple("DividendRow", [
+    "date", "name", "net_dividend", "withholding_tax_rate", "withholding_tax_amount", "position_id", "isin"
+])
+
+class ReportPeriod:
+    """ Report years pushed down into the sheet readers. Rows are selected by the year of their raw date cell before
+        any cell is decoded; chronological sheets (account activity) stop being read a while after the end of the period. """
+    def __init__(self, years):
+        self.years = frozenset(str(year) for year in years)
+        self.last = max(self.years)
+
+    def tag(self, filterRows):
+        """ Part of the cache entry name: rows of a sheet read for this period """
+        if filterRows:
+            return "y" + "_".join(sorted(self.years))
+        return "to" + self.last
+
+    @staticmethod
+    def sort_key(value):
+        """ Raw statement date (dd/mm/yyyy or dd.mm.yyyy, optionally with time) as a sortable yyyymmdd... string, or None """
+        if isinstance(value, str):
+            if len(value) >= 10 and value[6:10].isdigit():
+                return value[6:10] + value[3:5] + value[:2] + value[10:]
+            return None
+        if isinstance(value, datetime.datetime):
+            return value.strftime("%Y%m%d %H:%M:%S")
+        return None
+
+def stream_sheet(worksheet, table_sheet, fields, optional=(), period=None, dateField=None, filterRows=True, stopAfter=False):
+    """ Lazily yields raw cell values of the given columns of a read-only worksheet (blank cells as None).
+        Columns listed in optional may be missing from the sheet (older statement versions) and are read as None.
+        With a ReportPeriod rows are checked on the raw dateField cell first: rows of other years are skipped (filterRows).
+        With stopAfter (only for sheets in chronological order) reading stops once PERIOD_STOP_ROWS rows after the period
+        have followed each other in date order; a row with an earlier date turns stopping off, so a sheet that is not sorted
+        is read in full. Rows without a recognizable date are always yielded. """
+    wanted = [getattr(type(table_sheet), field).header for field in fields]
+    required = [header for field, header in zip(fields, wanted) if field not in optional]
+    rows = worksheet.iter_rows(values_only=True)
+
+    indexes = None
+    for row in rows:
+        headers = [str(value) for value in row]
+        if all(header in headers for header in required):
+            indexes = [headers.index(header) if header in headers else None for header in wanted]
+            break
+    if indexes is None:
+        raise HeadersNotFound(table_sheet)
+
+    dateIndex = None
+    if period is not None:
+        dateHeader = getattr(type(table_sheet), dateField).header
+        if dateHeader in headers:
+            dateIndex = headers.index(dateHeader)
+    sort_key = ReportPeriod.sort_key
+    previous = None  # sort key of the last dated row
+    ascending = stopAfter
+    after = 0  # dated rows after the period, all in date order
+
+    for row in rows:
+        if dateIndex is not None and dateIndex < len(row):
+            key = sort_key(row[dateIndex])
+            if key is not None:
+                if ascending:
+                    if previous is not None and key < previous:
+                        ascending = False
+                    elif key[:4] > period.last:
+                        after += 1
+                        if after > PERIOD_STOP_ROWS:
+                            break
+                    previous = key
+                if filterRows and key[:4] not in period.years:
+                    continue
+
+        values = []
+        for index in indexes:
+            value = row[index] if index is not None and index < len(row) else None
+            if isinstance(value, str) and value.startswith("'"):
+                value = value[1:]
+            values.append(None if value == "" else value)
+        yield values
+
+class StatementCache:
+    """ On-disk cache of decoded statement rows, keyed by the statement content hash and STATEMENT_CACHE_SCHEMA """
+    def __init__(self, directory=STATEMENT_CACHE_DIR, max_size=STATEMENT_CACHE_MAX_SIZE):
+        self.directory = directory
+        self.max_size = max_size * 1024 * 1024
+
+    @staticmethod
+    def key(filename):
+        sha = hashlib.sha256()
+        with open(filename, "rb") as f:
+            for block in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(block)
+        return "{0}-v{1}".format(sha.hexdigest(), STATEMENT_CACHE_SCHEMA)
+
+    def rows(self, key, sheet, row_class, reader):
+        """ Yields cached rows of a sheet; on a miss it yields rows from reader and stores them once fully read """
+        path = os.path.join(self.directory, "{0}-{1}.pickle".format(key, sheet))
+        if os.path.isfile(path):
+            try:
+                os.utime(path)  # keep recently used entries on eviction
+            except OSError:
+                pass
+            with open(path, "rb") as f:
+                while True:
+                    try:
+                        chunk = pickle.load(f)
+                    except EOFError:
+                        break
+                    for values in chunk:
+                        yield row_class._make(values)
+            return
+
+        os.makedirs(self.directory, exist_ok=True)
+        fd, tmpPath = tempfile.mkstemp(dir=self.directory, prefix=os.path.basename(path) + ".", suffix=".tmp")  # one per writer
+        complete = False
+        try:
+            with os.fdopen(fd, "wb") as f:
+                chunk = []
+                for row in reader:
+                    # plain tuples, so entries do not depend on the module name rows were pickled under
+                    chunk.append(tuple(row))
+                    if len(chunk) >= STATEMENT_CACHE_CHUNK:
+                        pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+                        chunk = []
+                    yield row
+                if chunk:
+                    pickle.dump(chunk, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmpPath, path)
+            complete = True
+        finally:
+            if not complete and os.path.isfile(tmpPath):
+                os.remove(tmpPath)
+        self.evict()
+
+    def fragments(self, filename):
+        """ Store of the rendered XML fragments of an output file (from its previous run) """
+        key = hashlib.sha256(os.path.abspath(filename).encode("utf-8")).hexdigest()
+        return FragmentStore(os.path.join(self.directory, "fragments-{0}-v{1}.pickle".format(key, FRAGMENT_CACHE_SCHEMA)), self)
+
+    def entries(self):
+        if not os.path.isdir(self.directory):
+            return []
+        return [entry for entry in os.scandir(self.directory) if entry.is_file() and entry.name.endswith(".pickle")]
+
+    def evict(self):
+        """ Removes least recently used entries until the cache fits into max_size; best effort, entries that are
+            gone or can not be removed (e.g. still open on Windows) are skipped """
+        entries = []
+        for entry in self.entries():
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+        entries.sort()
+        size = sum(entry[1] for entry in entries)
+        for mtime, entrySize, path in entries:
+            if size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass  # removed by another process
+            except OSError:
+                continue
+            size -= entrySize
+
+    def clear(self):
+        removed = 0
+        for entry in self.entries():
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass
+        return removed
+
+class FragmentStore:
+    """ Rendered XML fragments of one output file keyed by a fingerprint of the data they were rendered from.
+        Only fragments used by the last run are kept. """
+    def __init__(self, path, cache):
+        self.path = path
+        self.cache = cache
+        self.previous = {}
+        self.used = {}
+        if os.path.isfile(path):
+            try:
+                with open(path, "rb") as f:
+                    self.previous = pickle.load(f)
+            except (OSError, EOFError, pickle.UnpicklingError):
+                self.previous = {}
+
+    def get(self, key):
+        text = self.previous.get(key)
+        if text is not None:
+            self.used[key] = text
+        return text
+
+    def put(self, key, text):
+        self.used[key] = text
+
+    def save(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmpPath = "{0}.{1}.{2}.tmp".format(self.path, os.getpid(), threading.get_ident())
+        with open(tmpPath, "wb") as f:
+            pickle.dump(self.used, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, self.path)
+        self.cache.evict()
+
+class EToroStatement:
+    """ Streaming, read-only access to the sheets of an eToro XLSX statement. Every sheet is opened lazily and read once. """
+    # row class -> (CellDecoder method, field used to detect the date format)
+    DECODERS = {
+        ClosedPositionRow: ("closed_position", "close_date"),
+        AccountActivityRow: ("account_activity", None),
+        DividendRow: ("dividend", "date"),
+    }
+    # columns that only some statement versions carry
+    OPTIONAL_FIELDS = {
+        DividendRow: ("isin",),
+    }
+    # row class -> (date column checked against the report period, whether rows of other years are skipped,
+    # whether reading stops after the period); account activity of earlier years is needed for the symbols of positions
+    # opened before the period, but it is chronological. Closed positions and dividends are not guaranteed to be sorted.
+    PERIOD_FIELDS = {
+        ClosedPositionRow: ("close_date", True, False),
+        AccountActivityRow: ("date", False, True),
+        DividendRow: ("date", True, False),
+    }
+
+    def __init__(self, filename, cache=None, years=None):
+        self.filename = filename
+        self.cache = cache
+        self.period = ReportPeriod(years) if years else None
+        self.decoder = None
+        self._cacheKey = None
+
+    def closed_positions(self):
+        return self._read(EToroWorkbook.closed_positions, ClosedPositionRow)
+
+    def transactions(self):
+        return self._read(EToroWorkbook.transactions, AccountActivityRow)
+
+    def dividends(self):
+        return self._read(EToroWorkbook.dividends, DividendRow)
+
+    def _read(self, table_sheet, row_class):
+        if self.cache is None:
+            return self._read_xlsx(table_sheet, row_class)
+        if self._cacheKey is None:
+            self._cacheKey = self.cache.key(self.filename)
+        sheet = table_sheet.table_name
+        if self.period is not None:
+            sheet += "-" + self.period.tag(self.PERIOD_FIELDS[row_class][1])
+        return self.cache.rows(self._cacheKey, sheet, row_class, self._read_xlsx(table_sheet, row_class))
+
+    def _read_xlsx(self, table_sheet, row_class):
+        wb = load_workbook(self.filename, read_only=True, data_only=True)
+        try:
+            if table_sheet.sheetname not in wb.sheetnames:
+                raise HeadersNotFound(table_sheet)
+            decoderName, dateField = self.DECODERS[row_class]
+            decode = None
+            periodField, filterRows, stopAfter = self.PERIOD_FIELDS[row_class]
+            for values in stream_sheet(wb[table_sheet.sheetname], table_sheet, row_class._fields, self.OPTIONAL_FIELDS.get(row_class, ()),
+                                       self.period, periodField, filterRows, stopAfter):
+                if decode is None:
+                    if dateField is not None and self.decoder is None:
+                        self.decoder = CellDecoder.detect(values[row_class._fields.index(dateField)])
+                    decode = getattr(self.decoder or CellDecoder(), decoderName)
+                yield decode(values)
+        finally:
+            wb.close()
+
+def read_statement(filename, cache=None, years=None):
+    """ Reads all used sheets of a statement into lists; runs in worker processes when parsing in parallel """
+    statement = EToroStatement(filename, cache, years)
+    return list(statement.closed_positions()), list(statement.transactions()), list(statement.dividends())
+
 class CompanyInfoSheet(TableSheet):
     symbol = CharColumn(header='Symbol')
     ISIN = CharColumn(header='ISIN')
@@ -139,6 +475,67 @@ class CompanyInfoSheet(TableSheet):
 class CompanyWorkbook(TemplatedWorkbook):
     info = CompanyInfoSheet(sheetname='Info')
 
+CompanyInfo = namedtuple("CompanyInfo", ["symbol", "ISIN", "name", "address", "country_code"])
+
+class CompanyIndex:
+    """ Company_info.xlsx entries with hash lookups by symbol and by ISIN (on duplicates the first entry wins) """
+    def __init__(self, companies):
+        self.companies = companies
+        self.bySymbol = {}
+        self.byIsin = {}
+        for company in companies:
+            if company.symbol is not None:
+                self.bySymbol.setdefault(company.symbol, company)
+            if company.ISIN is not None:
+                self.byIsin.setdefault(company.ISIN.strip().upper(), company)
+
+    def by_symbol(self, symbol):
+        return self.bySymbol.get(symbol.upper())
+
+    def by_isin(self, isin):
+        if isin is None:
+            return None
+        return self.byIsin.get(isin.strip().upper())
+
+    def lookup(self, symbol, isin=None):
+        """ Company of a symbol; the ISIN (when the statement carries it) is used as a fallback """
+        company = self.by_symbol(symbol)
+        if company is None:
+            company = self.by_isin(isin)
+        return company
+
+    @classmethod
+    def read(cls, filename):
+        return cls([
+            CompanyInfo(info.symbol, info.ISIN, info.name, info.address, info.country_code)
+            for info in CompanyWorkbook(file=filename).info.read()
+        ])
+
+    @classmethod
+    def load(cls, filename="Company_info.xlsx", cache=None):
+        """ Loads the index from the cache directory; it is rebuilt from filename only when its content changes """
+        if cache is None:
+            return cls.read(filename)
+
+        key = cache.key(filename)
+        path = os.path.join(cache.directory, COMPANY_INDEX_FILENAME)
+        try:
+            with open(path, "rb") as f:
+                storedKey, companies = pickle.load(f)
+            if storedKey == key:
+                os.utime(path)  # keep it on cache eviction
+                return cls([CompanyInfo._make(company) for company in companies])
+        except (OSError, EOFError, ValueError, pickle.UnpicklingError):
+            pass
+
+        index = cls.read(filename)
+        os.makedirs(cache.directory, exist_ok=True)
+        tmpPath = "{0}.{1}.tmp".format(path, os.getpid())
+        with open(tmpPath, "wb") as f:
+            pickle.dump((key, [tuple(company) for company in index.companies]), f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmpPath, path)
+        return index
+
 class DividendsOutputSheet(TableSheet):
     skipped = CharColumn(header="Skipped", width=7)
     date = CharColumn(header="Date", width=12)
@@ -153,48 +550,541 @@ class DividendsOutputSheet(TableSheet):
     #currency = CharColumn(header="Orig. currency")
     position_ids = CharColumn(header="Position ID(s)", width=100)
 
-class DividendsOutputWorkbook(TemplatedWorkbook):
-    dividends = DividendsOutputSheet()
+@functools.lru_cache(maxsize=DATE_MEMO_SIZE)
+def edavki_date(ordinal):
+    return datetime.date.fromordinal(ordinal).strftime(EDAVKI_DATETIME_FORMAT)
+
+class Position:
+    """ Closed position of the report year. Fields shared by both legs are stored once; open and close are TradeLeg views. """
+    __slots__ = (
+        "position_id", "symbol", "name", "position_type", "ifi_type", "asset_type", "is_etf", "leverage", "units",
+        "open_date", "close_date", "open_price_eur", "close_price_eur", "open_date_str", "close_date_str", "open", "close"
+    )
+
+    def __init__(self, position_id, symbol, name, position_type, ifi_type, asset_type, leverage, units,
+                 open_date, close_date, open_price_eur, close_price_eur):
+        self.position_id = position_id
+        self.symbol = sys.intern(symbol) if symbol is not None else None
+        self.name = sys.intern(name) if name is not None else None
+        self.position_type = position_type
+        self.ifi_type = sys.intern(ifi_type) if ifi_type is not None else None
+        self.asset_type = asset_type
+        self.is_etf = ifi_type == "ETF"
+        self.leverage = leverage
+        self.units = units
+        self.open_date = open_date
+        self.close_date = close_date
+        self.open_price_eur = open_price_eur
+        self.close_price_eur = close_price_eur
+        self.open_date_str = edavki_date(open_date.toordinal())
+        self.close_date_str = edavki_date(close_date.toordinal())
+        self.open = TradeLeg(self, True)
+        self.close = TradeLeg(self, False)
+
+class TradeLeg:
+    """ Open (quantity > 0) or close (quantity < 0) leg of a Position """
+    __slots__ = ("position", "is_open")
+
+    def __init__(self, position, is_open):
+        self.position = position
+        self.is_open = is_open
+
+    position_id = property(lambda self: self.position.position_id)
+    symbol = property(lambda self: self.position.symbol)
+    name = property(lambda self: self.position.name)
+    position_type = property(lambda self: self.position.position_type)
+    ifi_type = property(lambda self: self.position.ifi_type)
+    asset_type = property(lambda self: self.position.asset_type)
+    is_etf = property(lambda self: self.position.is_etf)
+    leverage = property(lambda self: self.position.leverage)
+    open_price_eur = property(lambda self: self.position.open_price_eur)
+    close_price_eur = property(lambda self: self.position.close_price_eur)
+    open_date = property(lambda self: self.position.open_date)
+    close_date = property(lambda self: self.position.close_date)
+
+    @property
+    def quantity(self):
+        return self.position.units if self.is_open else -self.position.units
+
+    @property
+    def trade_date(self):
+        return self.position.open_date if self.is_open else self.position.close_date
+
+    @property
+    def trade_date_str(self):
+        return self.position.open_date_str if self.is_open else self.position.close_date_str
+
+    @property
+    def trade_price_eur(self):
+        return self.position.open_price_eur if self.is_open else self.position.close_price_eur
+
+    def __repr__(self):
+        return "TradeLeg(position_id={0}, symbol={1}, name={2}, quantity={3}, trade_date={4}, trade_price_eur={5})".format(
+            self.position_id, self.symbol, self.name, self.quantity, self.trade_date_str, self.trade_price_eur)
+
+class ConversionError(Exception):
+    """ Input data that can not be converted; the message is meant for the user """
+    pass
+
+class StatementFormatError(ConversionError):
+    pass
+
+class ConversionWarning(UserWarning):
+    """ Data that is converted anyway but should be checked; the message is meant for the user (see show_warning) """
+    pass
+
+showDefaultWarning = warnings.showwarning
+
+def show_warning(message, category, filename, lineno, file=None, line=None):
+    """ warnings.showwarning of the command line: ConversionWarning is printed like the other messages (and with them
+        into convert.log of a batch client) """
+    if issubclass(category, ConversionWarning):
+        print(message)
+    else:
+        showDefaultWarning(message, category, filename, lineno, file, line)
 
 # returns [date_format, float_with_comma]
 def determine_date_format_and_comma(date):
-    try:
-        datetime.datetime.strptime(date, ETORO_DATETIME_FORMAT_EN1)
-        return [ETORO_DATETIME_FORMAT_EN1, False]
-    except ValueError:
-        pass
-    try:
-        datetime.datetime.strptime(date, ETORO_DATETIME_FORMAT_SL1)
-        return [ETORO_DATETIME_FORMAT_SL1, True]
-    except ValueError:
-        pass
-    try:
-        datetime.datetime.strptime(date, ETORO_DATETIME_FORMAT_EN2)
-        return [ETORO_DATETIME_FORMAT_EN2, False]
-    except ValueError:
-        pass
-    try:
-        datetime.datetime.strptime(date, ETORO_DATETIME_FORMAT_SL2)
-        return [ETORO_DATETIME_FORMAT_SL2, True]
-    except ValueError:
-        print("ERROR: Could not determine eToro DATETIME format!")
-        sys.exit(-1)
+    # the separator and the length select the candidate, so usually a single strptime confirms it
+    if len(date) > 10:
+        candidates = [[ETORO_DATETIME_FORMAT_EN1, False], [ETORO_DATETIME_FORMAT_SL1, True]]
+    else:
+        candidates = [[ETORO_DATETIME_FORMAT_EN2, False], [ETORO_DATETIME_FORMAT_SL2, True]]
+    if date[2:3] == ".":
+        candidates.reverse()
+
+    for candidate in candidates:
+        try:
+            datetime.datetime.strptime(date, candidate[0])
+            return candidate
+        except ValueError:
+            pass
+    raise StatementFormatError("ERROR: Could not determine eToro DATETIME format! ({0})".format(date))
+
+class CellDecoder:
+    """ Typed decoding of statement cells for one statement. The date format and the decimal separator are detected
+        once; dates are parsed by slicing the fixed-width format, with a bounded memo of the (shared) day part. """
+    def __init__(self, date_format=ETORO_DATETIME_FORMAT_EN1, float_with_comma=False):
+        self.date_format = date_format
+        self.float_with_comma = float_with_comma
+        self._separator = date_format[2]
+        self._with_time = date_format.endswith("%H:%M:%S")
+        self._day = functools.lru_cache(maxsize=DATE_MEMO_SIZE)(self._parse_day)
+        self._parse_number = self._parse_number_with_comma if float_with_comma else float
+
+    @classmethod
+    def detect(cls, sample):
+        if isinstance(sample, str):
+            return cls(*determine_date_format_and_comma(sample))
+        return cls()
+
+    def _parse_day(self, value):
+        # dd?mm?yyyy -> (year, month, day) or None if it does not fit the format
+        sep = self._separator
+        if value[2] == sep and value[5] == sep and value[:2].isdigit() and value[3:5].isdigit() and value[6:].isdigit():
+            try:
+                return datetime.date(int(value[6:]), int(value[3:5]), int(value[:2])).timetuple()[:3]
+            except ValueError:
+                pass
+        return None
+
+    def date(self, value):
+        if value is None or isinstance(value, datetime.datetime):
+            return value
+        if not isinstance(value, str):
+            value = str(value)
+        if self._with_time:
+            if len(value) == 19 and value[10] == " " and value[13] == ":" and value[16] == ":" \
+                    and value[11:13].isdigit() and value[14:16].isdigit() and value[17:19].isdigit():
+                day = self._day(value[:10])
+                if day is not None:
+                    return datetime.datetime(day[0], day[1], day[2], int(value[11:13]), int(value[14:16]), int(value[17:19]))
+        elif len(value) == 10:
+            day = self._day(value)
+            if day is not None:
+                return datetime.datetime(day[0], day[1], day[2])
+        return datetime.datetime.strptime(value, self.date_format)
+
+    @staticmethod
+    def _parse_number_with_comma(value):
+        return float(value.replace(",", "."))
+
+    def number(self, value):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return self._parse_number(value)
+        return float(value)
+
+    def percent(self, value):
+        if value is None:
+            return None
+        if isinstance(value, str):
+            return self._parse_number(value.rstrip('%')) / 100.0
+        return float(value) / 100.0
+
+    @staticmethod
+    def integer(value):
+        if value is None or isinstance(value, int):
+            return value
+        try:
+            return int(value)
+        except ValueError:
+            number = float(value)
+            if not number.is_integer():
+                raise
+            return int(number)
+
+    @staticmethod
+    def leverage(value):
+        if value is None:
+            return 0
+        try:
+            return int(value)
+        except ValueError:
+            return 1
+
+    @staticmethod
+    def text(value):
+        if value is None or isinstance(value, str):
+            return value
+        return str(value)
+
+    def closed_position(self, values):
+        position_id, action, long_short, amount, units, open_date, close_date, leverage, profit, type = values
+        return ClosedPositionRow(
+            self.integer(position_id), self.text(action), self.text(long_short), self.number(amount), self.number(units),
+            self.date(open_date), self.date(close_date), self.leverage(leverage), self.number(profit), self.text(type)
+        )
+
+    def account_activity(self, values):
+        details, position_id = values
+        return AccountActivityRow(self.text(details), self.integer(position_id))
+
+    def dividend(self, values):
+        date, name, net_dividend, withholding_tax_rate, withholding_tax_amount, position_id, isin = values
+        return DividendRow(
+            self.date(date), self.text(name), self.number(net_dividend), self.percent(withholding_tax_rate),
+            self.number(withholding_tax_amount), self.integer(position_id), self.text(isin)
+        )
 
+class ExchangeRateError(ConversionError):
+    pass
+
+class ExchangeRateTable:
+    """ Daily exchange rates (parsed floats) per currency on a dense calendar indexed by date ordinal.
+        Days without a published rate (weekends, holidays) are forward-filled for up to max_gap days. """
+    STORE_MAGIC = b"BSRT"
+    STORE_VERSION = 2
+
+    def __init__(self, max_gap=EXCHANGE_RATE_MAX_GAP):
+        self.max_gap = max_gap
+        self.refreshed = None  # date of the last refresh from the BSI source
+        self.source = None  # rate_source_identity() of the BSI source the table was built from
+        self.since = None  # first day covered by lookups, loaded from max_gap days before (None: whole history of the source)
+        self.origin = None  # URL or file the table is extended from (extend_to), not stored
+        self.store = None  # store file rewritten after an extension, not stored
+        self._published = {}  # currency -> {ordinal: rate}
+        self._calendars = {}  # currency -> (first ordinal, [rate or None, ...])
+        self._arrays = {}  # currency -> calendar as numpy array (NaN for missing rates)
+
+    def add(self, date, currency, rate):
+        self._published.setdefault(currency, {})[date.toordinal()] = float(rate)
+        self._calendars.pop(currency, None)
+        self._arrays.pop(currency, None)
+
+    def currencies(self):
+        return list(self._published.keys())
+
+    def last_date(self):
+        ordinals = [max(published) for published in self._published.values() if published]
+        return datetime.date.fromordinal(max(ordinals)) if ordinals else None
+
+    def save(self, filename):
+        """ Writes the table in a compact binary layout: header (with the source identity), then per currency
+            sorted ordinals (int32) and rates (float64) """
+        tmpFilename = "{0}.{1}.tmp".format(filename, os.getpid())
+        source = (self.source or "").encode("utf-8")
+        with open(tmpFilename, "wb") as f:
+            f.write(self.STORE_MAGIC)
+            f.write(struct.pack("<HIHIH", self.STORE_VERSION, self.refreshed.toordinal() if self.refreshed else 0, len(self._published),
+                                self.since.toordinal() if self.since else 0, len(source)))
+            f.write(source)
+            for currency, published in self._published.items():
+                ordinals = array("i", sorted(published))
+                rates = array("d", (published[ordinal] for ordinal in ordinals))
+                if sys.byteorder != "little":
+                    ordinals.byteswap()
+                    rates.byteswap()
+                code = currency.encode("ascii")
+                f.write(struct.pack("<BI", len(code), len(ordinals)))
+                f.write(code)
+                f.write(ordinals.tobytes())
+                f.write(rates.tobytes())
+        os.replace(tmpFilename, filename)
+
+    @classmethod
+    def load(cls, filename, max_gap=EXCHANGE_RATE_MAX_GAP):
+        """ Loads a table written by save(); returns None if the file is missing or not compatible """
+        if not os.path.isfile(filename):
+            return None
+        with open(filename, "rb") as f:
+            data = f.read()
+        if data[:4] != cls.STORE_MAGIC:
+            return None
+        version = struct.unpack_from("<H", data, 4)[0]
+        if version != cls.STORE_VERSION:
+            return None
+        version, refreshed, count, since, sourceLength = struct.unpack_from("<HIHIH", data, 4)
+
+        table = cls(max_gap)
+        table.refreshed = datetime.date.fromordinal(refreshed) if refreshed else None
+        table.since = datetime.date.fromordinal(since) if since else None
+        offset = 4 + struct.calcsize("<HIHIH")
+        table.source = data[offset:offset + sourceLength].decode("utf-8") or None
+        offset += sourceLength
+        for i in range(count):
+            codeLength, length = struct.unpack_from("<BI", data, offset)
+            offset += struct.calcsize("<BI")
+            currency = data[offset:offset + codeLength].decode("ascii")
+            offset += codeLength
+            ordinals = array("i")
+            ordinals.frombytes(data[offset:offset + 4 * length])
+            offset += 4 * length
+            rates = array("d")
+            rates.frombytes(data[offset:offset + 8 * length])
+            offset += 8 * length
+            if sys.byteorder != "little":
+                ordinals.byteswap()
+                rates.byteswap()
+            table._published[currency] = dict(zip(ordinals, rates))
+        return table
+
+    def calendar(self, currency):
+        """ Returns (memoized) forward-filled calendar of a currency as (first ordinal, list of rates) """
+        calendar = self._calendars.get(currency)
+        if calendar is not None:
+            return calendar
+
+        published = self._published.get(currency, {})
+        if not published:
+            calendar = (0, [])
+        else:
+            first = min(published)
+            last = max(published) + self.max_gap
+            rates = []
+            rate = None
+            age = 0
+            for ordinal in range(first, last + 1):
+                if ordinal in published:
+                    rate = published[ordinal]
+                    age = 0
+                else:
+                    age += 1
+                rates.append(rate if age <= self.max_gap else None)
+            calendar = (first, rates)
+        self._calendars[currency] = calendar
+        return calendar
+
+    def rate(self, currency, date):
+        first, rates = self._calendars.get(currency) or self.calendar(currency)
+        index = date.toordinal() - first
+        if 0 <= index < len(rates):
+            rate = rates[index]
+            if rate is not None:
+                return rate
+        raise ExchangeRateError(
+            "Error: There is no {0} exchange rate for {1} (or {2} days before)".format(currency, date.strftime(EDAVKI_DATETIME_FORMAT), self.max_gap)
+        )
+
+    def gather(self, currency, ordinals):
+        """ Vectorized rate(): returns rates for a sequence of date ordinals (numpy array, or list without numpy) """
+        if numpy is None:
+            return [self.rate(currency, datetime.date.fromordinal(ordinal)) for ordinal in ordinals]
+
+        first, rates = self.calendar(currency)
+        calendar = self._arrays.get(currency)
+        if calendar is None:
+            calendar = numpy.array([numpy.nan if rate is None else rate for rate in rates] + [numpy.nan], dtype=numpy.float64)
+            self._arrays[currency] = calendar
+        index = numpy.asarray(ordinals, dtype=numpy.int64) - first
+        outside = (index < 0) | (index >= len(rates))
+        result = calendar[numpy.where(outside, len(rates), index)]
+        missing = numpy.isnan(result)
+        if missing.any():
+            self.rate(currency, datetime.date.fromordinal(int(numpy.asarray(ordinals)[missing.argmax()])))  # raises
+        return result
+
+    def extend_to(self, date):
+        """ Makes lookups from date on possible: when date lies before the loaded range (see load_exchange_rates since)
+            the days from the start of date's year are read from the origin. Called with the earliest date a conversion
+            needs, once its statements are read; raises ExchangeRateError when the origin can not be read. """
+        loaded = self.since
+        if loaded is None or date >= loaded or self.origin is None:
+            return
+        since = datetime.date(date.year, 1, 1)
+        gap = datetime.timedelta(days=self.max_gap)
+        try:
+            with open_rate_source(self.origin) as f:
+                added = list(iter_bsi_rates(f, set(self.currencies()), since=since - gap, until=loaded - gap - datetime.timedelta(days=1)))
+        except (OSError, xml.etree.ElementTree.ParseError) as e:
+            raise ExchangeRateError("Error: Could not load exchange rates before {0} from {1}: {2}".format(
+                loaded.strftime(EDAVKI_DATETIME_FORMAT), self.origin, e)) from e
+
+        with exchangeRatesLock:
+            if since >= self.since:
+                return  # extended as far by another thread meanwhile
+            for day, currency, rate in added:
+                self.add(day, currency, rate)
+            self.since = since
+            if self.store:
+                self.save(self.store)
+
+def normalize_trades(amounts, units, profits, leverages, directions, openOrdinals, closeOrdinals, rates, currency=ETORO_CURRENCY):
+    """ Computes open and close unit prices in EUR for a batch of closed positions given as columns.
+        directions: 1 for long (Buy), -1 for short (Sell), 0 if unknown (close price 0).
+        Returns (open_price_eur, close_price_eur) as lists. """
+    if not amounts:
+        return [], []
+
+    if numpy is None:
+        openPrices = []
+        closePrices = []
+        for amount, unit, profit, leverage, direction in zip(amounts, units, profits, leverages, directions):
+            if leverage > 1:
+                amount = amount * leverage
+            openPrices.append(amount / unit)
+            if direction > 0:
+                closePrices.append((amount + profit) / unit)
+            elif direction < 0:
+                closePrices.append((amount - profit) / unit)
+            else:
+                closePrices.append(0)
+        openRates = rates.gather(currency, openOrdinals)
+        closeRates = rates.gather(currency, closeOrdinals)
+        return [price / rate for price, rate in zip(openPrices, openRates)], [price / rate for price, rate in zip(closePrices, closeRates)]
+
+    amount = numpy.array(amounts, dtype=numpy.float64)
+    unit = numpy.array(units, dtype=numpy.float64)
+    profit = numpy.array(profits, dtype=numpy.float64)
+    leverage = numpy.array(leverages, dtype=numpy.int64)
+    direction = numpy.array(directions, dtype=numpy.int8)
+    if not unit.all():
+        raise ZeroDivisionError("float division by zero (closed position with 0 units)")
+
+    amount = numpy.where(leverage > 1, amount * leverage, amount)
+    openPrice = amount / unit
+    closePrice = numpy.where(direction > 0, (amount + profit) / unit, numpy.where(direction < 0, (amount - profit) / unit, 0.0))
+
+    openRate = rates.gather(currency, openOrdinals)
+    closeRate = rates.gather(currency, closeOrdinals)
+    return (openPrice / openRate).tolist(), (closePrice / closeRate).tolist()
+
+exchangeRatesLock = threading.Lock()  # serializes adding the rates read by ExchangeRateTable.extend_to (not the download)
+
+def rate_source_identity(source):
+    """ URL, or absolute path and content hash of a local BSI rate file; a store built from another source is rebuilt """
+    if source.startswith("http://") or source.startswith("https://"):
+        return source
+    sha = hashlib.sha256()
+    with open(source, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return "{0}#{1}".format(os.path.abspath(source), sha.hexdigest())
+
+def rates_since(years):
+    """ First day of the rates loaded for the report years; older days are added when a position needs them (extend_to) """
+    return datetime.date(min(years) - EXCHANGE_RATE_HISTORY_YEARS, 1, 1)
+
+def open_rate_source(source):
+    """ Opens the BSI rate XML from an URL or a local file """
+    if source.startswith("http://") or source.startswith("https://"):
+        # urllib.request.urlretrieve(bsRateXmlUrl, bsRateXmlFilename) # doesn't work because BSI now blocks this script...
+        # FU bsi!
+        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
+        return urllib.request.urlopen(urllib.request.Request(source, headers=headers))
+    return open(source, "rb")
+
+def iter_bsi_rates(source, currencies=None, since=None, until=None):
+    """ Streams (date, currency, rate) from a BSI rate XML, keeping only the requested currencies and date range """
+    root = None
+    for event, elem in xml.etree.ElementTree.iterparse(source, events=("start", "end")):
+        if root is None:
+            root = elem
+            continue
+        if event != "end" or elem.tag.rsplit("}", 1)[-1] != "tecajnica":
+            continue
 
-def get_exchange_rate(rates, trade_date, currency):
-    date = trade_date.strftime("%Y%m%d")
-    if date in rates:
-        return float(rates[date][currency])
+        date = datetime.date.fromisoformat(elem.attrib["datum"])
+        if (since is None or date >= since) and (until is None or date <= until):
+            for r in elem:
+                currency = r.attrib["oznaka"]
+                if currencies is None or currency in currencies:
+                    yield date, currency, r.text
+        root.clear()
+
+def load_exchange_rates(source=bsRateXmlUrl, store=bsRateStoreFilename, currencies=(ETORO_CURRENCY,), since=None):
+    """ Loads rates from the persistent store and appends days newer than its last entry (at most once per day).
+        The store is rebuilt when it was built from another source (URL, or path and content of a local file).
+        With since only days from then on are loaded; earlier days are added once the statements show that they are needed
+        (extend_to). """
+    identity = rate_source_identity(source)
+    rates = ExchangeRateTable.load(store) if store else None
+    if rates is not None and (rates.source != identity or not set(currencies).issubset(rates.currencies())
+                              or (since is None and rates.since is not None)):
+        rates = None
+
+    if rates is None:
+        rates = ExchangeRateTable()
+        rates.source = identity
+        rates.since = since
+        newSince = since - datetime.timedelta(days=rates.max_gap) if since is not None else None
     else:
-        for i in range(0, 6):
-            trade_date = trade_date - datetime.timedelta(days=1)
-            date = trade_date.strftime("%Y%m%d")
-            if date in rates:
-                return float(rates[date][currency])
-            if i == 6:
-                sys.exit(
-                    "Error: There is no exchange rate for " + str(date)
-                )
+        lastDate = rates.last_date()
+        newSince = lastDate + datetime.timedelta(days=1) if lastDate is not None else since
+    rates.origin = source
+    rates.store = store
+    if rates.refreshed == datetime.date.today():
+        return rates
+
+    try:
+        with open_rate_source(source) as f:
+            for date, currency, rate in iter_bsi_rates(f, set(currencies), since=newSince):
+                rates.add(date, currency, rate)
+    except (OSError, xml.etree.ElementTree.ParseError) as e:
+        if not rates.currencies():
+            raise
+        warnings.warn("!!! POZOR: Tečajnice ni bilo mogoče osvežiti ({0}), uporabljeni so shranjeni tečaji do {1}.".format(e, rates.last_date()),
+                      ConversionWarning)
+        return rates
+
+    rates.refreshed = datetime.date.today()
+    if store:
+        rates.save(store)
+    return rates
+
+class DeferredExchangeRates:
+    """ Loads the exchange rate table in a background thread; the first lookup waits for it """
+    def __init__(self, loader, *args):
+        executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="bsrate")
+        self._future = executor.submit(loader, *args)
+        executor.shutdown(wait=False)
+        self._table = None
+
+    def table(self):
+        if self._table is None:
+            self._table = self._future.result()
+            self.rate = self._table.rate  # skip the indirection for all further lookups
+        return self._table
+
+    def rate(self, currency, date):
+        return self.table().rate(currency, date)
+
+    def gather(self, currency, ordinals):
+        return self.table().gather(currency, ordinals)
+
+    def extend_to(self, date):
+        self.table().extend_to(date)
 
 def get_position_symbols(transactionList):
     syms = {}
@@ -208,191 +1098,813 @@ def get_position_symbols(transactionList):
             if xlsTransaction.position_id is None or xlsTransaction.details is None or xlsTransaction.details.find("/") < 0:
                 continue
             details_split = xlsTransaction.details.split("/", 1)
-            position_id = int(xlsTransaction.position_id)
-            syms[position_id] = details_split[0].upper()
+            syms[xlsTransaction.position_id] = details_split[0].upper()
     return syms
 
-# def update_position_symbols_from_dividends(dividendsList, companyList, syms):
-#     for diviSheet in dividendsList:
-#         if diviSheet is None:
-#             continue
-#
-#         for xlsDividend in diviSheet:
-#             position_id = int(xlsDividend.position_id)
-#             if syms.get(position_id) is not None:
-#                 continue
-#
-#             companyInfo = get_company_info_by_isin(xlsDividend.isin, companyList)
-#             if companyInfo is None:
-#                 print("!!! POZOR / NAPAKA: Ključa [position_id={0}] ni v slovarjih [openPositions, Company_info.xlxs]!".format(position_id))
-#                 print("                    Izvozi account statement za daljše obdobje oz. dodaj podatke za [ISIN={0}] v Company_info.xlxs.".format(xlsDividend.isin))
-#                 sys.exit(1)
-#
-#             syms[position_id] = companyInfo.symbol
-#             # DEBUG print("!!! Found {0}: {1}, {2}".format(position_id, companyInfo.symbol, companyInfo.name))
-#     return syms
-
-def get_company_info(symbol, companyList):
-    symbol = symbol.upper()
-    for companyInfo in companyList:
-        if companyInfo.symbol == symbol:
-            return companyInfo
-    return None
-
-# def get_company_info_by_isin(isin, companyList):
-#     for companyInfo in companyList:
-#         if companyInfo.ISIN == isin:
-#             return companyInfo
-#     return None
-
-def str2float(num):
-    global float_with_comma
-    if float_with_comma:
-        return float(num.replace(",", "."))
-    return float(num)
-
-# noinspection PyUnusedLocal
-def main():
-    global float_with_comma
-
-    print("------------------------------------------------------------------------------")
-    print("| eToro->eDavki | verzija " + APP_VER)
-    print("------------------------------------------------------------------------------")
+class XmlStreamWriter:
+    """ Writes XML elements straight to a file, in the same layout and escaping as minidom's toprettyxml(indent="\t") """
+    def __init__(self, f):
+        self.f = f
+        self.stack = []
+        self.pending = False  # start tag written without ">" until we know whether the element has children
+        f.write('<?xml version="1.0" ?>\n')
+
+    @staticmethod
+    def escape(text):
+        # as parsed back by minidom (line endings normalized) and written by its _write_data
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+        return text.replace("&", "&amp;").replace("<", "&lt;").replace("\"", "&quot;").replace(">", "&gt;")
+
+    def _close_pending(self):
+        if self.pending:
+            self.f.write(">\n")
+            self.pending = False
+
+    def start(self, tag, attrib=()):
+        self._close_pending()
+        self.f.write("\t" * len(self.stack) + "<" + tag)
+        for name, value in attrib:
+            self.f.write(" " + name + "=\"" + self.escape(value) + "\"")
+        self.stack.append(tag)
+        self.pending = True
+
+    def end(self):
+        tag = self.stack.pop()
+        if self.pending:
+            self.f.write("/>\n")
+            self.pending = False
+        else:
+            self.f.write("\t" * len(self.stack) + "</" + tag + ">\n")
 
-    parser = argparse.ArgumentParser()
-    parser.add_argument(
-        "eToroXLSXFiles",
-        metavar="eToro-xlsx-file",
-        help="eToro XLSX datoteka (\"XLSX Statement\")",
-        nargs="+",
-    )
-    parser.add_argument(
-        "-y",
-        metavar="report-year",
-        type=int,
-        default=0,
-        help="Datoteke bodo generirane za izbrano leto (privzeto za " + str(datetime.date.today().year - 1) + ")",
-    )
-    parser.add_argument(
-        "-t",
-        help="Testing",
-        action="store_true",
-    )
-    parser.add_argument(
-        "-c",
-        help="(Doh-KDVP) Vključi tudi kripto pozicije brez vzvoda v poročilu (običajno za s.p.; d.o.o.). Kripto pozicije z vzvodom (CFD) so vedno vključene.",
-        action="store_true",
-        default=False
-    )
+    def element(self, tag, text=None):
+        self._close_pending()
+        if text:
+            self.f.write("\t" * len(self.stack) + "<" + tag + ">" + self.escape(text) + "</" + tag + ">\n")
+        else:
+            self.f.write("\t" * len(self.stack) + "<" + tag + "/>\n")
+
+    def capture(self, render, *args):
+        """ Writes the complete elements of render(self, *args) and returns them as text for fragment() """
+        self._close_pending()
+        f = self.f
+        self.f = io.StringIO()
+        try:
+            render(self, *args)
+            text = self.f.getvalue()
+        finally:
+            self.f = f
+        f.write(text)
+        return text
+
+    def fragment(self, text):
+        """ Writes elements captured at the same depth """
+        self._close_pending()
+        self.f.write(text)
+
+def trades_fingerprint(kind, trades):
+    """ Hash of everything an instrument's popisni list is rendered from; EUR prices also cover the exchange rates used """
+    first = trades[0]
+    sha = hashlib.sha256(repr((kind, first.name, first.symbol, first.is_etf, first.ifi_type)).encode("utf-8"))
+    values = array("d")
+    for trade in trades:
+        values.extend((trade.trade_date.toordinal(), trade.quantity, trade.trade_price_eur, trade.leverage))
+    sha.update(values.tobytes())
+    return sha.digest()
+
+def write_items(w, render, kind, tradeGroups, fragments=None):
+    """ Writes render(w, trades) of every instrument; with a FragmentStore unchanged instruments are copied from the previous run """
+    for securityID in tradeGroups:
+        trades = tradeGroups[securityID]
+        if fragments is None:
+            render(w, trades)
+            continue
 
-    args = parser.parse_args()
-    inputFilenames = args.eToroXLSXFiles
-    if args.y == 0:
-        reportYear = datetime.date.today().year - 1
+        key = trades_fingerprint(kind, trades)
+        text = fragments.get(key)
+        if text is None:
+            fragments.put(key, w.capture(render, trades))
+        else:
+            w.fragment(text)
+
+def write_edp_header(w, schema, taxpayerConfig, test):
+    w.start("Envelope", (("xmlns", schema), ("xmlns:edp", "http://edavki.durs.si/Documents/Schemas/EDP-Common-1.xsd")))
+    w.start("edp:Header")
+    w.start("edp:taxpayer")
+    w.element("edp:taxNumber", taxpayerConfig["taxNumber"])
+    w.element("edp:taxpayerType", taxpayerConfig["taxpayerType"])
+    w.end()
+    w.start("edp:Workflow")
+    w.element("edp:DocumentWorkflowID", "I" if test else "O")
+    w.end()
+    w.end()
+    w.element("edp:AttachmentList")
+    w.element("edp:Signatures")
+
+def write_kdvp_long_item(w, trades):
+    """ Popisni list (KDVPItem) of a security with long positions """
+    w.start("KDVPItem")
+    w.element("InventoryListType", "PLVP")
+    w.element("Name", trades[0].name)
+    w.element("HasForeignTax", "false")
+    w.element("HasLossTransfer", "false")
+    w.element("ForeignTransfer", "false")
+    w.element("TaxDecreaseConformance", "false")
+    w.start("Securities")
+    # We need to enter either ISIN, Code or Name
+    # w.element("ISIN", trades[0].isin)
+    if len(trades) > 0 and trades[0].symbol is not None:
+        w.element("Code", trades[0].symbol[:10])
+    w.element("Name", trades[0].name)
+    w.element("IsFond", "true" if trades[0].is_etf else "false")
+
+    F8Value = 0
+    n = -1
+    for trade in trades:
+        n += 1
+        w.start("Row")
+        w.element("ID", str(n))
+        if trade.quantity > 0:
+            w.start("Purchase")
+            # Datum pridobitve
+            w.element("F1", trade.trade_date_str)
+            # Način pridobitve: A - vložek kapitala, B - nakup, C - povečanje kapitala družbe z lastnimi sredstvi zavezanca,
+            # D - povečanje kapitala družbe iz sredstev družbe, E - zamenjava kapitala ob statusnih spremembah družbe, F - dedovanje,
+            # G - darilo, H - drugo, I - povečanje kapitalskega deleža v osebni družbi zaradi pripisa dobička kapitalskemu deležu
+            w.element("F2", "B")
+            # Količina
+            w.element("F3", "{0:.8f}".format(trade.quantity))
+            # Nabavna vrednost ob pridobitvi (na enoto)
+            w.element("F4", "{0:.8f}".format(trade.trade_price_eur))
+            # Plačan davek na dediščine in darila (F2 == F | G)
+            w.element("F5", "0.0000")
+            w.end()
+        elif trade.quantity == 0:
+            warnings.warn("Error! Trade units == 0! " + str(trade), ConversionWarning)
+        else:
+            w.start("Sale")
+            # Datum odsvojitve
+            w.element("F6", trade.trade_date_str)
+            # Količina odsvojenega v.p.
+            w.element("F7", "{0:.8f}".format(-trade.quantity))
+            # Vrednost ob osvojitvi (na enoto)
+            w.element("F9", "{0:.8f}".format(trade.trade_price_eur))
+            # Pravilo iz drugega odstavka v povezavi s petim odstavkom 97.člena ZDoh-2
+            # TODO:
+            # w.element("F10", "NE")
+            w.end()
+        # Trenutna zaloga
+        F8Value += trade.quantity
+        w.element("F8", "{0:.8f}".format(F8Value))
+        w.end()
+    # trades
+    w.end()
+    w.end()
+
+def write_kdvp_short_item(w, trades):
+    """ Popisni list (KDVPItem) of a security with short positions """
+    w.start("KDVPItem")
+    w.element("InventoryListType", "PLVPSHORT")
+    w.element("Name", trades[0].name)
+    w.element("HasForeignTax", "false")
+    w.element("HasLossTransfer", "false")
+    w.element("ForeignTransfer", "false")
+    w.element("TaxDecreaseConformance", "false")
+    w.start("SecuritiesShort")
+    # We need to enter either ISIN, Code or Name
+    # w.element("ISIN", trades[0].isin)
+    if len(trades) > 0 and trades[0].symbol is not None:
+        w.element("Code", trades[0].symbol[:10])
+    w.element("Name", trades[0].name)
+    w.element("IsFond", "true" if trades[0].is_etf else "false")
+
+    F8Value = 0
+    n = -1
+    for trade in trades:
+        n += 1
+        w.start("Row")
+        w.element("ID", str(n))
+        if trade.quantity > 0:
+            w.start("Purchase")
+            w.element("F1", trade.trade_date_str)
+            w.element("F2", "A")
+            w.element("F3", "{0:.8f}".format(trade.quantity))
+            w.element("F4", "{0:.8f}".format(trade.trade_price_eur))
+            w.element("F5", "0.0000")
+            w.end()
+        else:
+            w.start("Sale")
+            w.element("F6", trade.trade_date_str)
+            w.element("F7", "{0:.8f}".format(-trade.quantity))
+            w.element("F9", "{0:.8f}".format(trade.trade_price_eur))
+            # Pravilo iz drugega odstavka v povezavi s petim odstavkom 97.člena ZDoh-2
+            # TODO:
+            # w.element("F10", "NE")
+            w.end()
+        # Trenutna zaloga
+        F8Value += trade.quantity
+        w.element("F8", "{0:.8f}".format(F8Value))
+        w.end()
+    # trades
+    w.end()
+    w.end()
+
+def write_doh_kdvp(filename, taxpayerConfig, reportYear, test, longNormalTrades, shortNormalTrades, cache=None):
+    """ Generate the files for Normal """
+    statementStartDate = datetime.date(year=reportYear, month=1, day=1)
+    statementEndDate = datetime.date(year=reportYear, month=12, day=31)
+
+    with open(filename, "w", encoding="utf-8") as f:
+        w = XmlStreamWriter(f)
+        write_edp_header(w, "http://edavki.durs.si/Documents/Schemas/Doh_KDVP_9.xsd", taxpayerConfig, test)
+        w.start("body")
+        w.element("edp:bodyContent")
+        w.start("Doh_KDVP")
+        w.start("KDVP")
+        w.element("DocumentWorkflowID", "I" if test else "O")
+        w.element("Year", str(reportYear))
+        w.element("PeriodStart", statementStartDate.strftime(EDAVKI_DATETIME_FORMAT))
+        w.element("PeriodEnd", statementEndDate.strftime(EDAVKI_DATETIME_FORMAT))
+        w.element("IsResident", "true")
+        w.element("SecurityCount", str(len(longNormalTrades)))
+        w.element("SecurityShortCount", str(len(shortNormalTrades)))
+        w.element("SecurityWithContractCount", "0")
+        w.element("SecurityWithContractShortCount", "0")
+        w.element("ShareCount", "0")
+        w.end()
+
+        fragments = cache.fragments(filename) if cache is not None else None
+        write_items(w, write_kdvp_long_item, "PLVP", longNormalTrades, fragments)
+        write_items(w, write_kdvp_short_item, "PLVPSHORT", shortNormalTrades, fragments)
+
+        w.end()
+        w.end()
+        w.end()
+    if fragments is not None:
+        fragments.save()
+
+def write_d_ifi_type(w, ifi_type):
+    if ifi_type == "FUT":
+        w.element("Type", "01")
+        w.element("TypeName", "terminska pogodba")
+    elif ifi_type == "CFD":
+        w.element("Type", "02")
+        w.element("TypeName", "finančne pogodbe na razliko")
+    elif ifi_type == "OPT":
+        w.element("Type", "03")
+        w.element("TypeName", "opcija in certifikat")
     else:
-        reportYear = int(args.y)
-
-    reportCryptos = args.c
-
-    test = args.t
+        w.element("Type", "04")
+        w.element("TypeName", "drugo")
+
+def write_d_ifi_long_item(w, trades):
+    """ Popisni list (TItem) of a derivative with long positions """
+    w.start("TItem")
+    w.element("TypeId", "PLIFI")
+    write_d_ifi_type(w, trades[0].ifi_type)
+    w.element("Name", trades[0].name)
+    if len(trades) > 0 and trades[0].symbol is not None:
+        w.element("Code", trades[0].symbol)
+    # w.element("ISIN", trades[0].isin)
+    w.element("HasForeignTax", "false")
+
+    F8Value = 0
+    for trade in trades:
+        w.start("TSubItem")
+        if trade.quantity > 0:
+            w.start("Purchase")
+            # Datum pridobitve
+            w.element("F1", trade.trade_date_str)
+            # Način pridobitve: A - nakup, B - dedovanje, C - darila, D - drugo
+            w.element("F2", "A")
+            # Količina
+            w.element("F3", "{0:.8f}".format(trade.quantity))
+            # Nabavna vrednost ob pridobitvi (na enoto)
+            w.element("F4", "{0:.8f}".format(trade.trade_price_eur))
+            # Trgovanje z vzvodom
+            w.element("F9", "true" if trade.leverage > 1 else "false")
+            w.end()
+        else:
+            w.start("Sale")
+            # Datum odsvojitve
+            w.element("F5", trade.trade_date_str)
+            # Količina odsvojenega v.p.
+            w.element("F6", "{0:.8f}".format(-trade.quantity))
+            # Vrednost ob odsvojitvi
+            w.element("F7", "{0:.8f}".format(trade.trade_price_eur))
+            w.end()
+        F8Value += trade.quantity
+        w.element("F8", "{0:.8f}".format(F8Value))
+        w.end()
+    # trades
+    w.end()
+
+def write_d_ifi_short_item(w, trades):
+    """ Popisni list (TItem) of a derivative with short positions """
+    w.start("TItem")
+    w.element("TypeId", "PLIFIShort")
+    write_d_ifi_type(w, trades[0].ifi_type)
+    w.element("Name", trades[0].name)
+    if len(trades) > 0 and trades[0].symbol is not None:
+        w.element("Code", trades[0].symbol)
+    # w.element("ISIN", trades[0].isin)
+    w.element("HasForeignTax", "false")
+
+    F8Value = 0
+    for trade in trades:
+        w.start("TShortSubItem")
+        if trade.quantity > 0:
+            w.start("Sale")
+            w.element("F1", trade.trade_date_str)
+            w.element("F2", "{0:.8f}".format(trade.quantity))
+            w.element("F3", "{0:.8f}".format(trade.trade_price_eur))
+            w.element("F9", "true" if trade.leverage > 1 else "false")
+            w.end()
+        else:
+            w.start("Purchase")
+            w.element("F4", trade.trade_date_str)
+            w.element("F5", "A")
+            w.element("F6", "{0:.8f}".format(-trade.quantity))
+            w.element("F7", "{0:.8f}".format(trade.trade_price_eur))
+            w.end()
+        F8Value += trade.quantity
+        w.element("F8", "{0:.8f}".format(F8Value))
+        w.end()
+    # trades
+    w.end()
+
+def write_d_ifi(filename, taxpayerConfig, reportYear, test, longDerivateTrades, shortDerivateTrades, cache=None):
+    """ Generate the files for Derivates """
+    statementStartDate = datetime.date(year=reportYear, month=1, day=1)
+    statementEndDate = datetime.date(year=reportYear, month=12, day=31)
+
+    with open(filename, "w", encoding="utf-8") as f:
+        w = XmlStreamWriter(f)
+        write_edp_header(w, "http://edavki.durs.si/Documents/Schemas/D_IFI_4.xsd", taxpayerConfig, test)
+        w.start("body")
+        w.element("edp:bodyContent")
+        w.start("D_IFI")
+        w.element("PeriodStart", statementStartDate.strftime(EDAVKI_DATETIME_FORMAT))
+        w.element("PeriodEnd", statementEndDate.strftime(EDAVKI_DATETIME_FORMAT))
+        w.element("TelephoneNumber", "")
+        w.element("Email", "")
+
+        fragments = cache.fragments(filename) if cache is not None else None
+        write_items(w, write_d_ifi_long_item, "PLIFI", longDerivateTrades, fragments)
+        write_items(w, write_d_ifi_short_item, "PLIFIShort", shortDerivateTrades, fragments)
+
+        w.end()
+        w.end()
+        w.end()
+    if fragments is not None:
+        fragments.save()
+
+def write_doh_div(filename, taxpayerConfig, reportYear, test, dividends):
+    """ Generate Doh-Div.xml (dividends marked as skipped are left out) """
+    with open(filename, "w", encoding="utf-8") as f:
+        w = XmlStreamWriter(f)
+        write_edp_header(w, "http://edavki.durs.si/Documents/Schemas/Doh_Div_3.xsd", taxpayerConfig, test)
+        w.start("body")
+        w.start("Doh_Div")
+        w.element("Period", str(reportYear))
+        w.end()
+
+        for dividend in dividends:
+            if "skipped" in dividend:
+                continue
 
+            w.start("Dividend")
+            w.element("Date", edavki_date(dividend["date"].toordinal()))
 
-    if not os.path.isfile("taxpayer.xml"):
-        print("Doh-Div.xml potrebuje tvojo davčno številko. Če se zmotiš, jo lahko spremeniš ročno (taxpayer.xml) ali pa kar pobrišeš taxpayer.xml in ponovno poženeš program.")
-        tax_number = input("Vnesi svojo davčno številko: ")
-        taxpayer_type = input("Tip davkoplačevalca (običajno FO, možnosti: FO - fizična oseba, PO - pravna oseba, SP - fizična oseba z dejavnostjo): ") or "FO"
-        taxpayer_type = taxpayer_type.upper()
-        f = open("taxpayer.xml", "w+", encoding="utf-8")
-        f.write(
-            "<taxpayer>\n"
-            "   <taxNumber>" + tax_number + "</taxNumber>\n"
-            "   <taxpayerType>" + taxpayer_type + "</taxpayerType>\n"
-            "</taxpayer>"
-        )
-        f.close()
-
-    if not os.path.isdir("output"):
-        os.mkdir("output")
+            if "ISIN" in dividend:
+                w.element("PayerIdentificationNumber", dividend["ISIN"])
+            if "name" in dividend and dividend["name"] != "":
+                w.element("PayerName", dividend["name"])
+            else:
+                w.element("PayerName", dividend["symbol"])
+            if "address" in dividend:
+                w.element("PayerAddress", dividend["address"])
+            if "country" in dividend:
+                w.element("PayerCountry", dividend["country"])
+            w.element("Type", "1")
+            w.element("Value", "{0:.2f}".format(dividend["gross_amount_eur"]))
+            w.element("ForeignTax", "{0:.2f}".format(dividend["withholding_tax_amount"]))
+            if "country" in dividend:
+                w.element("SourceCountry", dividend["country"])
+            # TODO: sestavi seznam oprostitvenih besedil (MP, clen...) iz https://www.gov.si/drzavni-organi/ministrstva/ministrstvo-za-finance/o-ministrstvu/direktorat-za-sistem-davcnih-carinskih-in-drugih-javnih-prihodkov/seznam-veljavnih-konvencij-o-izogibanju-dvojnega-obdavcevanja-dohodka-in-premozenja/
+            #if "reliefStatement" in dividend:
+            #    w.element("ReliefStatement", dividend["reliefStatement"])
+            #else:
+            w.element("ReliefStatement", "")
+            w.end()
+
+        w.end()
+        w.end()
+
+DEBUG_HEADER = ["Symbol", "Name", "ISIN", "Is ETF", "Action", "Trade date", "Quantity", "Trade price (EUR)"]
+SKIPPED_CRYPTO_COLUMNS = (0, 1, 4, 5, 6, 7)  # the skipped crypto sheet has no ISIN and ETF columns
+
+def debug_rows(tradeGroups):
+    for securityID in tradeGroups:
+        trades = tradeGroups[securityID]
+        is_etf = "true" if trades[0].is_etf else "false"
+        for trade in trades:
+            yield [
+                trade.symbol,
+                trade.name,
+                "",
+                is_etf,
+                "Open" if trade.quantity > 0 else "Close",
+                trade.trade_date_str,
+                trade.quantity if trade.quantity >= 0 else -trade.quantity,
+                trade.trade_price_eur
+            ]
+
+def write_debug_workbook(filename, longNormalTrades, longDerivateTrades, shortDerivateTrades, skippedCryptoTrades):
+    """ Save debug info to XLS (streamed, rows are not kept in memory) """
+    wb = Workbook(write_only=True)
+    for title, tradeGroups in (("Normal (long)", longNormalTrades), ("Derivate (long)", longDerivateTrades), ("Derivate (short)", shortDerivateTrades)):
+        sh = wb.create_sheet(title=title)
+        sh.append(DEBUG_HEADER)
+        for row in debug_rows(tradeGroups):
+            sh.append(row)
 
+    sh = wb.create_sheet(title="Skipped crypto")
+    sh.append([DEBUG_HEADER[i] for i in SKIPPED_CRYPTO_COLUMNS])
+    for row in debug_rows(skippedCryptoTrades):
+        sh.append([row[i] for i in SKIPPED_CRYPTO_COLUMNS])
 
-    """ Parse taxpayer information from the local taxpayer.xml file """
-    taxpayer = xml.etree.ElementTree.parse("taxpayer.xml").getroot()
-    taxpayerConfig = {
-        "taxNumber": taxpayer.find("taxNumber").text,
-        "taxpayerType": "FO",
-    }
+    wb.save(filename)
 
-    """ Creating daily exchange rates object """
-    bsRateXmlFilename = ("bsrate-" + str(datetime.date.today().year) + str(datetime.date.today().month) + str(datetime.date.today().day) + ".xml")
-    if not os.path.isfile(bsRateXmlFilename):
-        for file in glob.glob("bsrate-*.xml"):
-            os.remove(file)
+def write_debug_csv(filename, longNormalTrades, longDerivateTrades, shortDerivateTrades, skippedCryptoTrades):
+    """ Save debug info to CSV; the first column names the sheet of the XLSX variant """
+    with open(filename, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow(["Sheet"] + DEBUG_HEADER)
+        for title, tradeGroups in (("Normal (long)", longNormalTrades), ("Derivate (long)", longDerivateTrades),
+                                   ("Derivate (short)", shortDerivateTrades), ("Skipped crypto", skippedCryptoTrades)):
+            for row in debug_rows(tradeGroups):
+                writer.writerow([title] + row)
+
+def dividends_info_rows(dividends):
+    for dividend in dividends:
+        yield [
+            (dividend["skipped"] if "skipped" in dividend else ""),
+            edavki_date(dividend["date"].toordinal()),
+            dividend["symbol"],
+            (dividend["ISIN"] if "ISIN" in dividend else ""),
+            (dividend["name"] if not dividend["name"] is None else ""),
+            (dividend["address"] if "address" in dividend else ""),
+            (dividend["country"] if "country" in dividend else ""),
+            "{0:.8f}".format(dividend["netto_amount_eur"]),
+            "{0:.8f}".format(dividend["withholding_tax_amount"]),
+            "{0:.8f}".format(dividend["gross_amount_eur"]),
+            #dividend["currency"],
+            str(dividend["position_id"]) if not "positions" in dividend else ", ".join(map(str, dividend["positions"]))
+        ]
 
-        # urllib.request.urlretrieve(bsRateXmlUrl, bsRateXmlFilename) # doesn't work because BSI now blocks this script...
-        # FU bsi!
-        headers = {'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'}
-        req = urllib.request.Request(bsRateXmlUrl, headers=headers)
-        with urllib.request.urlopen(req) as response:
-            data = response.read()
-            with open(bsRateXmlFilename, 'wb') as f:
-                f.write(data)
-
-    bsRateXml = xml.etree.ElementTree.parse(bsRateXmlFilename).getroot()
-
-    rates = {}
-    for d in bsRateXml:
-        date = d.attrib["datum"].replace("-", "")
-        rates[date] = {}
-        for r in d:
-            currency = r.attrib["oznaka"]
-            rates[date][currency] = r.text
-
-    """ Load company info """
-    companyList = list(CompanyWorkbook(file="Company_info.xlsx").info.read())
-
-    """ Parsing of XLSX files """
-    tradesList = []
-    transactionList = []
-    dividendsList = []
-    for filename in inputFilenames:
-        wb = EToroWorkbook(file=filename)
-        tradesList.append(list(wb.closed_positions.read()))
-        transactionList.append(list(wb.transactions.read()))
-        dividendsList.append(list(wb.dividends.read()))
-
-    statementStartDate = datetime.datetime(year=reportYear, month=1, day=1)
-    statementEndDate = datetime.datetime(year=reportYear, month=12, day=31)
-
-    """ Dictionary of stock trade arrays, each key represents a group of trades of same resource """
-    longNormalTrades = {}
-    shortNormalTrades = {}
-    longDerivateTrades = {}
-    shortDerivateTrades = {}
-    skippedCryptoTrades = {}
-
-    """ Get trades from the worksheet and sort them by PositionID """
-    ETORO_DATETIME_FORMAT = None
-
-    allTradesByPositionID = {}
-    allTradesBySymbol = {}
-    positionSymbols = get_position_symbols(transactionList)
-    # when we have ISIN -> positionSymbols = update_position_symbols_from_dividends(dividendsList, companyList, positionSymbols)
+def write_dividends_info(filename, dividends):
+    """ Save dividend info to XLS (streamed); same layout as the DividendsOutputSheet template: header style, column widths, frozen header and table """
+    columns = DividendsOutputSheet().columns
+    wb = Workbook(write_only=True)
+    wb.add_named_style(NamedStyle(name="Header", font=Font(bold=True, color="FFFFFFFF"),
+                                  fill=PatternFill("solid", fgColor="FF" + DEFAULT_ACCENT_COLOR), alignment=Alignment(vertical="top")))
+    sh = wb.create_sheet(title="dividends")
+    for column in columns:
+        sh.column_dimensions[column.column_letter].width = column.width
+    sh.column_dimensions.group(start=get_column_letter(len(columns) + 1), end="XFD", outline_level=0, hidden=True)  # up to the last column
+    sh.freeze_panes = "A2"
+
+    header = []
+    for column in columns:
+        cell = WriteOnlyCell(sh, value=column.header)
+        cell.style = "Header"
+        header.append(cell)
+    sh.append(header)
+    lastRow = 1
+    for row in dividends_info_rows(dividends):
+        sh.append(row)
+        lastRow += 1
+
+    ref = "A1:{0}{1}".format(columns[-1].column_letter, max(lastRow, 2))
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")  # write-only sheets always warn about table columns, which are given here
+        sh.add_table(Table(ref=ref, displayName="dividends", autoFilter=AutoFilter(ref=ref),
+                           tableColumns=[TableColumn(id=i + 1, name=column.header) for i, column in enumerate(columns)]))
+    wb.save(filename)
 
+def write_dividends_info_csv(filename, dividends):
+    """ Save dividend info to CSV """
+    with open(filename, "w", newline="", encoding="utf-8") as f:
+        writer = csv.writer(f)
+        writer.writerow([column.header for column in DividendsOutputSheet().columns])
+        writer.writerows(dividends_info_rows(dividends))
+
+def render_outputs(tasks, jobs=1):
+    """ Runs independent render tasks (filename, function, args) concurrently; returns (filename, error) pairs in task order """
+    if jobs > 1:
+        # output writers are pure Python, so only processes render them truly in parallel
+        executor = ProcessPoolExecutor(max_workers=min(jobs, len(tasks)))
+    else:
+        executor = ThreadPoolExecutor(max_workers=len(tasks))
+    results = []
+    with executor:
+        futures = [(filename, executor.submit(function, filename, *args)) for filename, function, args in tasks]
+        for filename, future in futures:
+            try:
+                future.result()
+                results.append((filename, None))
+            except Exception as e:
+                results.append((filename, e))
+    return results
+
+def parse_report_years(value):
+    """ -y argument: a single year (2024), a range (2021-2024) or a comma separated list of both (2019,2022-2024);
+        0 stands for the previous year (the default) """
+    if value.strip() == "0":
+        return [datetime.date.today().year - 1]
+    years = set()
+    try:
+        for part in value.split(","):
+            first, _, last = part.strip().partition("-")
+            first = int(first)
+            last = int(last) if last else first
+            if not 1 <= first <= last <= 9999:
+                raise ValueError(value)
+            years.update(range(first, last + 1))
+    except ValueError:
+        raise argparse.ArgumentTypeError("neveljavno leto ali razpon let: {0}".format(value))
+    return sorted(years)
+
+TRADE_BUCKETS = ("longNormal", "shortNormal", "longDerivate", "shortDerivate", "skippedCrypto")
+TRADE_ORDER = attrgetter("trade_date", "position_id")
+
+def trade_bucket(position, reportCryptos):
+    """ One of TRADE_BUCKETS: the output file (and its section) a closed position is reported in """
+    if reportCryptos == False and position.ifi_type == "Crypto":
+        return "skippedCrypto"
+    if position.position_type not in ("long", "short"):
+        raise ConversionError("ERROR: Could not determine position type! ")
+    return position.position_type + ("Normal" if position.asset_type == "normal" else "Derivate")
+
+class TradeGroups:
+    """ Opening and closing trades of one report grouped by (bucket, instrument name) in a single pass.
+        sort() orders every group once by TRADE_ORDER, bucket() then returns the groups of one bucket
+        as {name: trades} in order of the first position of every instrument. """
+    def __init__(self):
+        self.groups = {}
+        self._buckets = None
+
+    def add(self, bucket, position):
+        key = (bucket, position.name)
+        trades = self.groups.get(key)
+        if trades is None:
+            trades = self.groups[key] = []
+        trades.append(position.open)
+        trades.append(position.close)
+        self._buckets = None
+
+    def sort(self):
+        for trades in self.groups.values():
+            trades.sort(key=TRADE_ORDER)
+
+    def bucket(self, bucket):
+        if self._buckets is None:
+            self._buckets = {name: {} for name in TRADE_BUCKETS}
+            for (groupBucket, name), trades in self.groups.items():
+                self._buckets[groupBucket][name] = trades
+        return self._buckets[bucket]
+
+    def position_ids(self, bucket, name):
+        """ Position IDs of one group as an ordered set (dictionary keys), in trade order after sort() """
+        return dict.fromkeys(trade.position_id for trade in self.groups[(bucket, name)]).keys()
+
+class YearReport:
+    """ Trades and dividends of one report year, grouped the way its output files need them """
+    def __init__(self, year, directory):
+        self.year = year
+        self.directory = directory
+        self.trades = TradeGroups()
+        self.dividends = []
+
+    """ Dictionaries of trade arrays, each key represents a group of trades of same resource """
+    longNormalTrades = property(lambda self: self.trades.bucket("longNormal"))
+    shortNormalTrades = property(lambda self: self.trades.bucket("shortNormal"))
+    longDerivateTrades = property(lambda self: self.trades.bucket("longDerivate"))
+    shortDerivateTrades = property(lambda self: self.trades.bucket("shortDerivate"))
+    skippedCryptoTrades = property(lambda self: self.trades.bucket("skippedCrypto"))
+
+    def add_position(self, position, reportCryptos):
+        self.trades.add(trade_bucket(position, reportCryptos), position)
+
+    def sort_trades(self):
+        """ Sort trades by trade date and position ID """
+        self.trades.sort()
+
+    def render_tasks(self, taxpayerConfig, test, controlFiles="xlsx", cache=None):
+        """ (filename, writer, arguments) of the output files; controlFiles is one of CONTROL_FILE_FORMATS.
+            With a StatementCache the Doh-KDVP and D-IFI writers re-render only instruments changed since the previous run. """
+        directory = self.directory
+        debugTrades = (self.longNormalTrades, self.longDerivateTrades, self.shortDerivateTrades, self.skippedCryptoTrades)
+        tasks = [
+            ("{0}/Doh-KDVP.xml".format(directory), write_doh_kdvp, (taxpayerConfig, self.year, test, self.longNormalTrades, self.shortNormalTrades, cache)),
+            ("{0}/D-IFI.xml".format(directory), write_d_ifi, (taxpayerConfig, self.year, test, self.longDerivateTrades, self.shortDerivateTrades, cache)),
+            ("{0}/Doh-Div.xml".format(directory), write_doh_div, (taxpayerConfig, self.year, test, self.dividends)),
+        ]
+        if controlFiles == "xlsx":
+            tasks.insert(0, ("{0}/Debug-{1}.xlsx".format(directory, self.year), write_debug_workbook, debugTrades))
+            tasks.append(("{0}/Dividende-info-{1}.xlsx".format(directory, self.year), write_dividends_info, (self.dividends,)))
+        elif controlFiles == "csv":
+            tasks.insert(0, ("{0}/Debug-{1}.csv".format(directory, self.year), write_debug_csv, debugTrades))
+            tasks.append(("{0}/Dividende-info-{1}.csv".format(directory, self.year), write_dividends_info_csv, (self.dividends,)))
+        return tasks
+
+class StageProfiler:
+    """ Wall time, CPU time, row count and peak traced memory of every pipeline stage (--profile).
+        Stages must not be nested; with cprofile the slowest stage is also profiled function by function.
+        Tracing memory slows allocation heavy stages (XLSX parsing) down several times, without it peak_mb stays None. """
+    def __init__(self, memory=True, cprofile=False):
+        self.memory = memory
+        self.cprofile = cprofile
+        self.stages = []
+        self.peak = 0
+        self._slowest = None  # (wall time, stage name, cProfile.Profile)
+        self._started = (time.perf_counter(), time.process_time())
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    @contextlib.contextmanager
+    def stage(self, name, rows=None):
+        """ Measures the block; the yielded record takes the row count if it is only known at the end """
+        record = {"stage": name, "rows": rows}
+        profile = cProfile.Profile() if self.cprofile else None
+        if self.memory:
+            tracemalloc.reset_peak()
+            memory = tracemalloc.get_traced_memory()[0]
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        if profile is not None:
+            profile.enable()
+        try:
+            yield record
+        finally:
+            if profile is not None:
+                profile.disable()
+            record["wall"] = time.perf_counter() - wall
+            record["cpu"] = time.process_time() - cpu
+            record["peak_mb"] = None
+            if self.memory:
+                peak = tracemalloc.get_traced_memory()[1]
+                record["peak_mb"] = (peak - memory) / (1024 * 1024)
+                self.peak = max(self.peak, peak)
+            self.stages.append(record)
+            if profile is not None and (self._slowest is None or record["wall"] > self._slowest[0]):
+                self._slowest = (record["wall"], name, profile)
+
+    def slowest(self):
+        return max(self.stages, key=lambda record: record["wall"]) if self.stages else None
+
+    def write(self, filename, **info):
+        """ Writes the JSON report (and the cProfile dump of the slowest stage next to it); returns written filenames """
+        report = dict(info)
+        report["version"] = APP_VER
+        report["created"] = datetime.datetime.now().isoformat(timespec="seconds")
+        report["total"] = {
+            "wall": time.perf_counter() - self._started[0],
+            "cpu": time.process_time() - self._started[1],  # without worker processes (-j)
+            "peak_mb": self.peak / (1024 * 1024) if self.memory else None,
+        }
+        report["stages"] = self.stages
+        written = [filename]
+        if self._slowest is not None:
+            dumpFilename = os.path.splitext(filename)[0] + ".prof"
+            self._slowest[2].dump_stats(dumpFilename)
+            report["cprofile"] = {"stage": self._slowest[1], "file": os.path.basename(dumpFilename)}
+            written.append(dumpFilename)
+        with open(filename, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        return written
+
+def profile_stage(profiler, name, rows=None):
+    """ Stage of the given profiler, or a no-op context when profiling is off """
+    if profiler is None:
+        return contextlib.nullcontext({})
+    return profiler.stage(name, rows)
+
+Statements = namedtuple("Statements", ["trades", "transactions", "dividends"])  # sheets (row iterables) per statement file
+NormalizedStatements = namedtuple("NormalizedStatements", ["positions", "dividends", "missing_info"])
+
+def merge_sheets(sheets, key, sortKey=None):
+    """ Merges the same sheet of several statements into one stream: k-way by sortKey (sheets are date ordered) and without
+        rows another statement already reported. A natural key repeated within one statement is kept as often as it repeats there. """
+    sheets = [sheet for sheet in sheets if sheet is not None]
+    streams = [zip(itertools.repeat(index), sheet) for index, sheet in enumerate(sheets)]
+    if sortKey is None:
+        merged = itertools.chain(*streams)
+    else:
+        merged = heapq.merge(*streams, key=lambda item: sortKey(item[1]))
+
+    counts = {}  # natural key -> occurrences in each statement
+    for index, row in merged:
+        rowKey = key(row)
+        occurrences = counts.get(rowKey)
+        if occurrences is None:
+            occurrences = counts[rowKey] = [0] * len(sheets)
+        if occurrences[index] == max(occurrences):
+            yield row
+        occurrences[index] += 1
+
+# natural keys of the statement rows and the order of the sheets
+MERGE_KEYS = {
+    "trades": (attrgetter("position_id"), attrgetter("close_date")),
+    "transactions": (attrgetter("details", "position_id"), None),
+    "dividends": (attrgetter("date", "position_id", "net_dividend", "withholding_tax_amount"), attrgetter("date")),
+}
+
+def merge_statements(statements, profiler=None):
+    """ Overlapping statements (e.g. 2020-2024 and 2024-2025 exports) as a single statement with every row once.
+        A single statement is passed through unchanged. """
+    if len([sheet for sheet in statements.trades if sheet is not None]) <= 1:
+        return statements
+
+    merged = {}
+    for field, (key, sortKey) in MERGE_KEYS.items():
+        sheet = merge_sheets(getattr(statements, field), key, sortKey)
+        if profiler is not None:
+            with profiler.stage("merge " + field) as record:
+                sheet = list(sheet)
+                record["rows"] = len(sheet)
+        merged[field] = [sheet]
+    return Statements(**merged)
+
+def unique_statements(filenames):
+    """ Input files without repeats of the same content (a file given twice, or a copy of it) """
+    if len(filenames) <= 1:
+        return list(filenames)
+    seen = set()
+    unique = []
+    for filename in filenames:
+        key = StatementCache.key(filename)
+        if key not in seen:
+            seen.add(key)
+            unique.append(filename)
+    return unique
+
+def load_statements(filenames, cache=None, jobs=1, profiler=None, years=None):
+    """ Stage 1: opens the statements; sheets are streamed lazily, or read in a process pool when jobs > 1.
+        With a profiler every sheet is read into a list in its own stage instead. Overlapping statements are merged.
+        With years only closed positions and dividends of those years (and account activity up to their end) are read.
+        Files with the same content are read once. """
+    filenames = unique_statements(filenames)
+    if profiler is not None:
+        sheets = []
+        for filename in filenames:
+            statement = EToroStatement(filename, cache, years)
+            for name, reader in (("Closed Positions", statement.closed_positions), ("Account Activity", statement.transactions),
+                                 ("Dividends", statement.dividends)):
+                with profiler.stage("read {0}: {1}".format(os.path.basename(filename), name)) as record:
+                    rows = list(reader())
+                    record["rows"] = len(rows)
+                sheets.append(rows)
+        return merge_statements(Statements(sheets[0::3], sheets[1::3], sheets[2::3]), profiler)
+
+    if jobs > 1 and len(filenames) > 1:
+        """ Parsing of XLSX files in a process pool; results are merged back in input order """
+        with ProcessPoolExecutor(max_workers=min(jobs, len(filenames))) as executor:
+            parsedStatements = list(executor.map(read_statement, filenames, [cache] * len(filenames), [years] * len(filenames)))
+        tradesList = [parsed[0] for parsed in parsedStatements]
+        transactionList = [parsed[1] for parsed in parsedStatements]
+        dividendsList = [parsed[2] for parsed in parsedStatements]
+    else:
+        """ Streaming of XLSX files (each sheet is read lazily when it is first iterated) """
+        statements = [EToroStatement(filename, cache, years) for filename in filenames]
+        tradesList = [statement.closed_positions() for statement in statements]
+        transactionList = [statement.transactions() for statement in statements]
+        dividendsList = [statement.dividends() for statement in statements]
+
+    return merge_statements(Statements(tradesList, transactionList, dividendsList))
+
+def normalize_positions(tradesList, positionSymbols, years, rates):
+    """ Closed positions of the report years as Position records with open and close prices in EUR.
+        Rows are decoded first; prices are then computed column-wise for all of them at once. """
+    tradeRows = []
+    amounts = []
+    unitsColumn = []
+    profits = []
+    leverages = []
+    directions = []
+    openOrdinals = []
+    closeOrdinals = []
     for tradeSheet in tradesList:
         if tradeSheet is None:
             continue
 
         for xlsTrade in tradeSheet:
-            # determine etoro datetime format
-            if ETORO_DATETIME_FORMAT is None:
-                ETORO_DATETIME_FORMAT, float_with_comma = determine_date_format_and_comma(xlsTrade.close_date)
-
-            close_date = datetime.datetime.strptime(xlsTrade.close_date, ETORO_DATETIME_FORMAT)
-            if close_date.year != reportYear:
+            close_date = xlsTrade.close_date
+            if close_date.year not in years:
                 # print("Skipping trade (year: " + str(close_date.year) + "): " + str(xlsTrade))
                 continue
 
-            open_date = datetime.datetime.strptime(xlsTrade.open_date, ETORO_DATETIME_FORMAT)  # ex.: 02/06/2020 13:57
+            open_date = xlsTrade.open_date  # ex.: 02/06/2020 13:57
 
             action = xlsTrade.action.split(" ", 1)
             #buy_sell = action[0]
@@ -404,7 +1916,7 @@ def main():
             else:
                 buy_sell = xlsTrade.long_short
 
-            position_id = int(xlsTrade.position_id)
+            position_id = xlsTrade.position_id
             name = action[1]
 
             symbol = positionSymbols[position_id] if position_id in positionSymbols else None
@@ -415,564 +1927,99 @@ def main():
 
             ifi_type = xlsTrade.type
 
-            try:
-                leverage = int(xlsTrade.leverage) if xlsTrade.leverage is not None else 0
-            except ValueError:
-                leverage = 1
-
-            if leverage is not None and leverage > 1:
-                amount = str2float(xlsTrade.amount) * leverage
-            else:
-                amount = str2float(xlsTrade.amount)
-            units = str2float(xlsTrade.units)
-            profit = str2float(xlsTrade.profit)
-
-            # open & close prices are bogus in eToro statement... calculate it from amount and profit
-            #open_price = str2float(xlsTrade.open_rate)
-            #close_price = str2float(xlsTrade.close_rate)
-
-            open_price = amount / units
-            close_price = 0
-            if buy_sell == "Buy":
-                close_price = (amount + profit) / units
-            elif buy_sell == "Sell":
-                close_price = (amount - profit) / units
-
-            open_rate = get_exchange_rate(rates, open_date, ETORO_CURRENCY)
-            if get_exchange_rate(rates, close_date, ETORO_CURRENCY) is None:
-                print("")
-            close_rate = get_exchange_rate(rates, close_date, ETORO_CURRENCY)
-
-            open_price_eur = open_price / open_rate
-            close_price_eur = close_price / close_rate
-
-            if buy_sell == "Buy":
-                position_type = "long"
-            elif buy_sell == "Sell":
-                position_type = "short"
-            else:
-                print("ERROR: Could not determine position type! ")
-                sys.exit(-1)
-
-            if ifi_type in derivateAssets:
-                asset_type = "derivate"
-            elif ifi_type in normalAssets:
-                if leverage > 1:
-                    print("ERROR: Leverage > 1 but asset type is not a derivate: {0}. Please report it on github.".format(ifi_type))
-                    sys.exit(-1)
-                asset_type = "normal"
-            else:
-                print("ERROR: Unknown asset type: {0}. Please report it on github.".format(ifi_type))
-                sys.exit(-1)
-
-            is_etf = ifi_type == "ETF"
-
-            trade_open = {
-                "position_id": position_id,
-                "symbol": symbol,
-                "position_type": position_type,
-                "name": name,
-                "is_etf": is_etf,
-                "ifi_type": ifi_type,
-                "leverage": leverage,
-                "asset_type": asset_type,
-                "quantity": units,
-                "trade_date": open_date,
-                "trade_price_eur": open_price_eur,
-                ##"isin": xlsTrade.isin,
-
-                # extra info
-                "open_price_eur": open_price_eur,
-                "close_price_eur": close_price_eur,
-                "open_date": open_date,
-                "close_date": close_date,
-            }
-
-            trade_close = {
-                "position_id": position_id,
-                "symbol": symbol,
-                "position_type": position_type,
-                "name": name,
-                "is_etf": is_etf,
-                "ifi_type": ifi_type,
-                "leverage": leverage,
-                "asset_type": asset_type,
-                "quantity": -units,
-                "trade_date": close_date,
-                "trade_price_eur": close_price_eur,
-                ## "isin": xlsTrade.isin,
-
-                # extra info
-                "open_price_eur": open_price_eur,
-                "close_price_eur": close_price_eur,
-                "open_date": open_date,
-                "close_date": close_date,
-            }
-
-            allTradesByPositionID[position_id] = trade_open
-            if symbol is not None:
-                allTradesBySymbol[symbol] = trade_open
-
-
-            if reportCryptos == False and ifi_type == "Crypto":
-                if name in skippedCryptoTrades.keys():
-                    skippedCryptoTrades[name].extend([trade_open, trade_close])
-                else:
-                    skippedCryptoTrades[name] = [trade_open, trade_close]
-                continue
-
-
-            if asset_type == "normal":
-                if position_type == "long":
-                    if name in longNormalTrades.keys():
-                        longNormalTrades[name].extend([trade_open, trade_close])
-                    else:
-                        longNormalTrades[name] = [trade_open, trade_close]
-                elif position_type == "short":
-                    if name in shortNormalTrades.keys():
-                        shortNormalTrades[name].extend([trade_open, trade_close])
-                    else:
-                        shortNormalTrades[name] = [trade_open, trade_close]
-                else:
-                    print("ERROR: Could not determine position type! ")
-                    sys.exit(-1)
-
-            else:
-                if position_type == "long":
-                    if name in longDerivateTrades.keys():
-                        longDerivateTrades[name].extend([trade_open, trade_close])
-                    else:
-                        longDerivateTrades[name] = [trade_open, trade_close]
-                elif position_type == "short":
-                    if name in shortDerivateTrades.keys():
-                        shortDerivateTrades[name].extend([trade_open, trade_close])
-                    else:
-                        shortDerivateTrades[name] = [trade_open, trade_close]
-                else:
-                    print("ERROR: Could not determine position type! ")
-                    sys.exit(-1)
-
-            """ else:
-                sys.exit(
-                    "Error: cannot figure out if trade is Normal or Derivate, Long or Short"
-                ) """
-
-    """ Sort trades by position ID """
-    for securityID in longNormalTrades:
-        longNormalTrades[securityID].sort(key=itemgetter('trade_date', 'position_id'))
-    for securityID in shortNormalTrades:
-        shortNormalTrades[securityID].sort(key=itemgetter('trade_date', 'position_id'))
-    for securityID in longDerivateTrades:
-        longDerivateTrades[securityID].sort(key=itemgetter('trade_date', 'position_id'))
-    for securityID in shortDerivateTrades:
-        shortDerivateTrades[securityID].sort(key=itemgetter('trade_date', 'position_id'))
-
-    for securityID in skippedCryptoTrades:
-        skippedCryptoTrades[securityID].sort(key=itemgetter('trade_date', 'position_id'))
-
-
-
-    """ Save debug info to XLS """
-    wb = Workbook()
-    sh = wb.create_sheet(title="Normal (long)")
-    sh.append([ "Symbol", "Name", "ISIN", "Is ETF", "Action", "Trade date", "Quantity", "Trade price (EUR)" ])
-    for securityID in longNormalTrades:
-        trades = longNormalTrades[securityID]
-        for trade in trades:
-            sh.append([
-                trade["symbol"],
-                trade["name"],
-                trade["isin"] if "isin" in trade else "",
-                "true" if trades[0]["is_etf"] else "false",
-                "Open" if trade["quantity"] > 0 else "Close",
-                trade["trade_date"].strftime(EDAVKI_DATETIME_FORMAT),
-                trade["quantity"] if trade["quantity"] >= 0 else -trade["quantity"],
-                trade["trade_price_eur"]
-            ])
-
-    sh = wb.create_sheet(title="Derivate (long)")
-    sh.append([ "Symbol", "Name", "ISIN", "Is ETF", "Action", "Trade date", "Quantity", "Trade price (EUR)" ])
-    for securityID in longDerivateTrades:
-        trades = longDerivateTrades[securityID]
-        for trade in trades:
-            sh.append([
-                trade["symbol"],
-                trade["name"],
-                trade["isin"] if "isin" in trade else "",
-                "true" if trades[0]["is_etf"] else "false",
-                "Open" if trade["quantity"] > 0 else "Close",
-                trade["trade_date"].strftime(EDAVKI_DATETIME_FORMAT),
-                trade["quantity"] if trade["quantity"] >= 0 else -trade["quantity"],
-                trade["trade_price_eur"]
-            ])
-
-
-    sh = wb.create_sheet(title="Derivate (short)")
-    sh.append([ "Symbol", "Name", "ISIN", "Is ETF", "Action", "Trade date", "Quantity", "Trade price (EUR)" ])
-    for securityID in shortDerivateTrades:
-        trades = shortDerivateTrades[securityID]
-        for trade in trades:
-            sh.append([
-                trade["symbol"],
-                trade["name"],
-                trade["isin"] if "isin" in trade else "",
-                "true" if trades[0]["is_etf"] else "false",
-                "Open" if trade["quantity"] > 0 else "Close",
-                trade["trade_date"].strftime(EDAVKI_DATETIME_FORMAT),
-                trade["quantity"] if trade["quantity"] >= 0 else -trade["quantity"],
-                trade["trade_price_eur"]
-            ])
-
-
-    sh = wb.create_sheet(title="Skipped crypto")
-    sh.append([ "Symbol", "Name", "Action", "Trade date", "Quantity", "Trade price (EUR)" ])
-    for securityID in skippedCryptoTrades:
-        trades = skippedCryptoTrades[securityID]
-        for trade in trades:
-            sh.append([
-                trade["symbol"],
-                trade["name"],
-                "Open" if trade["quantity"] > 0 else "Close",
-                trade["trade_date"].strftime(EDAVKI_DATETIME_FORMAT),
-                trade["quantity"] if trade["quantity"] >= 0 else -trade["quantity"],
-                trade["trade_price_eur"]
-            ])
-
-    filename = "output/Debug-{0}.xlsx".format(reportYear)
-    wb.save(filename)
-    print("{0} created ".format(filename))
-
-
-
-    ###########
-    ########### Doh-KDVP
-    ###########
-
-    """ Generate the files for Normal """
-    envelope = xml.etree.ElementTree.Element("Envelope", xmlns="http://edavki.durs.si/Documents/Schemas/Doh_KDVP_9.xsd")
-    envelope.set("xmlns:edp", "http://edavki.durs.si/Documents/Schemas/EDP-Common-1.xsd")
-    header = xml.etree.ElementTree.SubElement(envelope, "edp:Header")
-    taxpayer = xml.etree.ElementTree.SubElement(header, "edp:taxpayer")
-    xml.etree.ElementTree.SubElement(taxpayer, "edp:taxNumber").text = taxpayerConfig["taxNumber"]
-    xml.etree.ElementTree.SubElement(taxpayer, "edp:taxpayerType").text = taxpayerConfig["taxpayerType"]
-    Workflow = xml.etree.ElementTree.SubElement(header, "edp:Workflow")
-    if test:
-        xml.etree.ElementTree.SubElement(Workflow, "edp:DocumentWorkflowID").text = "I"
-    else:
-        xml.etree.ElementTree.SubElement(Workflow, "edp:DocumentWorkflowID").text = "O"
-    xml.etree.ElementTree.SubElement(envelope, "edp:AttachmentList")
-    xml.etree.ElementTree.SubElement(envelope, "edp:Signatures")
-
-    body = xml.etree.ElementTree.SubElement(envelope, "body")
-    xml.etree.ElementTree.SubElement(body, "edp:bodyContent")
-    Doh_KDVP = xml.etree.ElementTree.SubElement(body, "Doh_KDVP")
-    KDVP = xml.etree.ElementTree.SubElement(Doh_KDVP, "KDVP")
-    if test:
-        xml.etree.ElementTree.SubElement(KDVP, "DocumentWorkflowID").text = "I"
-    else:
-        xml.etree.ElementTree.SubElement(KDVP, "DocumentWorkflowID").text = "O"
-    xml.etree.ElementTree.SubElement(KDVP, "Year").text = str(reportYear)
-    xml.etree.ElementTree.SubElement(KDVP, "PeriodStart").text = statementStartDate.strftime(EDAVKI_DATETIME_FORMAT)
-    xml.etree.ElementTree.SubElement(KDVP, "PeriodEnd").text = statementEndDate.strftime(EDAVKI_DATETIME_FORMAT)
-    xml.etree.ElementTree.SubElement(KDVP, "IsResident").text = "true"
-    xml.etree.ElementTree.SubElement(KDVP, "SecurityCount").text = str(len(longNormalTrades))
-    xml.etree.ElementTree.SubElement(KDVP, "SecurityShortCount").text = str(len(shortNormalTrades))
-    xml.etree.ElementTree.SubElement(KDVP, "SecurityWithContractCount").text = "0"
-    xml.etree.ElementTree.SubElement(KDVP, "SecurityWithContractShortCount").text = "0"
-    xml.etree.ElementTree.SubElement(KDVP, "ShareCount").text = "0"
-
-    for securityID in longNormalTrades:
-        trades = longNormalTrades[securityID]
-        KDVPItem = xml.etree.ElementTree.SubElement(Doh_KDVP, "KDVPItem")
-        InventoryListType = xml.etree.ElementTree.SubElement(KDVPItem, "InventoryListType").text = "PLVP"
-        Name = xml.etree.ElementTree.SubElement(KDVPItem, "Name").text = trades[0]["name"]
-        HasForeignTax = xml.etree.ElementTree.SubElement(KDVPItem, "HasForeignTax").text = "false"
-        HasLossTransfer = xml.etree.ElementTree.SubElement(KDVPItem, "HasLossTransfer").text = "false"
-        ForeignTransfer = xml.etree.ElementTree.SubElement(KDVPItem, "ForeignTransfer").text = "false"
-        TaxDecreaseConformance = xml.etree.ElementTree.SubElement(KDVPItem, "TaxDecreaseConformance").text = "false"
-        Securities = xml.etree.ElementTree.SubElement(KDVPItem, "Securities")
-        # We need to enter either ISIN, Code or Name
-        # ISIN = xml.etree.ElementTree.SubElement(Securities, "ISIN").text = trades[0]["isin"]
-        if len(trades) > 0 and "symbol" in trades[0] and trades[0]["symbol"] is not None:
-            Code = xml.etree.ElementTree.SubElement(Securities, "Code").text = trades[0]["symbol"][:10]
-        Name = xml.etree.ElementTree.SubElement(Securities, "Name").text = trades[0]["name"]
-        IsFond = xml.etree.ElementTree.SubElement(Securities, "IsFond").text = "true" if trades[0]["is_etf"] else "false"
-
-        F8Value = 0
-        n = -1
-        for trade in trades:
-            n += 1
-            Row = xml.etree.ElementTree.SubElement(Securities, "Row")
-            ID = xml.etree.ElementTree.SubElement(Row, "ID").text = str(n)
-            if trade["quantity"] > 0:
-                PurchaseSale = xml.etree.ElementTree.SubElement(Row, "Purchase")
-                # Datum pridobitve
-                F1 = xml.etree.ElementTree.SubElement(PurchaseSale, "F1").text = trade["trade_date"].strftime(EDAVKI_DATETIME_FORMAT)
-                # Način pridobitve: A - vložek kapitala, B - nakup, C - povečanje kapitala družbe z lastnimi sredstvi zavezanca,
-                # D - povečanje kapitala družbe iz sredstev družbe, E - zamenjava kapitala ob statusnih spremembah družbe, F - dedovanje,
-                # G - darilo, H - drugo, I - povečanje kapitalskega deleža v osebni družbi zaradi pripisa dobička kapitalskemu deležu
-                F2 = xml.etree.ElementTree.SubElement(PurchaseSale, "F2").text = "B"
-                # Količina
-                F3 = xml.etree.ElementTree.SubElement(PurchaseSale, "F3").text = "{0:.8f}".format(trade["quantity"])
-                # Nabavna vrednost ob pridobitvi (na enoto)
-                F4 = xml.etree.ElementTree.SubElement(PurchaseSale, "F4").text = "{0:.8f}".format(trade["trade_price_eur"])
-                # Plačan davek na dediščine in darila (F2 == F | G)
-                F5 = xml.etree.ElementTree.SubElement(PurchaseSale, "F5").text = "0.0000"
-            elif trade["quantity"] == 0:
-                print("Error! Trade units == 0! " + str(trade))
-            else:
-                PurchaseSale = xml.etree.ElementTree.SubElement(Row, "Sale")
-                # Datum odsvojitve
-                F6 = xml.etree.ElementTree.SubElement(PurchaseSale, "F6").text = trade["trade_date"].strftime(EDAVKI_DATETIME_FORMAT)
-                # Količina odsvojenega v.p.
-                F7 = xml.etree.ElementTree.SubElement(PurchaseSale, "F7").text = "{0:.8f}".format(-trade["quantity"])
-                # Vrednost ob osvojitvi (na enoto)
-                F9 = xml.etree.ElementTree.SubElement(PurchaseSale, "F9").text = "{0:.8f}".format(trade["trade_price_eur"])
-                # Pravilo iz drugega odstavka v povezavi s petim odstavkom 97.člena ZDoh-2
-                # TODO:
-                #F10 = xml.etree.ElementTree.SubElement(PurchaseSale, "F10").text = "NE"
-            # Trenutna zaloga
-            F8Value += trade["quantity"]
-            F8 = xml.etree.ElementTree.SubElement(Row, "F8").text = "{0:.8f}".format(F8Value)
-        # trades
-    # longNormalTrades
-
-    for securityID in shortNormalTrades:
-        trades = shortNormalTrades[securityID]
-        KDVPItem = xml.etree.ElementTree.SubElement(Doh_KDVP, "KDVPItem")
-        InventoryListType = xml.etree.ElementTree.SubElement(KDVPItem, "InventoryListType").text = "PLVPSHORT"
-        Name = xml.etree.ElementTree.SubElement(KDVPItem, "Name").text = trades[0]["name"]
-        HasForeignTax = xml.etree.ElementTree.SubElement(KDVPItem, "HasForeignTax").text = "false"
-        HasLossTransfer = xml.etree.ElementTree.SubElement(KDVPItem, "HasLossTransfer").text = "false"
-        ForeignTransfer = xml.etree.ElementTree.SubElement(KDVPItem, "ForeignTransfer").text = "false"
-        TaxDecreaseConformance = xml.etree.ElementTree.SubElement(KDVPItem, "TaxDecreaseConformance").text = "false"
-        SecuritiesShort = xml.etree.ElementTree.SubElement(KDVPItem, "SecuritiesShort")
-        # We need to enter either ISIN, Code or Name
-        #ISIN = xml.etree.ElementTree.SubElement(SecuritiesShort, "ISIN").text = trades[0]["isin"]
-        if len(trades) > 0 and "symbol" in trades[0] and trades[0]["symbol"] is not None:
-            Code = xml.etree.ElementTree.SubElement(SecuritiesShort, "Code").text = trades[0]["symbol"][:10]
-        Name = xml.etree.ElementTree.SubElement(SecuritiesShort, "Name").text = trades[0]["name"]
-        IsFond = xml.etree.ElementTree.SubElement(SecuritiesShort, "IsFond").text = "true" if trades[0]["is_etf"] else "false"
-
-        F8Value = 0
-        n = -1
-        for trade in trades:
-            n += 1
-            Row = xml.etree.ElementTree.SubElement(SecuritiesShort, "Row")
-            ID = xml.etree.ElementTree.SubElement(Row, "ID").text = str(n)
-            if trade["quantity"] > 0:
-                PurchaseSale = xml.etree.ElementTree.SubElement(Row, "Purchase")
-                F1 = xml.etree.ElementTree.SubElement(PurchaseSale, "F1").text = trade["trade_date"].strftime(EDAVKI_DATETIME_FORMAT)
-                F2 = xml.etree.ElementTree.SubElement(PurchaseSale, "F2").text = "A"
-                F3 = xml.etree.ElementTree.SubElement(PurchaseSale, "F3").text = "{0:.8f}".format(trade["quantity"])
-                F4 = xml.etree.ElementTree.SubElement(PurchaseSale, "F4").text = "{0:.8f}".format(trade["trade_price_eur"])
-                F5 = xml.etree.ElementTree.SubElement(PurchaseSale, "F5").text = "0.0000"
-            else:
-                PurchaseSale = xml.etree.ElementTree.SubElement(Row, "Sale")
-                F6 = xml.etree.ElementTree.SubElement(PurchaseSale, "F6").text = trade["trade_date"].strftime(EDAVKI_DATETIME_FORMAT)
-                F7 = xml.etree.ElementTree.SubElement(PurchaseSale, "F7").text = "{0:.8f}".format(-trade["quantity"])
-                F9 = xml.etree.ElementTree.SubElement(PurchaseSale, "F9").text = "{0:.8f}".format(trade["trade_price_eur"])
-                # Pravilo iz drugega odstavka v povezavi s petim odstavkom 97.člena ZDoh-2
-                # TODO:
-                # F10 = xml.etree.ElementTree.SubElement(PurchaseSale, "F10").text = "NE"
-            # Trenutna zaloga
-            F8Value += trade["quantity"]
-            F8 = xml.etree.ElementTree.SubElement(Row, "F8").text = "{0:.8f}".format(F8Value)
-        # trades
-    # shortNormalTrades
-
-    xmlString = xml.etree.ElementTree.tostring(envelope)
-    prettyXmlString = minidom.parseString(xmlString).toprettyxml(indent="\t")
-    with open("output/Doh-KDVP.xml", "w", encoding="utf-8") as f:
-        f.write(prettyXmlString)
-        print("output/Doh-KDVP.xml created")
-
-
-    print("")
-
-    for securityID in skippedCryptoTrades:
-        trades = skippedCryptoTrades[securityID]
-        ids = []
-        name = trades[0]["name"]
-        symbol = trades[0]["symbol"]
-        for trade in trades:
-            if trade["position_id"] not in ids:
-                ids.append(trade["position_id"])
-
-        ids = ','.join(map(str, ids))
-        print("Crypto: skipped {0}/{1} ({2})".format(name, symbol, ids))
-
-    print("")
-
-    ###########
-    ########### D-IFI
-    ###########
-
-    """ Generate the files for Derivates """
-    envelope = xml.etree.ElementTree.Element("Envelope", xmlns="http://edavki.durs.si/Documents/Schemas/D_IFI_4.xsd")
-    envelope.set("xmlns:edp", "http://edavki.durs.si/Documents/Schemas/EDP-Common-1.xsd")
-    header = xml.etree.ElementTree.SubElement(envelope, "edp:Header")
-    taxpayer = xml.etree.ElementTree.SubElement(header, "edp:taxpayer")
-    xml.etree.ElementTree.SubElement(taxpayer, "edp:taxNumber").text = taxpayerConfig["taxNumber"]
-    xml.etree.ElementTree.SubElement(taxpayer, "edp:taxpayerType").text = taxpayerConfig["taxpayerType"]
-    Workflow = xml.etree.ElementTree.SubElement(header, "edp:Workflow")
-    if test:
-        xml.etree.ElementTree.SubElement(Workflow, "edp:DocumentWorkflowID").text = "I"
-    else:
-        xml.etree.ElementTree.SubElement(Workflow, "edp:DocumentWorkflowID").text = "O"
-    xml.etree.ElementTree.SubElement(envelope, "edp:AttachmentList")
-    xml.etree.ElementTree.SubElement(envelope, "edp:Signatures")
-
-
-    body = xml.etree.ElementTree.SubElement(envelope, "body")
-    xml.etree.ElementTree.SubElement(body, "edp:bodyContent")
-    difi = xml.etree.ElementTree.SubElement(body, "D_IFI")
-    xml.etree.ElementTree.SubElement(difi, "PeriodStart").text = statementStartDate.strftime(EDAVKI_DATETIME_FORMAT)
-    xml.etree.ElementTree.SubElement(difi, "PeriodEnd").text = statementEndDate.strftime(EDAVKI_DATETIME_FORMAT)
-    xml.etree.ElementTree.SubElement(difi, "TelephoneNumber").text = ""
-    xml.etree.ElementTree.SubElement(difi, "Email").text = ""
-
-    n = 0
-    for securityID in longDerivateTrades:
-        trades = longDerivateTrades[securityID]
-        n += 1
-
-        TItem = xml.etree.ElementTree.SubElement(difi, "TItem")
-        TypeId = xml.etree.ElementTree.SubElement(TItem, "TypeId").text = "PLIFI"
-        if trades[0]["ifi_type"] == "FUT":
-            Type = xml.etree.ElementTree.SubElement(TItem, "Type").text = "01"
-            TypeName = xml.etree.ElementTree.SubElement(TItem, "TypeName").text = "terminska pogodba"
-        elif trades[0]["ifi_type"] == "CFD":
-            Type = xml.etree.ElementTree.SubElement(TItem, "Type").text = "02"
-            TypeName = xml.etree.ElementTree.SubElement(TItem, "TypeName").text = "finančne pogodbe na razliko"
-        elif trades[0]["ifi_type"] == "OPT":
-            Type = xml.etree.ElementTree.SubElement(TItem, "Type").text = "03"
-            TypeName = xml.etree.ElementTree.SubElement(TItem, "TypeName").text = "opcija in certifikat"
+            leverage = xlsTrade.leverage
+
+            amounts.append(xlsTrade.amount)
+            units = xlsTrade.units
+            unitsColumn.append(units)
+            profits.append(xlsTrade.profit)
+            leverages.append(leverage)
+            directions.append(1 if buy_sell == "Buy" else -1 if buy_sell == "Sell" else 0)
+            openOrdinals.append(open_date.toordinal())
+            closeOrdinals.append(close_date.toordinal())
+            tradeRows.append((position_id, name, symbol, ifi_type, leverage, buy_sell, units, open_date, close_date))
+
+    if openOrdinals:
+        rates.extend_to(datetime.date.fromordinal(min(openOrdinals)))
+    # open & close prices are bogus in eToro statement... calculate it from amount and profit
+    openPricesEur, closePricesEur = normalize_trades(amounts, unitsColumn, profits, leverages, directions, openOrdinals, closeOrdinals, rates)
+
+    positions = []
+
+    for (position_id, name, symbol, ifi_type, leverage, buy_sell, units, open_date, close_date), open_price_eur, close_price_eur \
+            in zip(tradeRows, openPricesEur, closePricesEur):
+        if buy_sell == "Buy":
+            position_type = "long"
+        elif buy_sell == "Sell":
+            position_type = "short"
         else:
-            Type = xml.etree.ElementTree.SubElement(TItem, "Type").text = "04"
-            TypeName = xml.etree.ElementTree.SubElement(TItem, "TypeName").text = "drugo"
-
-        Name = xml.etree.ElementTree.SubElement(TItem, "Name").text = trades[0]["name"]
-        if len(trades) > 0 and "symbol" in trades[0] and trades[0]["symbol"] is not None:
-            Code = xml.etree.ElementTree.SubElement(TItem, "Code").text = trades[0]["symbol"]
-        #ISIN = xml.etree.ElementTree.SubElement(TItem, "ISIN").text = trades[0]["isin"]
-        HasForeignTax = xml.etree.ElementTree.SubElement(TItem, "HasForeignTax").text = "false"
-
-        F8Value = 0
-        for trade in trades:
-            TSubItem = xml.etree.ElementTree.SubElement(TItem, "TSubItem")
-            if trade["quantity"] > 0:
-                PurchaseSale = xml.etree.ElementTree.SubElement(TSubItem, "Purchase")
-                # Datum pridobitve
-                F1 = xml.etree.ElementTree.SubElement(PurchaseSale, "F1").text = trade["trade_date"].strftime(EDAVKI_DATETIME_FORMAT)
-                # Način pridobitve: A - nakup, B - dedovanje, C - darila, D - drugo
-                F2 = xml.etree.ElementTree.SubElement(PurchaseSale, "F2").text = "A"
-                # Količina
-                F3 = xml.etree.ElementTree.SubElement(PurchaseSale, "F3").text = "{0:.8f}".format(trade["quantity"])
-                # Nabavna vrednost ob pridobitvi (na enoto)
-                F4 = xml.etree.ElementTree.SubElement(PurchaseSale, "F4").text = "{0:.8f}".format(trade["trade_price_eur"])
-                # Trgovanje z vzvodom
-                F9 = xml.etree.ElementTree.SubElement(PurchaseSale, "F9").text = "true" if trade["leverage"] > 1 else "false"
-            else:
-                PurchaseSale = xml.etree.ElementTree.SubElement(TSubItem, "Sale")
-                # Datum odsvojitve
-                F5 = xml.etree.ElementTree.SubElement(PurchaseSale, "F5").text = trade["trade_date"].strftime(EDAVKI_DATETIME_FORMAT)
-                # Količina odsvojenega v.p.
-                F6 = xml.etree.ElementTree.SubElement(PurchaseSale, "F6").text = "{0:.8f}".format(-trade["quantity"])
-                # Vrednost ob odsvojitvi
-                F7 = xml.etree.ElementTree.SubElement(PurchaseSale, "F7").text = "{0:.8f}".format(trade["trade_price_eur"])
-            F8Value += trade["quantity"]
-            F8 = xml.etree.ElementTree.SubElement(TSubItem, "F8").text = "{0:.8f}".format(F8Value)
-        # trades
-    # longDerivateTrades
-
-    for securityID in shortDerivateTrades:
-        trades = shortDerivateTrades[securityID]
-        n += 1
-
-        TItem = xml.etree.ElementTree.SubElement(difi, "TItem")
-        TypeId = xml.etree.ElementTree.SubElement(TItem, "TypeId").text = "PLIFIShort"
-        if trades[0]["ifi_type"] == "FUT":
-            Type = xml.etree.ElementTree.SubElement(TItem, "Type").text = "01"
-            TypeName = xml.etree.ElementTree.SubElement(TItem, "TypeName").text = "terminska pogodba"
-        elif trades[0]["ifi_type"] == "CFD":
-            Type = xml.etree.ElementTree.SubElement(TItem, "Type").text = "02"
-            TypeName = xml.etree.ElementTree.SubElement(TItem, "TypeName").text = "finančne pogodbe na razliko"
-        elif trades[0]["ifi_type"] == "OPT":
-            Type = xml.etree.ElementTree.SubElement(TItem, "Type").text = "03"
-            TypeName = xml.etree.ElementTree.SubElement(TItem, "TypeName").text = "opcija in certifikat"
+            raise ConversionError("ERROR: Could not determine position type! ")
+
+        if ifi_type in derivateAssets:
+            asset_type = "derivate"
+        elif ifi_type in normalAssets:
+            if leverage > 1:
+                raise ConversionError("ERROR: Leverage > 1 but asset type is not a derivate: {0}. Please report it on github.".format(ifi_type))
+            asset_type = "normal"
         else:
-            Type = xml.etree.ElementTree.SubElement(TItem, "Type").text = "04"
-            TypeName = xml.etree.ElementTree.SubElement(TItem, "TypeName").text = "drugo"
-        Name = xml.etree.ElementTree.SubElement(TItem, "Name").text = trades[0]["name"]
-        if len(trades) > 0 and "symbol" in trades[0] and trades[0]["symbol"] is not None:
-            Code = xml.etree.ElementTree.SubElement(TItem, "Code").text = trades[0]["symbol"]
-        #ISIN = xml.etree.ElementTree.SubElement(TItem, "ISIN").text = trades[0]["isin"]
-        HasForeignTax = xml.etree.ElementTree.SubElement(TItem, "HasForeignTax").text = "false"
-
-        F8Value = 0
-        for trade in trades:
-            TShortSubItem = xml.etree.ElementTree.SubElement(TItem, "TShortSubItem")
-            if trade["quantity"] > 0:
-                PurchaseSale = xml.etree.ElementTree.SubElement(TShortSubItem, "Sale")
-                F1 = xml.etree.ElementTree.SubElement(PurchaseSale, "F1").text = trade["trade_date"].strftime(EDAVKI_DATETIME_FORMAT)
-                F2 = xml.etree.ElementTree.SubElement(PurchaseSale, "F2").text = "{0:.8f}".format(trade["quantity"])
-                F3 = xml.etree.ElementTree.SubElement(PurchaseSale, "F3").text = "{0:.8f}".format(trade["trade_price_eur"])
-                F9 = xml.etree.ElementTree.SubElement(PurchaseSale, "F9").text = "true" if trade["leverage"] > 1 else "false"
-            else:
-                PurchaseSale = xml.etree.ElementTree.SubElement(TShortSubItem, "Purchase")
-                F4 = xml.etree.ElementTree.SubElement(PurchaseSale, "F4").text = trade["trade_date"].strftime(EDAVKI_DATETIME_FORMAT)
-                F5 = xml.etree.ElementTree.SubElement(PurchaseSale, "F5").text = "A"
-                F6 = xml.etree.ElementTree.SubElement(PurchaseSale, "F6").text = "{0:.8f}".format(-trade["quantity"])
-                F7 = xml.etree.ElementTree.SubElement(PurchaseSale, "F7").text = "{0:.8f}".format(trade["trade_price_eur"])
-            F8Value += trade["quantity"]
-            F8 = xml.etree.ElementTree.SubElement(TShortSubItem, "F8").text = "{0:.8f}".format(F8Value)
-        # trades
-    # shortDerivateTrades
-
-    xmlString = xml.etree.ElementTree.tostring(envelope)
-    prettyXmlString = minidom.parseString(xmlString).toprettyxml(indent="\t")
-    with open("output/D-IFI.xml", "w", encoding="utf-8") as f:
-        f.write(prettyXmlString)
-        print("output/D-IFI.xml created")
-
-    ###########
-    ########### Doh-Div
-    ###########
-
-    """ Get dividends from XLSX """
+            raise ConversionError("ERROR: Unknown asset type: {0}. Please report it on github.".format(ifi_type))
+
+        positions.append(Position(position_id, symbol, name, position_type, ifi_type, asset_type, leverage, units,
+                                  open_date, close_date, open_price_eur, close_price_eur))
+
+    return positions
+
+def normalize_dividends(dividendsList, positionSymbols, years, rates, companyIndex, profiler=None):
+    """ Dividends of the report years in EUR, merged per payer and day and completed from the company index.
+        Returns (dividends, missing company info). """
+    with profile_stage(profiler, "dividends") as record:
+        dividends = convert_dividends(dividendsList, positionSymbols, years, rates, companyIndex)
+        record["rows"] = len(dividends)
+    with profile_stage(profiler, "dividend merging", len(dividends)):
+        dividends = merge_dividends(dividends)
+    with profile_stage(profiler, "dividend company info", len(dividends)):
+        missing_info = complete_dividends(dividends, companyIndex)
+    return dividends, missing_info
+
+def convert_dividends(dividendsList, positionSymbols, years, rates, companyIndex):
+    """ Dividend rows of the report years as dictionaries with amounts in EUR """
     dividends = []
-    ETORO_DATETIME_FORMAT = None
+    if any(diviSheet is not None for diviSheet in dividendsList):
+        rates.extend_to(datetime.date(min(years), 1, 1))
 
     for diviSheet in dividendsList:
         if diviSheet is None:
             continue
 
         for xlsDividend in diviSheet:
-            if ETORO_DATETIME_FORMAT is None:
-                ETORO_DATETIME_FORMAT, float_with_comma = determine_date_format_and_comma(xlsDividend.date)
-
             # 2024   Date of Payment	Instrument Name	Net Dividend Received (USD)	Withholding Tax Rate (%)	Withholding Tax Amount (USD)	Position ID	Type	ISIN
             # 2025.1 Date of Payment	Instrument Name	Net Dividend Received (USD)	Withholding Tax Rate (%)	Withholding Tax Amount (USD)	Position ID	Type
-            date = datetime.datetime.strptime(xlsDividend.date, ETORO_DATETIME_FORMAT)
-            if date.year != reportYear:
+            date = xlsDividend.date
+            if date.year not in years:
                 # print("Skipping dividend (year: " + str(date.year) + "): " + str(xlsDividend))
                 continue
 
-            position_id = int(xlsDividend.position_id)
+            position_id = xlsDividend.position_id
             symbol = positionSymbols.get(position_id)
+            if symbol is None:
+                """ Position opened before the statement period; newer statements carry the ISIN of the instrument """
+                companyInfo = companyIndex.by_isin(xlsDividend.isin)
+                if companyInfo is not None:
+                    symbol = companyInfo.symbol.upper()
 
-            rate = get_exchange_rate(rates, date, ETORO_CURRENCY)
-            withholding_tax_rate = float(xlsDividend.withholding_tax_rate.rstrip('%')) / 100.0
+            rate = rates.rate(ETORO_CURRENCY, date)
+            withholding_tax_rate = xlsDividend.withholding_tax_rate
 
-            netto_amount_eur = str2float(xlsDividend.net_dividend) / rate
-            withholding_tax_amount = str2float(xlsDividend.withholding_tax_amount) / rate
+            netto_amount_eur = xlsDividend.net_dividend / rate
+            withholding_tax_amount = xlsDividend.withholding_tax_amount / rate
             gross_amount_eur = netto_amount_eur + withholding_tax_amount
 
             if symbol is None:
-                print("!!! POZOR / NAPAKA: Ključa [position_id={0}] ni v slovarju [positionSymbols]!".format(position_id))
-                print("                    Verjetno vhodna datoteka ne zajema celotnega obdobja obdelanih finančnih instrumentov.")
-                sys.exit(1)
+                message = "!!! POZOR / NAPAKA: Ključa [position_id={0}] ni v slovarju [positionSymbols]!\n".format(position_id)
+                message += "                    Verjetno vhodna datoteka ne zajema celotnega obdobja obdelanih finančnih instrumentov."
+                if xlsDividend.isin is not None:
+                    message += "\n                    Izvozi account statement za daljše obdobje oz. dodaj podatke za [ISIN={0}] v Company_info.xlsx.".format(xlsDividend.isin)
+                raise ConversionError(message)
 
             dividend = {
                 "position_id": position_id,
@@ -983,42 +2030,45 @@ def main():
                 "date": date,
                 "name": xlsDividend.name,
                 "symbol": symbol,
+                "statement_isin": xlsDividend.isin,
                 "currency": "USD"
-                # "ISIN": xlsDividend.isin
             }
 
             dividends.append(dividend)
+    return dividends
 
-
+def merge_dividends(dividends):
     """ Merge multiple dividends or payments in lieu of dividends on the same day from the same company into a single entry """
     mergedDividends = []
+    mergeIndex = {}  # (payment date, symbol) -> first non-negative entry of that day; negative entries are never merged
     for dividend in dividends:
-        merged = False
-        for mergedDividend in mergedDividends:
-            if \
-                dividend["date"].date() == mergedDividend["date"].date() \
-                and dividend["symbol"] == mergedDividend["symbol"] \
-                and mergedDividend["gross_amount_eur"]>=0 \
-                and dividend["gross_amount_eur"]>=0 \
-            :
-                mergedDividend["netto_amount_eur"] = mergedDividend["netto_amount_eur"] + dividend["netto_amount_eur"]
-                mergedDividend["gross_amount_eur"] = mergedDividend["gross_amount_eur"] + dividend["gross_amount_eur"]
-                mergedDividend["withholding_tax_amount"] = mergedDividend["withholding_tax_amount"] + dividend["withholding_tax_amount"]
-                if "positions" in mergedDividend:
-                    mergedDividend["positions"].append(dividend["position_id"])
-                else:
-                    mergedDividend["positions"] = [mergedDividend["position_id"], dividend["position_id"]]
-                merged = True
-                break
-        if not merged:
+        if dividend["gross_amount_eur"] < 0:
             mergedDividends.append(dividend)
-    dividends = mergedDividends
+            continue
 
-    """ Add missing data """
+        key = (dividend["date"].date(), dividend["symbol"])
+        mergedDividend = mergeIndex.get(key)
+        if mergedDividend is None:
+            mergeIndex[key] = dividend
+            mergedDividends.append(dividend)
+            continue
+
+        mergedDividend["netto_amount_eur"] = mergedDividend["netto_amount_eur"] + dividend["netto_amount_eur"]
+        mergedDividend["gross_amount_eur"] = mergedDividend["gross_amount_eur"] + dividend["gross_amount_eur"]
+        mergedDividend["withholding_tax_amount"] = mergedDividend["withholding_tax_amount"] + dividend["withholding_tax_amount"]
+        if "positions" in mergedDividend:
+            mergedDividend["positions"].append(dividend["position_id"])
+        else:
+            mergedDividend["positions"] = [mergedDividend["position_id"], dividend["position_id"]]
+    return mergedDividends
+
+def complete_dividends(dividends, companyIndex):
+    """ Add missing data from the company index; returns symbols without company info """
     errors = []
     missing_info = []
+    missingSymbols = set()
     for dividend in dividends:
-        companyInfo = get_company_info(dividend["symbol"], companyList)
+        companyInfo = companyIndex.lookup(dividend["symbol"], dividend["statement_isin"])
         if companyInfo is not None:
             if "ISIN" in dividend:
                 if dividend["ISIN"] != companyInfo.ISIN:
@@ -1028,115 +2078,276 @@ def main():
 
             dividend["address"] = companyInfo.address
             dividend["country"] = companyInfo.country_code
-        elif not any(x["symbol"] == dividend["symbol"] for x in missing_info):
-            missing_info.append({
-                "symbol": dividend["symbol"],
-                "name": dividend["name"]
-            })
+        else:
+            if dividend["statement_isin"] is not None:
+                dividend["ISIN"] = dividend["statement_isin"]
 
-            if "ISIN" in dividend:
+            if dividend["symbol"] not in missingSymbols:
+                missingSymbols.add(dividend["symbol"])
                 missing_info.append({
-                    "ISIN": dividend["ISIN"]
+                    "symbol": dividend["symbol"],
+                    "name": dividend["name"]
                 })
 
+                if "ISIN" in dividend:
+                    missing_info[-1]["ISIN"] = dividend["ISIN"]
+
     if errors:
-        print("!!! POZOR / NAPAKA:\n")
+        message = "!!! POZOR / NAPAKA:\n\n"
         for e in errors:
-            print("\tISIN {0}:\n\t\t{1}\n\tse ne ujema z:\n\t\t{2}".format(e[0], e[1], e[2]))
-        print("\tPreveri/popravi podatke v Company_info.xlsx in ponovno poženi program.")
-        sys.exit(1)
-
-    """ Generate Doh-Div.xml """
-    envelope = xml.etree.ElementTree.Element("Envelope", xmlns="http://edavki.durs.si/Documents/Schemas/Doh_Div_3.xsd")
-    envelope.set("xmlns:edp", "http://edavki.durs.si/Documents/Schemas/EDP-Common-1.xsd")
-    header = xml.etree.ElementTree.SubElement(envelope, "edp:Header")
-    taxpayer = xml.etree.ElementTree.SubElement(header, "edp:taxpayer")
-    xml.etree.ElementTree.SubElement(taxpayer, "edp:taxNumber").text = taxpayerConfig["taxNumber"]
-    xml.etree.ElementTree.SubElement(taxpayer, "edp:taxpayerType").text = taxpayerConfig["taxpayerType"]
-    Workflow = xml.etree.ElementTree.SubElement(header, "edp:Workflow")
-    if test:
-        xml.etree.ElementTree.SubElement(Workflow, "edp:DocumentWorkflowID").text = "I"
-    else:
-        xml.etree.ElementTree.SubElement(Workflow, "edp:DocumentWorkflowID").text = "O"
-    xml.etree.ElementTree.SubElement(envelope, "edp:AttachmentList")
-    xml.etree.ElementTree.SubElement(envelope, "edp:Signatures")
-
-    body = xml.etree.ElementTree.SubElement(envelope, "body")
-    Doh_Div = xml.etree.ElementTree.SubElement(body, "Doh_Div")
-    xml.etree.ElementTree.SubElement(Doh_Div, "Period").text = str(reportYear)
+            message += "\tISIN {0}:\n\t\t{1}\n\tse ne ujema z:\n\t\t{2}\n".format(e[0], e[1], e[2])
+        message += "\tPreveri/popravi podatke v Company_info.xlsx in ponovno poženi program."
+        raise ConversionError(message)
 
     for dividend in dividends:
         if round(dividend["gross_amount_eur"], 2) <= 0:
             dividend["skipped"] = "YES"
-            continue
 
-        Dividend = xml.etree.ElementTree.SubElement(body, "Dividend")
-        xml.etree.ElementTree.SubElement(Dividend, "Date").text = dividend["date"].strftime(EDAVKI_DATETIME_FORMAT)
+    return missing_info
+
+def normalize_statements(statements, years, rates, companyIndex, profiler=None):
+    """ Stage 2: converts the statement rows of the report years into EUR positions and dividends.
+        rates (ExchangeRateTable or DeferredExchangeRates) and companyIndex (CompanyIndex) may be shared between calls. """
+    years = set(years)
+    with profile_stage(profiler, "symbol mapping") as record:
+        positionSymbols = get_position_symbols(statements.transactions)
+        record["rows"] = len(positionSymbols)
+    with profile_stage(profiler, "positions") as record:
+        positions = normalize_positions(statements.trades, positionSymbols, years, rates)
+        record["rows"] = len(positions)
+    dividends, missing_info = normalize_dividends(statements.dividends, positionSymbols, years, rates, companyIndex, profiler)
+    return NormalizedStatements(positions, dividends, missing_info)
+
+NORMALIZED_FILE_MAGIC = b"EDNC"
+NORMALIZED_FILE_VERSION = 1
+NORMALIZED_FILE_EPOCH = datetime.datetime(1970, 1, 1)
+NORMALIZED_FILE_TYPECODES = {"<i8": "q", "<M8[s]": "q", "<f8": "d", "<i4": "i"}  # column dtype -> array typecode
+
+""" Columns of the normalized file tables; "text" columns are stored as <i4 codes into the column's categories """
+NORMALIZED_POSITION_COLUMNS = (
+    ("position_id", "<i8"), ("symbol", "text"), ("name", "text"), ("position_type", "text"), ("ifi_type", "text"),
+    ("asset_type", "text"), ("leverage", "<i8"), ("units", "<f8"), ("open_date", "<M8[s]"), ("close_date", "<M8[s]"),
+    ("open_price_eur", "<f8"), ("close_price_eur", "<f8"),
+)
+NORMALIZED_DIVIDEND_COLUMNS = (
+    ("position_id", "<i8"), ("date", "<M8[s]"), ("name", "text"), ("symbol", "text"), ("statement_isin", "text"),
+    ("ISIN", "text"), ("address", "text"), ("country", "text"), ("currency", "text"), ("skipped", "text"),
+    ("gross_amount_eur", "<f8"), ("netto_amount_eur", "<f8"), ("withholding_tax_amount", "<f8"), ("withholding_tax_rate", "<f8"),
+)
+NORMALIZED_DIVIDEND_POSITION_COLUMNS = (("dividend", "<i4"), ("position_id", "<i8"))
+
+ABSENT = object()  # dividend key that is not set (e.g. ISIN of an unknown company)
+
+def encode_column(values, dtype):
+    """ (array, categories) of one column; None is stored as NaN (<f8), -1 (<i8) or as a category (text, -1 marks an unset key) """
+    if dtype == "text":
+        categories = {}
+        codes = array("i", (-1 if value is ABSENT else categories.setdefault(value, len(categories)) for value in values))
+        return codes, list(categories)
+    if dtype == "<M8[s]":
+        return array("q", ((value - NORMALIZED_FILE_EPOCH) // datetime.timedelta(seconds=1) for value in values)), None
+    if dtype == "<f8":
+        return array("d", (float("nan") if value is None else value for value in values)), None
+    return array(NORMALIZED_FILE_TYPECODES[dtype], (-1 if value is None else value for value in values)), None
+
+def decode_column(values, dtype, categories):
+    if dtype == "text":
+        return [ABSENT if code < 0 else categories[code] for code in values]
+    if dtype == "<M8[s]":
+        return [NORMALIZED_FILE_EPOCH + datetime.timedelta(seconds=value) for value in values]
+    if dtype == "<f8":
+        return [None if value != value else value for value in values]
+    if dtype == "<i8":
+        return [None if value == -1 else value for value in values]
+    return values
+
+def write_normalized_file(filename, normalized, years):
+    """ Writes normalized positions and dividends (amounts in EUR) to a memory-mappable columnar file (--save-normalized).
+        Layout (little endian): magic, uint32 version, uint32 directory length, uint32 data offset, UTF-8 JSON directory,
+        then every column as a contiguous array starting at data offset + its 8-byte aligned offset. The directory names
+        the report years, missing company info and per table its row count and columns (name, numpy dtype, offset and,
+        for text columns, the categories the <i4 codes index). Merged dividends list their position IDs in dividend_positions. """
+    dividendPositions = [(index, position_id) for index, dividend in enumerate(normalized.dividends)
+                         for position_id in dividend.get("positions", ())]
+    tables = (
+        ("positions", NORMALIZED_POSITION_COLUMNS, len(normalized.positions),
+         lambda field: [getattr(position, field) for position in normalized.positions]),
+        ("dividends", NORMALIZED_DIVIDEND_COLUMNS, len(normalized.dividends),
+         lambda field: [dividend.get(field, ABSENT) for dividend in normalized.dividends]),
+        ("dividend_positions", NORMALIZED_DIVIDEND_POSITION_COLUMNS, len(dividendPositions),
+         lambda field: [row[0 if field == "dividend" else 1] for row in dividendPositions]),
+    )
 
-        if "ISIN" in dividend:
-            xml.etree.ElementTree.SubElement(Dividend, "PayerIdentificationNumber").text = dividend["ISIN"]
-        if "name" in dividend and dividend["name"] != "":
-            xml.etree.ElementTree.SubElement(Dividend, "PayerName").text = dividend["name"]
-        else:
-            xml.etree.ElementTree.SubElement(Dividend, "PayerName").text = dividend["symbol"]
-        if "address" in dividend:
-            xml.etree.ElementTree.SubElement(Dividend, "PayerAddress").text = dividend["address"]
-        if "country" in dividend:
-            xml.etree.ElementTree.SubElement(Dividend, "PayerCountry").text = dividend["country"]
-        xml.etree.ElementTree.SubElement(Dividend, "Type").text = "1"
-        xml.etree.ElementTree.SubElement(Dividend, "Value").text = "{0:.2f}".format(dividend["gross_amount_eur"])
-        xml.etree.ElementTree.SubElement(Dividend, "ForeignTax").text = "{0:.2f}".format(dividend["withholding_tax_amount"])
-        if "country" in dividend:
-            xml.etree.ElementTree.SubElement(Dividend, "SourceCountry").text = dividend["country"]
-        # TODO: sestavi seznam oprostitvenih besedil (MP, clen...) iz https://www.gov.si/drzavni-organi/ministrstva/ministrstvo-za-finance/o-ministrstvu/direktorat-za-sistem-davcnih-carinskih-in-drugih-javnih-prihodkov/seznam-veljavnih-konvencij-o-izogibanju-dvojnega-obdavcevanja-dohodka-in-premozenja/
-        #if "reliefStatement" in dividend:
-        #    xml.etree.ElementTree.SubElement(Dividend, "ReliefStatement").text = dividend["reliefStatement"]
-        #else:
-        xml.etree.ElementTree.SubElement(Dividend, "ReliefStatement").text = ""
-
-    xmlString = xml.etree.ElementTree.tostring(envelope)
-    prettyXmlString = minidom.parseString(xmlString).toprettyxml(indent="\t")
-    with open("output/Doh-Div.xml", "w", encoding="utf-8") as f:
-        f.write(prettyXmlString)
-        print("output/Doh-Div.xml created")
-
-
-
-    ###################
-    ###################
-    ###################
-    """ Debug output """
-    rows = []
-    for dividend in dividends:
-        row = [
-            (dividend["skipped"] if "skipped" in dividend else ""),
-            dividend["date"].strftime(EDAVKI_DATETIME_FORMAT),
-            dividend["symbol"],
-            (dividend["ISIN"] if "ISIN" in dividend else ""),
-            (dividend["name"] if not dividend["name"] is None else ""),
-            (dividend["address"] if "address" in dividend else ""),
-            (dividend["country"] if "country" in dividend else ""),
-            "{0:.8f}".format(dividend["netto_amount_eur"]),
-            "{0:.8f}".format(dividend["withholding_tax_amount"]),
-            "{0:.8f}".format(dividend["gross_amount_eur"]),
-            #dividend["currency"],
-            dividend["position_id"] if not "positions" in dividend else ", ".join(map(str, dividend["positions"]))
-        ]
-        rows.append(row)
+    directory = {"years": sorted(years), "missing_info": normalized.missing_info, "tables": {}}
+    blocks = []
+    offset = 0
+    for table, columns, rows, column_values in tables:
+        directory["tables"][table] = {"rows": rows, "columns": []}
+        for field, dtype in columns:
+            values, categories = encode_column(column_values(field), dtype)
+            if sys.byteorder != "little":
+                values.byteswap()
+            column = {"name": field, "dtype": "<i4" if dtype == "text" else dtype, "offset": offset}
+            if categories is not None:
+                column["categories"] = categories
+            directory["tables"][table]["columns"].append(column)
+            data = values.tobytes()
+            blocks.append(data + bytes(-len(data) % 8))
+            offset += len(blocks[-1])
+
+    header = json.dumps(directory, ensure_ascii=False).encode("utf-8")
+    headerSize = len(NORMALIZED_FILE_MAGIC) + struct.calcsize("<III")
+    dataOffset = headerSize + len(header) + (-(headerSize + len(header)) % 8)
+    tmpFilename = "{0}.{1}.tmp".format(filename, os.getpid())
+    with open(tmpFilename, "wb") as f:
+        f.write(NORMALIZED_FILE_MAGIC)
+        f.write(struct.pack("<III", NORMALIZED_FILE_VERSION, len(header), dataOffset))
+        f.write(header)
+        f.write(bytes(dataOffset - headerSize - len(header)))
+        for block in blocks:
+            f.write(block)
+    os.replace(tmpFilename, filename)
+
+def read_normalized_file(filename, years=None):
+    """ Reads a file written by write_normalized_file through a memory map; returns (NormalizedStatements, report years).
+        With years only rows of those years are returned. Raises ValueError if the file is not compatible, truncated or lacks a year. """
+    headerSize = len(NORMALIZED_FILE_MAGIC) + struct.calcsize("<III")
+    with open(filename, "rb") as f:
+        if f.read(len(NORMALIZED_FILE_MAGIC)) != NORMALIZED_FILE_MAGIC:
+            raise ValueError("ni datoteka z normaliziranimi podatki")
+        size = os.fstat(f.fileno()).st_size
+        if size < headerSize:
+            raise ValueError("datoteka je okrnjena")
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+            version, headerLength, dataOffset = struct.unpack_from("<III", view, len(NORMALIZED_FILE_MAGIC))
+            if version != NORMALIZED_FILE_VERSION:
+                raise ValueError("nepodprta verzija datoteke ({0})".format(version))
+            if size < headerSize + headerLength:
+                raise ValueError("datoteka je okrnjena")
+            directory = json.loads(bytes(view[headerSize:headerSize + headerLength]).decode("utf-8"))
+
+            tables = {}
+            for table, description in directory["tables"].items():
+                rows = description["rows"]
+                columns = tables[table] = {}
+                for column in description["columns"]:
+                    typecode = NORMALIZED_FILE_TYPECODES[column["dtype"]]
+                    start = dataOffset + column["offset"]
+                    end = start + rows * array(typecode).itemsize
+                    if end > size:
+                        raise ValueError("datoteka je okrnjena")
+                    with view[start:end] as data:
+                        if sys.byteorder == "little":
+                            with data.cast(typecode) as typed:
+                                values = typed.tolist()
+                        else:
+                            values = array(typecode, data.tobytes())
+                            values.byteswap()
+                    dtype = "text" if "categories" in column else column["dtype"]
+                    columns[column["name"]] = decode_column(values, dtype, column.get("categories"))
+
+    if years is None:
+        years = directory["years"]
+    missingYears = set(years) - set(directory["years"])
+    if missingYears:
+        raise ValueError("ne vsebuje podatkov za leto {0}".format(", ".join(map(str, sorted(missingYears)))))
+    years = set(years)
+
+    columns = tables["positions"]
+    positions = [Position(*values) for values in zip(*(columns[field] for field, dtype in NORMALIZED_POSITION_COLUMNS))
+                 if values[9].year in years]  # close_date
+
+    columns = tables["dividends"]
+    fields = [field for field, dtype in NORMALIZED_DIVIDEND_COLUMNS]
+    dividends = [{field: value for field, value in zip(fields, values) if value is not ABSENT}
+                 for values in zip(*(columns[field] for field in fields))]
+    columns = tables["dividend_positions"]
+    for index, position_id in zip(columns["dividend"], columns["position_id"]):
+        dividends[index].setdefault("positions", []).append(position_id)
+    dividends = [dividend for dividend in dividends if dividend["date"].year in years]
+
+    return NormalizedStatements(positions, dividends, directory["missing_info"]), sorted(years)
+
+def classify_reports(normalized, years, reportCryptos=False, outputDirectory="output", profiler=None):
+    """ Stage 3: groups positions and dividends into one YearReport per year (by close and payment date).
+        With several years every report gets its own <outputDirectory>/<year> directory. """
+    reports = {}
+    for reportYear in sorted(years):
+        directory = outputDirectory if len(years) == 1 else "{0}/{1}".format(outputDirectory, reportYear)
+        reports[reportYear] = YearReport(reportYear, directory)
+
+    with profile_stage(profiler, "grouping", len(normalized.positions) + len(normalized.dividends)):
+        for position in normalized.positions:
+            reports[position.close_date.year].add_position(position, reportCryptos)
+        for dividend in normalized.dividends:
+            reports[dividend["date"].year].dividends.append(dividend)
+
+    with profile_stage(profiler, "sorting", 2 * len(normalized.positions)):
+        for report in reports.values():
+            report.sort_trades()
+    return reports
+
+def render_reports(reports, taxpayerConfig, test=False, jobs=1, profiler=None, controlFiles="xlsx", cache=None):
+    """ Stage 4: writes the output files of all reports concurrently (one by one when profiling); returns (filename, error) pairs """
+    renderTasks = []
+    for report in reports.values():
+        os.makedirs(report.directory, exist_ok=True)
+        renderTasks.extend(report.render_tasks(taxpayerConfig, test, controlFiles, cache))
+    if profiler is None:
+        return render_outputs(renderTasks, jobs)
+
+    results = []
+    for filename, function, args in renderTasks:
+        # rows: trades (grouped in dictionaries) and dividends passed to the writer
+        rows = sum(len(arg) if isinstance(arg, list) else sum(len(trades) for trades in arg.values() if isinstance(trades, list))
+                   for arg in args if isinstance(arg, (list, dict)))
+        with profiler.stage("write " + filename, rows):
+            try:
+                function(filename, *args)
+                results.append((filename, None))
+            except Exception as e:
+                results.append((filename, e))
+    return results
+
+def convert(inputFilenames, reportYears, taxpayerConfig, rates, companyIndex, outputDirectory="output",
+            reportCryptos=False, test=False, statementCache=None, jobs=1, profiler=None, controlFiles="xlsx",
+            normalized=None, normalizedFile=None, reuseFragments=True):
+    """ Runs all stages and prints the progress for the command line; returns (failed outputs, missing company info).
+        Without reuseFragments (temporary output directories) no XML fragments are stored in statementCache.
+        With normalized (read_normalized_file) the statements are not read again and rates and companyIndex are not used;
+        with normalizedFile the normalized statements are also written to that file (write_normalized_file).
+        Raises ConversionError (or ExchangeRateError) when the input data can not be converted. """
+    if normalized is None:
+        statements = load_statements(inputFilenames, statementCache, jobs, profiler, reportYears)
+        normalized = normalize_statements(statements, reportYears, rates, companyIndex, profiler)
+    if normalizedFile is not None:
+        with profile_stage(profiler, "normalized file", len(normalized.positions) + len(normalized.dividends)):
+            write_normalized_file(normalizedFile, normalized, reportYears)
+        print("{0} created".format(normalizedFile))
+    reports = classify_reports(normalized, reportYears, reportCryptos, outputDirectory, profiler)
+    missing_info = normalized.missing_info
 
+    print("")
 
-    """ Save dividend info to XLS """
-    wb = DividendsOutputWorkbook(template_styles=DefaultStyleSet(
-        NamedStyle(name="hyperlink")
-    ))
-    if len(rows) > 0:
-        wb.dividends.write(
-            objects=rows
-        )
+    for report in reports.values():
+        if len(reports) > 1 and report.skippedCryptoTrades:
+            print("Leto {0}:".format(report.year))
+        for securityID, trades in report.skippedCryptoTrades.items():
+            name = trades[0].name
+            symbol = trades[0].symbol
+            ids = ','.join(map(str, report.trades.position_ids("skippedCrypto", securityID)))
+            print("Crypto: skipped {0}/{1} ({2})".format(name, symbol, ids))
 
-    filename = "output/Dividende-info-{0}.xlsx".format(reportYear)
-    wb.save(filename)
-    print("{0} created ".format(filename))
+    print("")
+
+    failedOutputs = []
+    fragmentCache = statementCache if reuseFragments else None
+    for filename, error in render_reports(reports, taxpayerConfig, test, jobs, profiler, controlFiles, fragmentCache):
+        if error is None:
+            print("{0} created".format(filename))
+        else:
+            print("!!! NAPAKA: {0} ni bila ustvarjena: {1}: {2}".format(filename, type(error).__name__, error))
+            failedOutputs.append(filename)
 
     print("\n------------------------------------------------------------------------------------------------------------------------------------")
 
@@ -1153,7 +2364,491 @@ def main():
         print("!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!!")
         print("------------------------------------------------------------------------------------------------------------------------------------")
 
-    sys.exit(0)
+    return failedOutputs, missing_info
+
+BatchClient = namedtuple("BatchClient", ["tax_number", "taxpayer_type", "files", "years", "crypto", "output"])
+
+def read_batch_manifest(filename, defaultYears):
+    """ Reads a batch manifest; paths in it are relative to the manifest. Example:
+        <batch>
+           <taxpayer>
+              <taxNumber>12345678</taxNumber>
+              <taxpayerType>FO</taxpayerType>
+              <file>eToroAccountStatement-2024.xlsx</file>  (one or more)
+              <year>2024</year>  (optional, same as -y)
+              <crypto>true</crypto>  (optional, same as -c)
+              <output>output/12345678</output>  (optional, default output/<taxNumber>)
+           </taxpayer>
+        </batch>
+    """
+    baseDirectory = os.path.dirname(os.path.abspath(filename))
+    clients = []
+    outputs = set()
+    for taxpayer in xml.etree.ElementTree.parse(filename).getroot().iter("taxpayer"):
+        taxNumber = (taxpayer.findtext("taxNumber") or "").strip()
+        if not taxNumber:
+            raise ValueError("taxpayer without taxNumber")
+        files = [os.path.join(baseDirectory, f.text.strip()) for f in taxpayer.iter("file") if f.text and f.text.strip()]
+        if not files:
+            raise ValueError("no statement files for {0}".format(taxNumber))
+        year = (taxpayer.findtext("year") or "").strip()
+        try:
+            years = parse_report_years(year) if year else defaultYears
+        except argparse.ArgumentTypeError as e:
+            raise ValueError(str(e))
+        output = (taxpayer.findtext("output") or "").strip()
+        output = os.path.join(baseDirectory, output) if output else "output/{0}".format(taxNumber)
+        if os.path.abspath(output) in outputs:
+            raise ValueError("output directory {0} is used more than once".format(output))
+        outputs.add(os.path.abspath(output))
+        clients.append(BatchClient(
+            taxNumber,
+            (taxpayer.findtext("taxpayerType") or "FO").strip().upper(),
+            files,
+            years,
+            (taxpayer.findtext("crypto") or "").strip().lower() in ("1", "true", "yes", "da"),
+            output
+        ))
+    if not clients:
+        raise ValueError("no <taxpayer> entries")
+    return clients
+
+_batchContext = None  # (rates, companyIndex, statementCache, test, controlFiles) shared by all clients of a batch worker
+
+def init_batch_worker(context):
+    global _batchContext
+    _batchContext = context
+
+def convert_client(client, reuseFragments=True):
+    """ Converts the statements of one batch client; all messages go to convert.log in its output directory.
+        Returns (success, message) for the batch summary. """
+    rates, companyIndex, statementCache, test, controlFiles = _batchContext
+    os.makedirs(client.output, exist_ok=True)
+    logFilename = "{0}/convert.log".format(client.output)
+    taxpayerConfig = {
+        "taxNumber": client.tax_number,
+        "taxpayerType": client.taxpayer_type,
+    }
+    with open(logFilename, "w", encoding="utf-8") as log, contextlib.redirect_stdout(log):
+        try:
+            failedOutputs, missing_info = convert(client.files, client.years, taxpayerConfig, rates, companyIndex,
+                                                  client.output, client.crypto, test, statementCache, controlFiles=controlFiles,
+                                                  reuseFragments=reuseFragments)
+        except ConversionError as e:
+            print(e)
+            return False, "{0} (glej {1})".format(str(e).strip().splitlines()[0], logFilename)
+        except Exception as e:
+            traceback.print_exc(file=log)
+            return False, "{0}: {1} (glej {2})".format(type(e).__name__, e, logFilename)
+
+    if failedOutputs:
+        return False, "neuspešno: {0} (glej {1})".format(", ".join(failedOutputs), logFilename)
+    if missing_info:
+        return True, "{0} (manjkajo podatki o podjetjih: {1})".format(client.output, ", ".join(mi["symbol"] for mi in missing_info))
+    return True, client.output
+
+def run_batch(clients, rates, companyIndex, statementCache=None, test=False, jobs=1, controlFiles="xlsx"):
+    """ Converts the clients of a batch manifest, in parallel worker processes when jobs > 1; returns the exit code """
+    context = (rates, companyIndex, statementCache, test, controlFiles)
+    if jobs > 1 and len(clients) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(clients)), initializer=init_batch_worker, initargs=(context,)) as executor:
+            futures = [executor.submit(convert_client, client) for client in clients]
+            results = []
+            for future in futures:
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    results.append((False, "{0}: {1}".format(type(e).__name__, e)))
+    else:
+        init_batch_worker(context)
+        results = [convert_client(client) for client in clients]
+
+    print("")
+    print("Povzetek paketne obdelave:")
+    for client, (success, message) in zip(clients, results):
+        print("  {0}\t{1}\t{2}".format("OK" if success else "NAPAKA", client.tax_number, message))
+    failures = sum(1 for success, message in results if not success)
+    print("Uspešno: {0}, neuspešno: {1}".format(len(results) - failures, failures))
+    return 1 if failures else 0
+
+def parse_server_address(value):
+    """ --serve argument: PORT or HOST:PORT """
+    host, _, port = value.rpartition(":")
+    try:
+        port = int(port)
+    except ValueError:
+        raise argparse.ArgumentTypeError("neveljaven naslov strežnika: {0}".format(value))
+    return host or SERVER_DEFAULT_HOST, port
+
+def convert_upload(statement, client):
+    """ Converts an uploaded statement (bytes) in a batch worker; returns (success, message, zip of the outputs, log) """
+    with tempfile.TemporaryDirectory(prefix="etoro-edavki-") as directory:
+        filename = os.path.join(directory, "statement.xlsx")
+        with open(filename, "wb") as f:
+            f.write(statement)
+        client = client._replace(files=[filename], output=os.path.join(directory, "output"))
+        success, message = convert_client(client, reuseFragments=False)  # fragments of a temporary directory are never hit again
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as archive:
+            for root, dirs, files in os.walk(client.output):
+                dirs.sort()
+                for name in sorted(files):
+                    path = os.path.join(root, name)
+                    archive.write(path, os.path.relpath(path, client.output))
+        with open(os.path.join(client.output, "convert.log"), encoding="utf-8") as f:
+            log = f.read()
+        return success, message.replace(directory + os.sep, ""), buffer.getvalue(), log
+
+class ServiceBusy(Exception):
+    pass
+
+class ConversionService:
+    """ Keeps the exchange rates and the company index warm and converts uploads on a bounded pool of worker processes.
+        Reference data (and with it the pool) is reloaded once a day. """
+    def __init__(self, ratesSource=bsRateXmlUrl, statementCache=None, jobs=1, test=False, companyFilename="Company_info.xlsx",
+                 controlFiles="xlsx"):
+        self.ratesSource = ratesSource
+        self.statementCache = statementCache
+        self.jobs = max(1, jobs)
+        self.test = test
+        self.companyFilename = companyFilename
+        self.controlFiles = controlFiles
+        self.lock = threading.Lock()
+        self.pending = threading.BoundedSemaphore(self.jobs + SERVER_MAX_PENDING)
+        self.executor = None
+        self.loadedOn = None
+        self._executor()
+
+    def _executor(self):
+        with self.lock:
+            if self.loadedOn != datetime.date.today():
+                rates = load_exchange_rates(self.ratesSource, since=rates_since([datetime.date.today().year - 1]))
+                companyIndex = CompanyIndex.load(self.companyFilename, self.statementCache)
+                context = (rates, companyIndex, self.statementCache, self.test, self.controlFiles)
+                previous = self.executor
+                self.executor = ProcessPoolExecutor(max_workers=self.jobs, initializer=init_batch_worker, initargs=(context,))
+                self.loadedOn = datetime.date.today()
+                if previous is not None:
+                    previous.shutdown(wait=False)
+            return self.executor
+
+    def convert(self, statement, client):
+        """ Returns (success, message, zip of the outputs, log); raises ServiceBusy when too many conversions are waiting """
+        if not self.pending.acquire(blocking=False):
+            raise ServiceBusy()
+        try:
+            return self._executor().submit(convert_upload, statement, client).result()
+        finally:
+            self.pending.release()
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+
+class ConversionRequestHandler(http.server.BaseHTTPRequestHandler):
+    """ POST /convert?taxNumber=12345678[&taxpayerType=FO][&year=2024][&crypto=1] with the XLSX statement as the body
+        returns a zip of the outputs; GET /health answers when the service is up. """
+    def do_GET(self):
+        if urllib.parse.urlsplit(self.path).path == "/health":
+            self._reply(200, b"OK\n")
+        else:
+            self._reply(404, b"Not found\n")
+
+    def do_POST(self):
+        url = urllib.parse.urlsplit(self.path)
+        if url.path != "/convert":
+            self._reply(404, b"Not found\n")
+            return
+        try:
+            length = int(self.headers.get("Content-Length", "0"))
+        except ValueError:
+            length = 0
+        if not 0 < length <= SERVER_MAX_UPLOAD * 1024 * 1024:
+            self.close_connection = True  # the body is not read
+            self._reply(413 if length > 0 else 400, "eToro XLSX datoteka mora biti v telesu zahtevka (največ {0} MB)\n".format(SERVER_MAX_UPLOAD).encode("utf-8"))
+            return
+        statement = self.rfile.read(length)
+
+        params = urllib.parse.parse_qs(url.query)
+        taxNumber = params.get("taxNumber", [""])[0].strip()
+        if not taxNumber:
+            self._reply(400, "manjka parameter taxNumber\n".encode("utf-8"))
+            return
+        try:
+            years = parse_report_years(params["year"][0]) if "year" in params else [datetime.date.today().year - 1]
+        except argparse.ArgumentTypeError as e:
+            self._reply(400, "{0}\n".format(e).encode("utf-8"))
+            return
+
+        client = BatchClient(
+            taxNumber,
+            params.get("taxpayerType", ["FO"])[0].strip().upper(),
+            [],
+            years,
+            params.get("crypto", [""])[0].strip().lower() in ("1", "true", "yes", "da"),
+            None
+        )
+        try:
+            success, message, archive, log = self.server.service.convert(statement, client)
+        except ServiceBusy:
+            self._reply(503, "strežnik je zaseden, poskusi kasneje\n".encode("utf-8"))
+            return
+        except Exception as e:
+            self._reply(500, "{0}: {1}\n".format(type(e).__name__, e).encode("utf-8"))
+            return
+
+        if success:
+            self._reply(200, archive, "application/zip", {"Content-Disposition": "attachment; filename=\"eDavki-{0}.zip\"".format(taxNumber)})
+        else:
+            self._reply(422, "{0}\n\n{1}".format(message, log).encode("utf-8"))
+
+    def _reply(self, status, body, contentType="text/plain; charset=utf-8", headers=None):
+        self.send_response(status)
+        self.send_header("Content-Type", contentType)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+def stop_on_signal(signum, frame):
+    raise KeyboardInterrupt()
+
+def serve(address, service):
+    """ Serves conversions until interrupted (Ctrl+C or SIGTERM) """
+    server = http.server.ThreadingHTTPServer(address, ConversionRequestHandler)
+    server.service = service
+    signal.signal(signal.SIGTERM, stop_on_signal)
+    print("Strežnik posluša na http://{0}:{1}/convert (prekini s Ctrl+C)".format(*server.server_address[:2]))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.shutdown()
+    return 0
+
+# noinspection PyUnusedLocal
+def main():
+    print("------------------------------------------------------------------------------")
+    print("| eToro->eDavki | verzija " + APP_VER)
+    print("------------------------------------------------------------------------------")
+    warnings.showwarning = show_warning
+    warnings.simplefilter("always", ConversionWarning)
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "eToroXLSXFiles",
+        metavar="eToro-xlsx-file",
+        help="eToro XLSX datoteka (\"XLSX Statement\")",
+        nargs="*",
+    )
+    parser.add_argument(
+        "-y",
+        metavar="report-years",
+        type=parse_report_years,
+        default=None,
+        help="Datoteke bodo generirane za izbrano leto, razpon let (2021-2024) ali seznam let (2021,2023) (privzeto za " + str(datetime.date.today().year - 1) + "). Pri več letih je vsako leto v svoji podmapi output/leto.",
+    )
+    parser.add_argument(
+        "-t",
+        help="Testing",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        metavar="N",
+        type=int,
+        default=1,
+        help="Število vzporednih procesov za branje vhodnih in pisanje izhodnih datotek (privzeto 1)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        help="Ne uporabi predpomnilnika že prebranih XLSX datotek (" + STATEMENT_CACHE_DIR + ")",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cache-size",
+        metavar="MB",
+        type=int,
+        default=STATEMENT_CACHE_MAX_SIZE,
+        help="Največja velikost predpomnilnika v MB (privzeto " + str(STATEMENT_CACHE_MAX_SIZE) + ")",
+    )
+    parser.add_argument(
+        "--clear-cache",
+        help="Izprazni predpomnilnik že prebranih XLSX datotek",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--rates-source",
+        metavar="URL-or-file",
+        default=bsRateXmlUrl,
+        help="Vir tečajnice BSI (URL ali lokalna XML datoteka; privzeto " + bsRateXmlUrl + ")",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="manifest.xml",
+        help="Paketna obdelava več davkoplačevalcev brez vprašanj (seznam v XML datoteki, glej README); vsak dobi svojo izhodno mapo",
+    )
+    parser.add_argument(
+        "--serve",
+        metavar="[HOST:]PORT",
+        type=parse_server_address,
+        help="Zaženi lokalni HTTP strežnik za konverzijo naloženih XLSX datotek (tečajnica in Company_info.xlsx ostaneta naložena; glej README)",
+    )
+    parser.add_argument(
+        "--control-files",
+        choices=CONTROL_FILE_FORMATS,
+        default="xlsx",
+        help="Oblika kontrolnih datotek Debug-leto in Dividende-info-leto: xlsx (privzeto), csv ali none (brez njih)",
+    )
+    parser.add_argument(
+        "--save-normalized",
+        metavar="file",
+        help="Shrani normalizirane pozicije in dividende (zneski v EUR) še v stolpčno datoteko, ki jo lahko brez ponovne konverzije berejo tudi druga orodja (glej README)",
+    )
+    parser.add_argument(
+        "--from-normalized",
+        metavar="file",
+        help="Ustvari datoteke iz datoteke, shranjene z --save-normalized, namesto iz eToro XLSX datotek (brez branja tečajnice in Company_info.xlsx)",
+    )
+    parser.add_argument(
+        "--profile",
+        help="Izmeri čas, procesorski čas, število vrstic in porabo pomnilnika posameznih faz konverzije (output/profile.json)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--profile-no-memory",
+        help="Kot --profile, a brez merjenja pomnilnika (ki večkrat upočasni branje XLSX datotek)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--cprofile",
+        help="Kot --profile, dodatno shrani cProfile najpočasnejše faze (output/profile.prof)",
+        action="store_true",
+    )
+    parser.add_argument(
+        "-c",
+        help="(Doh-KDVP) Vključi tudi kripto pozicije brez vzvoda v poročilu (običajno za s.p.; d.o.o.). Kripto pozicije z vzvodom (CFD) so vedno vključene.",
+        action="store_true",
+        default=False
+    )
+
+    args = parser.parse_args()
+    inputFilenames = args.eToroXLSXFiles
+
+    statementCache = None if args.no_cache else StatementCache(max_size=args.cache_size)
+    if args.clear_cache:
+        removed = StatementCache().clear()
+        print("Predpomnilnik izpraznjen ({0} datotek odstranjenih)".format(removed))
+        if not inputFilenames and args.batch is None and args.serve is None:
+            sys.exit(0)
+    if args.batch is not None and inputFilenames:
+        parser.error("vhodne datoteke pri --batch navedeš v seznamu")
+    if args.serve is not None and (inputFilenames or args.batch is not None):
+        parser.error("--serve ne sprejema vhodnih datotek ali --batch")
+    if args.from_normalized is not None and (inputFilenames or args.batch is not None or args.serve is not None or args.save_normalized is not None):
+        parser.error("--from-normalized ne sprejema vhodnih datotek, --batch, --serve ali --save-normalized")
+    if args.save_normalized is not None and (args.batch is not None or args.serve is not None):
+        parser.error("--save-normalized je na voljo le pri konverziji vhodnih datotek")
+    if args.batch is None and args.serve is None and args.from_normalized is None and not inputFilenames:
+        parser.error("manjka vsaj ena eToro XLSX datoteka")
+    profile = args.profile or args.profile_no_memory or args.cprofile
+    if profile and (args.batch is not None or args.serve is not None):
+        parser.error("--profile je na voljo le pri konverziji vhodnih datotek")
+    profiler = StageProfiler(not args.profile_no_memory, args.cprofile) if profile else None
+    normalized = None
+    if args.from_normalized is not None:
+        """ Years of the file unless -y selects some of them """
+        try:
+            with profile_stage(profiler, "normalized file") as record:
+                normalized, reportYears = read_normalized_file(args.from_normalized, args.y or None)
+                record["rows"] = len(normalized.positions) + len(normalized.dividends)
+        except (OSError, ValueError, KeyError) as e:
+            sys.exit("ERROR: {0}: {1}".format(args.from_normalized, e))
+    elif not args.y:
+        reportYears = [datetime.date.today().year - 1]
+    else:
+        reportYears = args.y
+
+    reportCryptos = args.c
+
+    test = args.t
+
+    if args.serve is not None:
+        for file in glob.glob("bsrate-*.xml"):
+            os.remove(file)  # daily full downloads of older versions
+        sys.exit(serve(args.serve, ConversionService(args.rates_source, statementCache, args.jobs, test,
+                                                       controlFiles=args.control_files)))
+
+    if args.batch is not None:
+        try:
+            batchClients = read_batch_manifest(args.batch, reportYears)
+        except (OSError, ValueError, xml.etree.ElementTree.ParseError) as e:
+            sys.exit("ERROR: Batch manifest {0}: {1}".format(args.batch, e))
+    elif not os.path.isfile("taxpayer.xml"):
+        print("Doh-Div.xml potrebuje tvojo davčno številko. Če se zmotiš, jo lahko spremeniš ročno (taxpayer.xml) ali pa kar pobrišeš taxpayer.xml in ponovno poženeš program.")
+        tax_number = input("Vnesi svojo davčno številko: ")
+        taxpayer_type = input("Tip davkoplačevalca (običajno FO, možnosti: FO - fizična oseba, PO - pravna oseba, SP - fizična oseba z dejavnostjo): ") or "FO"
+        taxpayer_type = taxpayer_type.upper()
+        f = open("taxpayer.xml", "w+", encoding="utf-8")
+        f.write(
+            "<taxpayer>\n"
+            "   <taxNumber>" + tax_number + "</taxNumber>\n"
+            "   <taxpayerType>" + taxpayer_type + "</taxpayerType>\n"
+            "</taxpayer>"
+        )
+        f.close()
+
+    rates = companyIndex = None
+    if normalized is None:
+        """ Creating daily exchange rates object (persistent store, refreshed incrementally) in the background while statements are parsed """
+        for file in glob.glob("bsrate-*.xml"):
+            os.remove(file)  # daily full downloads of older versions
+        if args.batch is not None:
+            ratesSince = rates_since([year for client in batchClients for year in client.years] or reportYears)
+        else:
+            ratesSince = rates_since(reportYears)
+        if profiler is None:
+            rates = DeferredExchangeRates(load_exchange_rates, args.rates_source, bsRateStoreFilename, (ETORO_CURRENCY,), ratesSince)
+        else:
+            with profiler.stage("exchange rates"):
+                rates = load_exchange_rates(args.rates_source, since=ratesSince)
+
+        """ Load company info (indexed, cached until Company_info.xlsx changes) """
+        with profile_stage(profiler, "company info") as record:
+            companyIndex = CompanyIndex.load("Company_info.xlsx", statementCache)
+            record["rows"] = len(companyIndex.bySymbol)
+
+    if args.batch is not None:
+        """ Reference data is loaded once and shared by all clients """
+        sys.exit(run_batch(batchClients, rates.table(), companyIndex, statementCache, test, args.jobs, args.control_files))
+
+    """ Parse taxpayer information from the local taxpayer.xml file """
+    taxpayer = xml.etree.ElementTree.parse("taxpayer.xml").getroot()
+    taxpayerConfig = {
+        "taxNumber": taxpayer.find("taxNumber").text,
+        "taxpayerType": "FO",
+    }
+
+    try:
+        failedOutputs, missing_info = convert(inputFilenames, reportYears, taxpayerConfig, rates, companyIndex, "output",
+                                              reportCryptos, test, statementCache, args.jobs, profiler, args.control_files,
+                                              normalized, args.save_normalized)
+    except ConversionError as e:
+        sys.exit(str(e))
+
+    if profiler is not None:
+        os.makedirs("output", exist_ok=True)
+        for filename in profiler.write("output/profile.json", files=[os.path.basename(filename) for filename in inputFilenames],
+                                       years=sorted(reportYears), jobs=args.jobs, cache=statementCache is not None):
+            print("{0} created".format(filename))
+        slowest = profiler.slowest()
+        print("Najpočasnejša faza: {0} ({1:.2f} s)".format(slowest["stage"], slowest["wall"]))
+    sys.exit(1 if failedOutputs else 0)
 
 
 if __name__ == "__main__":
@@ -17,5 +17,8 @@ setup(
 		'openpyxl-templates>=0.2.5',
 		'prettytable>=2.0.0',
 		'future>=0.18.2'
-	]
+	],
+    extras_require={
+        "numpy": ["numpy>=1.17"]
+    }
 )
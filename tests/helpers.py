@@ -0,0 +1,94 @@
+""" Small eToro statements, rate tables and company data shared by the tests """
+
+import datetime
+import os
+import sys
+
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import etoro_edavki as ee
+
+TAXPAYER = {"taxNumber": "12345678", "taxpayerType": "FO"}
+
+CLOSED_POSITIONS_HEADER = ["Position ID", "Action", "Long / Short", "Amount", "Units / Contracts", "Open Date", "Close Date",
+                           "Leverage", "Profit(USD)", "Type"]
+ACCOUNT_ACTIVITY_HEADER = ["Date", "Type", "Details", "Amount", "Position ID"]
+DIVIDENDS_HEADER = ["Date of Payment", "Instrument Name", "Net Dividend Received (USD)", "Withholding Tax Rate (%)",
+                    "Withholding Tax Amount (USD)", "Position ID", "ISIN"]
+
+def position(position_id, closeDate, openDate="02/01/2023 10:00:00", name="Apple", amount="100.00", units="1.000000",
+             profit="5.00", type="Stocks", longShort="Long", leverage="1"):
+    """ Closed Positions row """
+    return [str(position_id), "Buy " + name, longShort, amount, units, openDate, closeDate, leverage, profit, type]
+
+def activity(position_id, date="02/01/2023 10:00:00", symbol="AAPL"):
+    """ Account Activity row opening a position (maps the position to its symbol) """
+    return [date, "Open Position", symbol + "/USD", "100.00", str(position_id)]
+
+def dividend(position_id, date, name="Apple", net="0.85", tax="0.15", isin="US0378331005"):
+    """ Dividends row """
+    return [date, name, net, "15", tax, str(position_id), isin]
+
+def write_statement(path, closedPositions=(), activities=(), dividends=()):
+    """ Writes an XLSX statement with the three sheets the converter reads; returns its filename """
+    wb = Workbook()
+    wb.remove(wb.active)
+    for title, header, rows in (("Closed Positions", CLOSED_POSITIONS_HEADER, closedPositions),
+                                ("Account Activity", ACCOUNT_ACTIVITY_HEADER, activities),
+                                ("Dividends", DIVIDENDS_HEADER, dividends)):
+        sh = wb.create_sheet(title)
+        sh.append(header)
+        for row in rows:
+            sh.append(row)
+    wb.save(str(path))
+    return str(path)
+
+def sample_statement(path):
+    """ A statement of 2023 with a long stock position, a derivative, a short position and two dividends """
+    return write_statement(
+        path,
+        [
+            position(1001, "15/03/2023 10:00:00"),
+            position(1002, "20/06/2023 11:00:00", openDate="05/05/2023 09:30:00", name="Tesla", type="CFD", leverage="2"),
+            position(1003, "01/09/2023 15:00:00", openDate="01/08/2023 15:00:00", name="Microsoft", longShort="Short"),
+        ],
+        [activity(1001), activity(1002, "05/05/2023 09:30:00", "TSLA"), activity(1003, "01/08/2023 15:00:00", "MSFT")],
+        [dividend(1001, "15/05/2023 00:00:00"), dividend(1003, "15/08/2023 00:00:00", "Microsoft", "1.70", "0.30", "US5949181045")],
+    )
+
+def rate_table(since=datetime.date(2022, 1, 1), until=datetime.date(2024, 12, 31), rate=1.1):
+    """ USD exchange rate table with the same rate on every day """
+    rates = ee.ExchangeRateTable()
+    day = since
+    while day <= until:
+        rates.add(day, "USD", rate)
+        day += datetime.timedelta(days=1)
+    return rates
+
+def write_rates(path, since=datetime.date(2022, 1, 1), until=datetime.date(2024, 12, 31), rate="1.1000"):
+    """ BSI rate XML (dtecbs-l.xml layout) with the same USD rate on every day; returns its filename """
+    with open(str(path), "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<DtecBS xmlns="http://www.bsi.si">\n')
+        day = since
+        while day <= until:
+            f.write('<tecajnica datum="{0}"><tecaj oznaka="USD" sifra="840">{1}</tecaj></tecajnica>\n'.format(day.isoformat(), rate))
+            day += datetime.timedelta(days=1)
+        f.write("</DtecBS>\n")
+    return str(path)
+
+def company_index():
+    return ee.CompanyIndex([
+        ee.CompanyInfo("AAPL", "US0378331005", "Apple Inc.", "One Apple Park Way, Cupertino, CA 95014", "US"),
+        ee.CompanyInfo("MSFT", "US5949181045", "Microsoft Corporation", "One Microsoft Way, Redmond, WA 98052", "US"),
+    ])
+
+def read_outputs(directory):
+    """ {filename: bytes} of the XML files in an output directory """
+    outputs = {}
+    for name in sorted(os.listdir(str(directory))):
+        if name.endswith(".xml"):
+            with open(os.path.join(str(directory), name), "rb") as f:
+                outputs[name] = f.read()
+    return outputs
@@ -0,0 +1,42 @@
+""" Exchange rate store (bsrate.bin) loaded from a first day on and extended once the statements need earlier days """
+
+import datetime
+import os
+
+import pytest
+
+from helpers import TAXPAYER, activity, company_index, ee, position, read_outputs, write_rates, write_statement
+
+def load(tmp_path, since):
+    source = write_rates(tmp_path / "rates.xml", since=datetime.date(2019, 1, 1))
+    return ee.load_exchange_rates(source, str(tmp_path / "bsrate.bin"), since=since)
+
+def old_position_statement(tmp_path):
+    return write_statement(tmp_path / "statement.xlsx", [position(1001, "15/03/2023 10:00:00", openDate="02/07/2020 10:00:00")],
+                           [activity(1001, "02/07/2020 10:00:00")])
+
+def test_lookup_before_the_loaded_range_does_not_read_the_source(tmp_path):
+    rates = load(tmp_path, datetime.date(2022, 1, 1))
+    assert rates.rate("USD", datetime.date(2022, 1, 1)) == 1.1
+    os.remove(str(tmp_path / "rates.xml"))
+    with pytest.raises(ee.ExchangeRateError, match="no USD exchange rate"):
+        rates.rate("USD", datetime.date(2020, 7, 2))
+
+def test_store_is_extended_to_the_earliest_open_date(tmp_path):
+    rates = load(tmp_path, datetime.date(2022, 1, 1))
+    failedOutputs, missing_info = ee.convert([old_position_statement(tmp_path)], [2023], TAXPAYER, rates, company_index(),
+                                             str(tmp_path / "output"), controlFiles="none")
+    assert failedOutputs == []
+    assert b"<F1>2020-07-02</F1>" in read_outputs(tmp_path / "output")["Doh-KDVP.xml"]
+    assert rates.since == datetime.date(2020, 1, 1)
+
+    stored = ee.ExchangeRateTable.load(str(tmp_path / "bsrate.bin"))
+    assert stored.since == datetime.date(2020, 1, 1)
+    assert stored.rate("USD", datetime.date(2020, 1, 1)) == 1.1
+
+def test_source_that_can_not_be_read_is_reported(tmp_path):
+    rates = load(tmp_path, datetime.date(2022, 1, 1))
+    os.remove(str(tmp_path / "rates.xml"))
+    with pytest.raises(ee.ExchangeRateError, match="Could not load exchange rates before 2022-01-01"):
+        ee.convert([old_position_statement(tmp_path)], [2023], TAXPAYER, rates, company_index(), str(tmp_path / "output"),
+                   controlFiles="none")
@@ -0,0 +1,58 @@
+""" Same-day dividends of a company merged into one entry (merge_dividends) """
+
+import copy
+import datetime
+
+from helpers import ee
+
+def nested_loop_merge(dividends):
+    """ merge_dividends before the hash index: every dividend compared with every merged entry """
+    mergedDividends = []
+    for dividend in dividends:
+        merged = False
+        for mergedDividend in mergedDividends:
+            if dividend["date"].date() == mergedDividend["date"].date() and dividend["symbol"] == mergedDividend["symbol"] \
+                    and mergedDividend["gross_amount_eur"] >= 0 and dividend["gross_amount_eur"] >= 0:
+                mergedDividend["netto_amount_eur"] = mergedDividend["netto_amount_eur"] + dividend["netto_amount_eur"]
+                mergedDividend["gross_amount_eur"] = mergedDividend["gross_amount_eur"] + dividend["gross_amount_eur"]
+                mergedDividend["withholding_tax_amount"] = mergedDividend["withholding_tax_amount"] + dividend["withholding_tax_amount"]
+                if "positions" in mergedDividend:
+                    mergedDividend["positions"].append(dividend["position_id"])
+                else:
+                    mergedDividend["positions"] = [mergedDividend["position_id"], dividend["position_id"]]
+                merged = True
+                break
+        if not merged:
+            mergedDividends.append(dividend)
+    return mergedDividends
+
+def paid(position_id, symbol, day, gross, hour=0):
+    return {"position_id": position_id, "symbol": symbol, "date": datetime.datetime(2023, 5, day, hour),
+            "netto_amount_eur": gross * 0.85, "gross_amount_eur": gross, "withholding_tax_amount": gross * 0.15}
+
+def test_same_as_nested_loop_on_colliding_keys():
+    dividends = [
+        paid(1, "AAPL", 10, 1.0),
+        paid(2, "MSFT", 10, 2.0),
+        paid(3, "AAPL", 10, 0.5, hour=14),  # same day, other time
+        paid(4, "AAPL", 10, -0.3),  # correction, never merged
+        paid(5, "AAPL", 10, 0.25),
+        paid(6, "AAPL", 11, 1.0),
+        paid(7, None, 10, 0.1),  # symbol unknown
+        paid(8, None, 10, 0.2),
+        paid(9, "MSFT", 10, -0.4),
+        paid(10, "AAPL", 10, -0.1),
+        paid(11, "MSFT", 10, 0.0),
+    ]
+    expected = nested_loop_merge(copy.deepcopy(dividends))
+    merged = ee.merge_dividends(copy.deepcopy(dividends))
+    assert merged == expected
+    assert [dividend["position_id"] for dividend in merged] == [1, 2, 4, 6, 7, 9, 10]
+    assert merged[0]["positions"] == [1, 3, 5]
+    assert merged[0]["gross_amount_eur"] == 1.75
+
+def test_negative_first_entry_is_not_a_merge_target():
+    dividends = [paid(1, "AAPL", 10, -1.0), paid(2, "AAPL", 10, 1.0), paid(3, "AAPL", 10, 2.0)]
+    merged = ee.merge_dividends(copy.deepcopy(dividends))
+    assert merged == nested_loop_merge(copy.deepcopy(dividends))
+    assert [dividend.get("positions") for dividend in merged] == [None, [2, 3]]
@@ -0,0 +1,68 @@
+""" Overlapping statements merged into one (merge_sheets with the natural keys of MERGE_KEYS) """
+
+import datetime
+
+from helpers import TAXPAYER, activity, company_index, dividend, ee, position, rate_table, read_outputs, write_statement
+
+def closed(position_id, day):
+    return ee.ClosedPositionRow(position_id, "Buy Apple", "Long", 100.0, 1.0, datetime.datetime(2023, 1, 2, 10),
+                                datetime.datetime(2023, 3, day, 10), 1, 5.0, "Stocks")
+
+def paid(position_id, day, net=0.85):
+    return ee.DividendRow(datetime.datetime(2023, 5, day), "Apple", net, 15.0, 0.15, position_id, "US0378331005")
+
+def merge(*statements):
+    merged = ee.merge_statements(ee.Statements(
+        trades=[statement.get("trades", []) for statement in statements],
+        transactions=[statement.get("transactions", []) for statement in statements],
+        dividends=[statement.get("dividends", []) for statement in statements],
+    ))
+    return {field: list(getattr(merged, field)[0]) for field in ee.MERGE_KEYS}
+
+def test_row_in_both_statements_is_kept_once():
+    older = {"trades": [closed(1, 1), closed(2, 5)], "transactions": [ee.AccountActivityRow("AAPL/USD", 1)],
+             "dividends": [paid(1, 10), paid(1, 20)]}
+    newer = {"trades": [closed(2, 5), closed(3, 9)], "transactions": [ee.AccountActivityRow("AAPL/USD", 1),
+                                                                      ee.AccountActivityRow("AAPL/USD", 3)],
+             "dividends": [paid(1, 20), paid(3, 25)]}
+    merged = merge(older, newer)
+    assert merged["trades"] == [closed(1, 1), closed(2, 5), closed(3, 9)]
+    assert merged["transactions"] == [ee.AccountActivityRow("AAPL/USD", 1), ee.AccountActivityRow("AAPL/USD", 3)]
+    assert merged["dividends"] == [paid(1, 10), paid(1, 20), paid(3, 25)]
+
+def test_row_repeated_within_a_statement_is_kept_as_often():
+    # two real dividends of the same position, day and amount
+    older = {"dividends": [paid(1, 10), paid(1, 10)]}
+    newer = {"dividends": [paid(1, 10), paid(1, 10), paid(1, 10), paid(2, 12)]}
+    assert merge(older, newer)["dividends"] == [paid(1, 10)] * 3 + [paid(2, 12)]
+    assert merge(newer, older)["dividends"] == [paid(1, 10)] * 3 + [paid(2, 12)]
+    assert merge(older, {"dividends": [paid(1, 10)]})["dividends"] == [paid(1, 10)] * 2
+
+def test_statements_out_of_date_order():
+    older = {"trades": [closed(1, 1), closed(2, 5)], "dividends": [paid(1, 10), paid(2, 20)]}
+    newer = {"trades": [closed(2, 5), closed(3, 9)], "dividends": [paid(2, 20), paid(3, 25)]}
+    merged = merge(newer, older)
+    assert merged["trades"] == [closed(1, 1), closed(2, 5), closed(3, 9)]
+    assert merged["dividends"] == [paid(1, 10), paid(2, 20), paid(3, 25)]
+
+    # a sheet that is not sorted by date loses no rows and reports none twice
+    unsorted = {"trades": [closed(3, 9), closed(1, 1), closed(2, 5)]}
+    assert sorted(merge(unsorted, older)["trades"]) == [closed(1, 1), closed(2, 5), closed(3, 9)]
+
+def test_overlapping_statement_files(tmp_path):
+    positions = [position(1001, "15/03/2023 10:00:00"), position(1002, "15/06/2023 10:00:00"),
+                 position(1003, "15/09/2023 10:00:00")]
+    activities = [activity(1001), activity(1002), activity(1003)]
+    dividends = [dividend(1001, "15/05/2023 00:00:00"), dividend(1001, "15/08/2023 00:00:00"),
+                 dividend(1001, "15/11/2023 00:00:00")]
+    whole = write_statement(tmp_path / "whole.xlsx", positions, activities, dividends)
+    first = write_statement(tmp_path / "first.xlsx", positions[:2], activities[:2], dividends[:2])
+    second = write_statement(tmp_path / "second.xlsx", positions[1:], activities[1:], dividends[1:])
+
+    outputs = []
+    for name, filenames in (("whole", [whole]), ("parts", [second, first])):
+        failedOutputs, missing_info = ee.convert(filenames, [2023], TAXPAYER, rate_table(), company_index(),
+                                                 str(tmp_path / name), controlFiles="none")
+        assert failedOutputs == []
+        outputs.append(read_outputs(tmp_path / name))
+    assert outputs[0] == outputs[1]
@@ -0,0 +1,74 @@
+""" Normalized positions and dividends saved with --save-normalized and read back with --from-normalized (EDNC file) """
+
+import struct
+
+import pytest
+
+from helpers import activity, company_index, dividend, ee, position, rate_table, write_statement
+
+def normalize(tmp_path):
+    filename = write_statement(
+        tmp_path / "statement.xlsx",
+        [
+            position(1001, "15/03/2023 10:00:00"),
+            position(1002, "20/06/2023 11:00:00", openDate="05/05/2023 09:30:00", name="Tesla", type="CFD", leverage="2"),
+            position(1003, "01/09/2024 15:00:00", openDate="01/08/2023 15:00:00", name="Microsoft", longShort="Short"),
+        ],
+        [activity(1001), activity(1002, "05/05/2023 09:30:00", "TSLA"), activity(1003, "01/08/2023 15:00:00", "MSFT")],
+        [
+            dividend(1001, "15/05/2023 00:00:00"),
+            dividend(1004, "15/05/2023 00:00:00"),  # same payment for two positions, merged
+            dividend(1002, "15/08/2023 00:00:00", "Tesla", isin=""),  # unknown company, missing info
+            dividend(1003, "15/08/2024 00:00:00", "Microsoft", "1.70", "0.30", "US5949181045"),
+        ],
+    )
+    statements = ee.load_statements([filename])
+    return ee.normalize_statements(statements, [2023, 2024], rate_table(), company_index())
+
+def fields(position):
+    return tuple(getattr(position, field) for field, dtype in ee.NORMALIZED_POSITION_COLUMNS)
+
+def write(tmp_path, normalized):
+    filename = str(tmp_path / "normalized.ednc")
+    ee.write_normalized_file(filename, normalized, [2023, 2024])
+    return filename
+
+def test_round_trip(tmp_path):
+    normalized = normalize(tmp_path)
+    assert any("positions" in dividend for dividend in normalized.dividends)
+    assert normalized.missing_info
+    filename = write(tmp_path, normalized)
+
+    read, years = ee.read_normalized_file(filename)
+    assert years == [2023, 2024]
+    assert [fields(position) for position in read.positions] == [fields(position) for position in normalized.positions]
+    assert read.dividends == normalized.dividends
+    assert read.missing_info == normalized.missing_info
+
+def test_years_are_selected_while_reading(tmp_path):
+    normalized = normalize(tmp_path)
+    read, years = ee.read_normalized_file(write(tmp_path, normalized), [2024])
+    assert years == [2024]
+    assert [position.position_id for position in read.positions] == [1003]
+    assert read.dividends == [dividend for dividend in normalized.dividends if dividend["date"].year == 2024]
+
+    with pytest.raises(ValueError, match="2022"):
+        ee.read_normalized_file(write(tmp_path, normalized), [2022, 2023])
+
+def test_other_version_is_rejected(tmp_path):
+    filename = write(tmp_path, normalize(tmp_path))
+    with open(filename, "r+b") as f:
+        f.seek(len(ee.NORMALIZED_FILE_MAGIC))
+        f.write(struct.pack("<I", ee.NORMALIZED_FILE_VERSION + 1))
+    with pytest.raises(ValueError, match="verzija"):
+        ee.read_normalized_file(filename)
+
+def test_truncated_file_is_rejected(tmp_path):
+    filename = write(tmp_path, normalize(tmp_path))
+    with open(filename, "rb") as f:
+        data = f.read()
+    for length in (0, 3, 10, 40, len(data) - 8, len(data) - 1):
+        with open(filename, "wb") as f:
+            f.write(data[:length])
+        with pytest.raises(ValueError):
+            ee.read_normalized_file(filename)
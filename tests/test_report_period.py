@@ -0,0 +1,55 @@
+""" Report years pushed down into the sheet readers (-y): rows of other years are skipped while reading,
+    but no row of a report year may be lost when a sheet is not sorted by date. """
+
+import os
+import sys
+
+from openpyxl import Workbook
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import etoro_edavki as ee
+
+CLOSED_POSITIONS_HEADER = ["Position ID", "Action", "Long / Short", "Amount", "Units / Contracts", "Open Date", "Close Date",
+                           "Leverage", "Profit(USD)", "Type"]
+
+def write_statement(path, closeDates, activityDates=()):
+    wb = Workbook()
+    wb.remove(wb.active)
+    sh = wb.create_sheet("Closed Positions")
+    sh.append(CLOSED_POSITIONS_HEADER)
+    for index, closeDate in enumerate(closeDates):
+        sh.append([str(1000 + index), "Buy Apple", "Long", "100.00", "1.000000", "02/01/2023 10:00:00", closeDate, "1", "5.00", "Stocks"])
+    sh = wb.create_sheet("Account Activity")
+    sh.append(["Date", "Type", "Details", "Amount", "Position ID"])
+    for index, date in enumerate(activityDates):
+        sh.append([date, "Open Position", "AAPL/USD", "100.00", str(2000 + index)])
+    sh = wb.create_sheet("Dividends")
+    sh.append(["Date of Payment", "Instrument Name", "Net Dividend Received (USD)", "Withholding Tax Rate (%)",
+               "Withholding Tax Amount (USD)", "Position ID"])
+    wb.save(path)
+    return str(path)
+
+def test_unsorted_closed_positions_are_read_in_full(tmp_path):
+    filename = write_statement(tmp_path / "statement.xlsx", ["15/03/2024 10:00:00", "15/05/2024 10:00:00", "15/06/2023 10:00:00"])
+    rows = list(ee.EToroStatement(filename, years=[2023]).closed_positions())
+    assert [row.position_id for row in rows] == [1002]
+
+def test_rows_of_other_years_are_skipped(tmp_path):
+    filename = write_statement(tmp_path / "statement.xlsx", ["15/06/2023 10:00:00", "15/03/2024 10:00:00", "16/06/2023 10:00:00"])
+    rows = list(ee.EToroStatement(filename, years=[2024]).closed_positions())
+    assert [row.position_id for row in rows] == [1001]
+
+def test_account_activity_out_of_date_order_is_read_in_full(tmp_path):
+    filename = write_statement(tmp_path / "statement.xlsx", [], ["01/02/2022 10:00:00", "01/02/2023 10:00:00",
+                                                                 "01/02/2024 10:00:00", "01/03/2023 10:00:00"])
+    rows = list(ee.EToroStatement(filename, years=[2023]).transactions())
+    assert [row.position_id for row in rows] == [2000, 2001, 2002, 2003]
+
+def test_account_activity_stops_well_after_the_period(tmp_path, monkeypatch):
+    monkeypatch.setattr(ee, "PERIOD_STOP_ROWS", 2)
+    filename = write_statement(tmp_path / "statement.xlsx", [], ["01/02/2023 10:00:00", "01/02/2024 10:00:00",
+                                                                 "01/03/2024 10:00:00", "01/04/2024 10:00:00",
+                                                                 "01/05/2024 10:00:00"])
+    rows = list(ee.EToroStatement(filename, years=[2023]).transactions())
+    assert [row.position_id for row in rows] == [2000, 2001, 2002]
@@ -0,0 +1,64 @@
+""" Conversion server (--serve): uploads converted on the worker pool and returned as a zip """
+
+import io
+import os
+import threading
+import urllib.error
+import urllib.request
+import zipfile
+
+import pytest
+
+from helpers import ee, sample_statement, write_rates
+
+COMPANY_INFO = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "Company_info.xlsx")
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # bsrate.bin
+    service = ee.ConversionService(write_rates(tmp_path / "rates.xml"), companyFilename=COMPANY_INFO)
+    server = ee.http.server.ThreadingHTTPServer(("127.0.0.1", 0), ee.ConversionRequestHandler)
+    server.service = service
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield "http://127.0.0.1:{0}".format(server.server_address[1])
+    server.shutdown()
+    server.server_close()
+    service.shutdown()
+
+def post(url, body):
+    request = urllib.request.Request(url, data=body, method="POST")
+    try:
+        with urllib.request.urlopen(request) as response:
+            return response.status, response.read()
+    except urllib.error.HTTPError as e:
+        with e:
+            return e.code, e.read()
+
+def test_statement_is_converted(server, tmp_path):
+    with open(sample_statement(tmp_path / "statement.xlsx"), "rb") as f:
+        statement = f.read()
+    status, body = post(server + "/convert?taxNumber=12345678&year=2023", statement)
+    assert status == 200
+    with zipfile.ZipFile(io.BytesIO(body)) as archive:
+        members = archive.namelist()
+        kdvp = archive.read("Doh-KDVP.xml")
+    assert sorted(members) == ["D-IFI.xml", "Debug-2023.xlsx", "Dividende-info-2023.xlsx", "Doh-Div.xml", "Doh-KDVP.xml", "convert.log"]
+    assert b"<edp:taxNumber>12345678</edp:taxNumber>" in kdvp
+
+def test_invalid_requests(server):
+    status, body = post(server + "/convert?year=2023", b"PK")
+    assert status == 400
+    assert "taxNumber" in body.decode("utf-8")
+
+    status, body = post(server + "/convert?taxNumber=12345678&year=20x3", b"PK")
+    assert status == 400
+
+    status, body = post(server + "/convert?taxNumber=12345678&year=2023", b"not an eToro statement")
+    assert status == 422
+    message = body.decode("utf-8").splitlines()[0]
+    assert message.startswith("BadZipFile")
+    assert message.endswith("(glej output/convert.log)")  # no paths of the temporary directory
+
+    with urllib.request.urlopen(server + "/health") as response:
+        assert response.status == 200
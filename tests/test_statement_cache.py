@@ -0,0 +1,84 @@
+""" Decoded statement rows cached by content hash (StatementCache) """
+
+import os
+import shutil
+
+from helpers import TAXPAYER, company_index, ee, rate_table, read_outputs, sample_statement
+
+def convert(filenames, outputDirectory, cache):
+    failedOutputs, missing_info = ee.convert(filenames, [2023], TAXPAYER, rate_table(), company_index(), str(outputDirectory),
+                                             statementCache=cache, controlFiles="none")
+    assert failedOutputs == []
+    return read_outputs(outputDirectory)
+
+def test_same_statement_twice_through_a_cold_cache(tmp_path):
+    filename = sample_statement(tmp_path / "statement.xlsx")
+    copy = str(tmp_path / "copy.xlsx")
+    shutil.copyfile(filename, copy)
+    expected = convert([filename], tmp_path / "single", None)
+
+    assert convert([filename, filename], tmp_path / "same", ee.StatementCache(str(tmp_path / "cache1"))) == expected
+    assert convert([filename, copy], tmp_path / "copy", ee.StatementCache(str(tmp_path / "cache2"))) == expected
+    assert convert([filename, copy], tmp_path / "warm", ee.StatementCache(str(tmp_path / "cache2"))) == expected
+
+ROWS = [ee.AccountActivityRow("AAPL/USD", 1001), ee.AccountActivityRow("MSFT/USD", 1002)]
+
+def unread():
+    raise AssertionError("the statement was read although the rows are cached")
+    yield
+
+def cache_files(cache):
+    return sorted(entry.name for entry in cache.entries())
+
+def test_miss_stores_rows_and_hit_reads_them(tmp_path):
+    cache = ee.StatementCache(str(tmp_path / "cache"))
+    assert list(cache.rows("key-v1", "AccountActivity", ee.AccountActivityRow, iter(ROWS))) == ROWS
+    assert cache_files(cache) == ["key-v1-AccountActivity.pickle"]
+    assert list(cache.rows("key-v1", "AccountActivity", ee.AccountActivityRow, unread())) == ROWS
+    assert not [name for name in (tmp_path / "cache").iterdir() if name.suffix == ".tmp"]
+
+def test_partially_read_sheet_is_not_stored(tmp_path):
+    cache = ee.StatementCache(str(tmp_path / "cache"))
+    rows = cache.rows("key-v1", "AccountActivity", ee.AccountActivityRow, iter(ROWS))
+    next(rows)
+    rows.close()
+    assert list((tmp_path / "cache").iterdir()) == []
+
+def test_schema_bump_misses(tmp_path, monkeypatch):
+    filename = sample_statement(tmp_path / "statement.xlsx")
+    cache = ee.StatementCache(str(tmp_path / "cache"))
+    key = cache.key(filename)
+    list(cache.rows(key, "AccountActivity", ee.AccountActivityRow, iter(ROWS)))
+
+    monkeypatch.setattr(ee, "STATEMENT_CACHE_SCHEMA", ee.STATEMENT_CACHE_SCHEMA + 1)
+    newKey = cache.key(filename)
+    assert newKey != key
+    assert list(cache.rows(newKey, "AccountActivity", ee.AccountActivityRow, iter(ROWS[:1]))) == ROWS[:1]
+
+def test_eviction_removes_least_recently_used(tmp_path):
+    cache = ee.StatementCache(str(tmp_path / "cache"))
+    for age, key in enumerate(("old", "used", "new")):
+        list(cache.rows(key, "AccountActivity", ee.AccountActivityRow, iter(ROWS)))
+        os.utime(os.path.join(cache.directory, key + "-AccountActivity.pickle"), (1000 + age, 1000 + age))
+    list(cache.rows("old", "AccountActivity", ee.AccountActivityRow, unread()))  # a hit makes "old" the most recent
+
+    size = os.path.getsize(os.path.join(cache.directory, "new-AccountActivity.pickle"))
+    cache.max_size = 2 * size
+    cache.evict()
+    assert cache_files(cache) == ["new-AccountActivity.pickle", "old-AccountActivity.pickle"]
+
+def test_eviction_skips_entries_that_can_not_be_removed(tmp_path, monkeypatch):
+    cache = ee.StatementCache(str(tmp_path / "cache"))
+    for key in ("a", "b"):
+        list(cache.rows(key, "AccountActivity", ee.AccountActivityRow, iter(ROWS)))
+    remove = os.remove
+
+    def locked(path):
+        if path.endswith("a-AccountActivity.pickle"):
+            raise PermissionError(13, "The process cannot access the file because it is being used by another process", path)
+        remove(path)
+
+    monkeypatch.setattr(os, "remove", locked)
+    cache.max_size = 0
+    cache.evict()
+    assert cache_files(cache) == ["a-AccountActivity.pickle"]
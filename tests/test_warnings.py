@@ -0,0 +1,38 @@
+""" Warnings of the stages are ConversionWarning (warnings.warn), not prints; the command line prints them (show_warning) """
+
+import datetime
+import io
+import warnings
+
+import pytest
+
+from helpers import ee, write_rates
+
+def test_refresh_failure_warns(tmp_path, monkeypatch):
+    source = write_rates(tmp_path / "rates.xml")
+    store = str(tmp_path / "bsrate.bin")
+    rates = ee.load_exchange_rates(source, store)
+    rates.refreshed = datetime.date(2024, 1, 1)
+    rates.save(store)
+
+    def offline(source):
+        raise OSError("offline")
+
+    monkeypatch.setattr(ee, "open_rate_source", offline)
+    with pytest.warns(ee.ConversionWarning, match="offline"):
+        rates = ee.load_exchange_rates(source, store)
+    assert rates.rate("USD", datetime.date(2024, 12, 31)) == 1.1
+
+def test_trade_without_units_warns():
+    position = ee.Position(1001, "AAPL", "Apple", "long", "Stocks", "normal", 1, 0.0, datetime.datetime(2023, 1, 2),
+                           datetime.datetime(2023, 3, 15), 100.0, 105.0)
+    w = ee.XmlStreamWriter(io.StringIO())
+    with pytest.warns(ee.ConversionWarning, match="units == 0"):
+        ee.write_kdvp_long_item(w, [position.open, position.close])
+
+def test_command_line_prints_conversion_warnings(capsys, monkeypatch):
+    monkeypatch.setattr(warnings, "showwarning", ee.show_warning)
+    with warnings.catch_warnings():
+        warnings.simplefilter("always")
+        warnings.warn("!!! POZOR: preveri", ee.ConversionWarning)
+    assert capsys.readouterr().out == "!!! POZOR: preveri\n"
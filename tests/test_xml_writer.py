@@ -0,0 +1,71 @@
+""" XmlStreamWriter output is byte for byte what the minidom based writers produced (toprettyxml(indent="\t")) """
+
+from xml.dom import minidom
+
+from helpers import TAXPAYER, activity, dividend, ee, position, rate_table, read_outputs, write_statement
+
+NAME = 'Procter & "Gamble" <PG>'
+ADDRESS = "One Apple Park Way\r\nCupertino, CA 95014"
+
+def strip_layout(node):
+    """ Removes the whitespace between elements that toprettyxml adds """
+    for child in list(node.childNodes):
+        if child.nodeType == child.TEXT_NODE and not child.data.strip():
+            node.removeChild(child)
+        else:
+            strip_layout(child)
+    return node
+
+def minidom_pretty(data):
+    """ The output as the minidom based writers printed the same tree """
+    return strip_layout(minidom.parseString(data)).toprettyxml(indent="\t").encode("utf-8")
+
+def texts(data, tag):
+    return [element.firstChild.data for element in minidom.parseString(data).getElementsByTagName(tag)]
+
+def test_outputs_match_minidom(tmp_path):
+    filename = write_statement(
+        tmp_path / "statement.xlsx",
+        [
+            position(1001, "15/03/2023 10:00:00", name=NAME),
+            position(1002, "20/06/2023 11:00:00", openDate="05/05/2023 09:30:00", name=NAME, type="CFD", leverage="2"),
+            position(1003, "01/09/2023 15:00:00", openDate="01/08/2023 15:00:00", name=NAME, longShort="Short"),
+            position(1004, "02/09/2023 15:00:00", openDate="01/08/2023 15:00:00", name="Tesla", type="CFD", longShort="Short"),
+        ],
+        [activity(1001, symbol="PG"), activity(1002, "05/05/2023 09:30:00", "PG"), activity(1003, "01/08/2023 15:00:00", "PG"),
+         activity(1004, "01/08/2023 15:00:00", "TSLA")],
+        [dividend(1001, "15/05/2023 00:00:00", NAME), dividend(1001, "15/08/2023 00:00:00", NAME, isin="")],
+    )
+    companies = ee.CompanyIndex([ee.CompanyInfo("PG", "US0378331005", NAME, ADDRESS, "US")])
+    failedOutputs, missing_info = ee.convert([filename], [2023], TAXPAYER, rate_table(), companies, str(tmp_path / "output"),
+                                             controlFiles="none")
+    assert failedOutputs == []
+    outputs = read_outputs(tmp_path / "output")
+    assert sorted(outputs) == ["D-IFI.xml", "Doh-Div.xml", "Doh-KDVP.xml"]
+
+    for name, data in outputs.items():
+        assert data == minidom_pretty(data), name
+    assert texts(outputs["Doh-KDVP.xml"], "Name") == [NAME] * 4
+    assert NAME in texts(outputs["D-IFI.xml"], "Name")
+    assert texts(outputs["Doh-Div.xml"], "PayerName") == [NAME, NAME]
+    assert texts(outputs["Doh-Div.xml"], "PayerAddress")[0] == ADDRESS.replace("\r\n", "\n")
+    assert b"<ReliefStatement/>" in outputs["Doh-Div.xml"]
+
+def test_escaping_and_empty_elements(tmp_path):
+    path = tmp_path / "out.xml"
+    with open(str(path), "w", encoding="utf-8") as f:
+        w = ee.XmlStreamWriter(f)
+        w.start("Envelope", (("xmlns", "http://example.com/a?b=1&c=\"2\""),))
+        w.element("Name", NAME)
+        w.element("Address", "line 1\r\nline 2\rline 3\n")
+        w.element("Empty", "")
+        w.start("List")
+        w.end()
+        w.start("Item")
+        w.element("Value", "> 0 & < 1")
+        w.end()
+        w.end()
+    data = path.read_bytes()
+    assert data == minidom_pretty(data)
+    assert texts(data, "Name") == [NAME]
+    assert texts(data, "Address") == ["line 1\nline 2\nline 3\n"]